@@ -4,12 +4,36 @@ app.py
 ステップ4：Groq追加・3種類のセリフをGroqで生成
 """
 
+import functools
+import hmac
 import json
 import random
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 import chromadb
-from chromadb.utils import embedding_functions
+import numpy as np
 import streamlit as st
 from groq import Groq
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+import canonical
+import catalog_compiler
+import llm_models
+import llm_scheduler
+import data_pack
+import embedding_store
+import ingredient_index
+import local_normalizer
+import recipe_retriever
+from embedding import EMBED_MODEL, get_embedding_function
+import metrics
+import response_cache
+from recipe_store import (
+    apply_search_ef, create_recipe_store, hnsw_matches, hnsw_metadata, ingest_recipes, open_recipe_store,
+)
 
 # ────────────────────────────
 # ページ設定
@@ -116,6 +140,29 @@ def apply_styles():
         font-size: 1.4rem;
     }}
 
+    /* ── タイピング表示（CSSアニメーションだけで動かす・iframeなし） ── */
+    .yuru-typing {{
+        font-size: 1rem;
+        color: #5c3d0e;
+        line-height: 1.7;
+        white-space: pre-wrap;
+        word-break: break-all;
+        min-height: 1.5em;
+    }}
+    .yuru-typing .yuru-type {{
+        opacity: 0;
+        animation: yuru-type-in 0.12s linear forwards;
+    }}
+    @keyframes yuru-type-in {{
+        to {{ opacity: 1; }}
+    }}
+    @media (prefers-reduced-motion: reduce) {{
+        .yuru-typing .yuru-type {{
+            opacity: 1;
+            animation: none;
+        }}
+    }}
+
     /* ── セクション見出し ── */
     .yuru-section-label {{
         font-size: 0.78rem;
@@ -329,44 +376,98 @@ def section_label(text: str):
 # panel_open / panel_close は廃止。各画面で with st.container(border=True): を使う。
 
 
-def typing_animation(text: str, speed_ms: int = 30):
-    """タイピングアニメーションでテキストを表示する（JavaScript）"""
-    safe_text = text.replace("\\", "\\\\").replace("`", "\\`").replace("$", "\\$")
-    uid = f"typing_{random.randint(10000, 99999)}"
-    st.components.v1.html(f"""
-    <div id="{uid}" style="
-        font-size: 1rem;
-        color: #5c3d0e;
-        line-height: 1.7;
-        white-space: pre-wrap;
-        word-break: break-all;
-        min-height: 1.5em;
-        font-family: inherit;
-    "></div>
-    <script>
-    (function() {{
-        const el = document.getElementById('{uid}');
-        const text = `{safe_text}`;
-        let i = 0;
-        function type() {{
-            if (i < text.length) {{
-                el.textContent += text[i++];
-                setTimeout(type, {speed_ms});
-            }}
-        }}
-        type();
-    }})();
-    </script>
-    """, height=80)
+# 句読点・改行ごとに1つの<span>にして、文字数に応じた遅延で順番に表示する
+_TYPING_SEGMENT_PATTERN = re.compile(r"[^、。！？!?\n]*[、。！？!?\n]?")
+
+
+def _escape_html(text: str) -> str:
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;").replace("\n", "<br>")
+
+
+def _typing_html(text: str, speed_ms: int, static_chars: int = 0) -> str:
+    """
+    タイピング表示用のHTMLを作る。
+    先頭 static_chars 文字は表示済みとしてアニメーションなしで出す（ストリーミング用）。
+    """
+    parts = []
+    if static_chars:
+        parts.append(_escape_html(text[:static_chars]))
+    delay = 0
+    for segment in _TYPING_SEGMENT_PATTERN.findall(text[static_chars:]):
+        if not segment:
+            continue
+        parts.append(
+            f'<span class="yuru-type" style="animation-delay:{delay}ms">{_escape_html(segment)}</span>'
+        )
+        delay += len(segment) * speed_ms
+    return f'<div class="yuru-typing">{"".join(parts)}</div>'
+
+
+def typing_animation(text, speed_ms: int = 30) -> str:
+    """
+    タイピングアニメーションでテキストを表示する（CSSアニメーション）。
+    text: 文字列、またはストリーミングで届く文字列片のイテラブル
+    戻り値: 表示した全文
+    """
+    if isinstance(text, str):
+        st.markdown(_typing_html(text, speed_ms), unsafe_allow_html=True)
+        return text
+
+    # ストリーミング：届いた分だけ追記し、表示済みの部分はアニメーションし直さない
+    placeholder = st.empty()
+    shown = ""
+    for chunk in text:
+        if not chunk:
+            continue
+        revealed = len(shown)
+        shown += chunk
+        placeholder.markdown(_typing_html(shown, speed_ms, revealed), unsafe_allow_html=True)
+    return shown
 
 
 # ────────────────────────────
 # 定数
 # ────────────────────────────
 CHROMA_DIR = "./chroma_db"
-RECIPE_COLLECTION = "recipes"
 INGREDIENT_COLLECTION = "ingredients"
-EMBED_MODEL = "paraphrase-multilingual-mpnet-base-v2"
+
+# 全料理一致率スコアリング
+MATCH_RATE_CANDIDATES = 10         # 一致率上位から候補に加える件数
+MATCH_RATE_WEIGHT = 3.0            # 食材一致率（0〜1）をカテゴリ一致数に足すときの重み
+MATCH_RATE_DEFAULT_DISTANCE = 1.0  # ベクトル検索に出てこなかった料理の仮の距離
+
+# セッション状態
+LAST_RECIPES_MAX = 10                # 「直近に提案した料理」の履歴の上限
+SESSION_ACCOUNTING_TTL_SEC = 3600    # この秒数動きのないセッションはメモリ集計から外す
+
+# Groqのレート制限（プランに合わせて secrets.toml で上書きできる）
+GROQ_REQUESTS_PER_MINUTE = 30
+GROQ_TOKENS_PER_MINUTE = 12000
+GROQ_MAX_CONCURRENCY = 4
+GROQ_MAX_QUEUE = 50
+
+# ヘッジ（secrets.toml に GROQ_HEDGE = true を書いたときだけ有効）
+GROQ_HEDGE_DEFAULT_AFTER_MS = 3000   # まだレイテンシの実績がないときにもう1本出すまでの時間
+GROQ_HEDGE_MIN_AFTER_MS = 500        # p95がこれより短くても、これ以上は待つ
+
+# 画面ごとのLLMの締め切り（秒）。過ぎたらテンプレートのセリフで先に画面を出す
+LLM_DEADLINE_SEC = {
+    "normalize": 5.0,   # 食材解析（間に合わなければローカルの正規化で検索する）
+    "cooking": 4.0,     # 調理手順
+    "farewell": 2.5,    # お見送り
+}
+LLM_LATE_GRACE_SEC = 10.0   # テンプレートを出したあと、遅れて届く結果を待つ時間
+LLM_LATE_POLL_SEC = 0.5     # 遅れて届く結果を確認する間隔
+LLM_DEADLINE_WORKERS = 16
+
+# 調理手順セリフのキャッシュ（料理×食材の置き換え×言及する食材 ごとに数パターン貯める）
+STEPS_CACHE_PATH = "./cache/llm_cache.sqlite"
+STEPS_CACHE_MAX_KEYS = 500          # メモリに置くキー数
+STEPS_CACHE_VARIANTS = 3            # 1キーあたりのパターン数（揃うまではGroqで生成する）
+STEPS_PROMPT_VERSION = 1            # プロンプトを変えたら上げる（古いキャッシュを使わないように）
+
+# 事前生成したお見送りセリフ（pregen_farewells.py）
+FAREWELL_DB_PATH = "./data/farewell_db.json"
 
 # 一致率による前置き
 MATCH_PREFIXES = {
@@ -413,68 +514,228 @@ def get_groq_client():
     return Groq(api_key=st.secrets["GROQ_API_KEY"])
 
 
+@st.cache_resource
+def get_llm_scheduler() -> llm_scheduler.LLMScheduler:
+    """Groq呼び出しをプロセス全体で順番待ちさせるスケジューラー（全セッションで共有）"""
+    return llm_scheduler.LLMScheduler(
+        requests_per_minute=st.secrets.get("GROQ_REQUESTS_PER_MINUTE", GROQ_REQUESTS_PER_MINUTE),
+        tokens_per_minute=st.secrets.get("GROQ_TOKENS_PER_MINUTE", GROQ_TOKENS_PER_MINUTE),
+        max_concurrency=GROQ_MAX_CONCURRENCY,
+        max_queue=GROQ_MAX_QUEUE,
+    )
+
+
+@st.cache_resource
+def get_task_models() -> dict:
+    """呼び出しの種類 → モデル名（secrets.toml の GROQ_MODEL_NORMALIZE などで上書きできる）"""
+    return {
+        task: st.secrets.get(f"GROQ_MODEL_{task.upper()}", model)
+        for task, model in llm_models.TASK_MODELS.items()
+    }
+
+
+def groq_chat(prompt: str, priority: int, max_tokens: int, temperature: float,
+              model: str = llm_models.MODEL_LARGE) -> str:
+    """
+    スケジューラー経由でGroqを呼び、返答の本文を返す。
+    混雑で捨てられたときは llm_scheduler.LLMShedError を投げる（呼び出し側でテンプレートに切り替える）
+    """
+    client = get_groq_client()
+    session_id = current_session_id()
+
+    def call():
+        return client.chat.completions.create(
+            model=model,
+            messages=[{"role": "user", "content": prompt}],
+            max_tokens=max_tokens,
+            temperature=temperature,
+        )
+
+    # 日本語は1文字≒1トークン以上になるので、文字数＋最大出力で多めに見積もる
+    est_tokens = len(prompt) + max_tokens
+    scheduler = get_llm_scheduler()
+    started = time.perf_counter()
+    if st.secrets.get("GROQ_HEDGE", False):
+        # このモデルの直近のp95を過ぎても返ってこなければ、もう1本出す
+        hedge_after_ms = max(
+            GROQ_HEDGE_MIN_AFTER_MS,
+            metrics.percentile(f"llm.latency_ms.{model}", 0.95, GROQ_HEDGE_DEFAULT_AFTER_MS),
+        )
+        response = scheduler.submit_hedged(
+            call, priority, session_id=session_id, est_tokens=est_tokens,
+            hedge_after_sec=hedge_after_ms / 1000,
+        )
+    else:
+        response = scheduler.submit(call, priority, session_id=session_id, est_tokens=est_tokens)
+    metrics.observe(f"llm.latency_ms.{model}", (time.perf_counter() - started) * 1000)
+    metrics.inc(f"llm.model.{model}")
+    return response.choices[0].message.content.strip()
+
+
 # ────────────────────────────
 # Groqセリフ生成（① 食材解析）
 # ────────────────────────────
 def groq_normalize_ingredients(user_input: str) -> tuple[list[str], str]:
     """
     ユーザーの入力テキストをGroqで解析し、正規化された食材リストとセリフを返す。
+    まず小さいモデルに聞き、JSONが読めない・結果の形があやしいときだけ大きいモデルに聞き直す（llm_models.py）。
     戻り値: (正規化食材リスト, セリフ文字列)
-    失敗時: ([], "") を返す
+    失敗時（どちらのモデルも読めるJSONを返さなかったときも）: ([], "groq_error") を返す
     """
+    models = get_task_models()
+    user_input = canonical.normalize_width(user_input)
+    variants = get_ingredient_variants()
+
+    def call_model(model: str, prompt: str) -> str:
+        return groq_chat(prompt, llm_scheduler.PRIORITY_NORMALIZE, max_tokens=300,
+                         temperature=0.7, model=model)
+
     try:
-        client = get_groq_client()
-        prompt = f"""あなたは食材を正規化する専門家です。
-ユーザーが入力した食材テキストを解析して、以下のJSON形式で返してください。
-
-入力テキスト：「{user_input}」
-
-ルール：
-- 表記ゆれを正規化する（例：たまご→卵、冷ごはん→ご飯、ネギ→ねぎ）
-- 修飾語を除去して食材名だけにする（例：残り物のハム→ハム）
-- 日本語の一般的な食材名に統一する
-- 食材ではないもの（調理法・量・状態など）は除外する
-- 料理名・メニュー名は食材に分解する（例：牛丼→牛肉・玉ねぎ・ご飯、から揚げ弁当→鶏肉・ご飯、ビッグマック→牛肉・パン・チーズ・野菜）
-- コンビニ弁当・ファストフード・外食メニューなども同様に含まれる食材に分解する
-- パン類（食パン・トースト・ロールパン・バゲットなど）は「パン」に統一する
-- ご飯・冷ご飯・白米・米などは「ご飯」に統一する
-- うどん・そば・ラーメン・パスタなど麺類は「〇〇」とそのまま正規化するが、総称で入力された場合は「麺」にする
-- 缶詰は「〇〇缶」の形に統一する（例：ツナ→ツナ缶、シーチキン→ツナ缶、サバ→サバ缶、イワシ→イワシ缶）
-- ひき肉は種類を明示する（例：ミンチ→豚ひき肉、合いびき→合挽き肉）
-
-返すJSONの形式（他のテキストは一切含めないこと）：
-{{
-  "ingredients": ["食材1", "食材2", "食材3"],
-  "message": "○○と△△と□□があるんだぞい！ちょっと考えてみるぞい…"
-}}
-
-messageは「ゆるゆるコックさん」というキャラクターのセリフで、語尾は「〜ぞい」「〜だぞい」を使い、食材名を入れて元気よく書いてください。
-食材が1つだけのときは「〇〇があるんだぞい！」のように単体で話し、「と」で繋げないでください。
-必ず日本語のみで出力してください。"""
-
-        response = client.chat.completions.create(
-            model="llama-3.3-70b-versatile",
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=300,
-            temperature=0.7,
-        )
-        raw = response.choices[0].message.content.strip()
-        # JSONを取り出す
-        start = raw.find("{")
-        end = raw.rfind("}") + 1
-        if start == -1 or end == 0:
-            return [], ""
-        data = json.loads(raw[start:end])
-        ingredients = data.get("ingredients", [])
-        message = data.get("message", "")
-        return ingredients, message
+        result = llm_models.normalize_tiered(call_model, user_input, models)
     except Exception:
         return [], "groq_error"  # エラー時はフラグとして"groq_error"を返す
+    if result["escalated"]:
+        metrics.inc(f"llm.normalize.escalated.{result['reason']}")
+    # 「ネギ」「ｳｨﾝﾅｰ」のような表記ゆれで返ってきても食材DBの名前にそろえる
+    ingredients = []
+    for name in result["ingredients"]:
+        name = variants.resolve(name) or name
+        if name not in ingredients:
+            ingredients.append(name)
+    return ingredients, result["message"]
+
+
+# ────────────────────────────
+# 食材マッピング・手順置換
+# ────────────────────────────
+def build_ingredient_mapping(recipe: dict, user_names: list) -> dict:
+    """
+    本物の食材 → ユーザーが持っている食材 のマッピングを作る。
+    user_names: Groqが正規化したユーザーの入力食材リスト
+    戻り値: {本物の食材: 表示名}（代替のときは「〇〇（代替）」）
+    """
+    # 優先順位：① 完全一致 → ② 同カテゴリ代替 → ③ 主食系同士代替 → ④ カテゴリ不問フォールバック
+    real_ingredients_list = recipe["本物の食材"]  # 順序を保持するためlistで扱う
+    ingredient_map = get_ingredient_map()  # 食材名→カテゴリの辞書
+
+    # ユーザー食材のカテゴリを取得
+    user_categories = {name: ingredient_map.get(name, []) for name in user_names}
+
+    # 代替候補を2種類に分けて管理する
+    # ・non_staple_substitutes: 主食系以外の代替候補（肉・野菜・魚など）
+    # ・staple_substitutes: 主食系同士の代替候補（パスタ→マカロニ など）
+    # カテゴリ未登録食材はどちらからも除外する
+    non_staple_substitutes = [
+        n for n in user_names
+        if n not in real_ingredients_list
+        and "主食系" not in ingredient_map.get(n, [])
+        and len(ingredient_map.get(n, [])) > 0
+    ]
+    staple_substitutes = [
+        n for n in user_names
+        if n not in real_ingredients_list
+        and "主食系" in ingredient_map.get(n, [])
+        and len(ingredient_map.get(n, [])) > 0
+    ]
+
+    mapping = {}
+    used_substitutes = set()
+
+    for real in real_ingredients_list:
+        if real in user_names:
+            # ① 完全一致
+            mapping[real] = real
+        else:
+            real_cats = set(ingredient_map.get(real, []))
+            best = None
+
+            # ② 同カテゴリ代替（主食系以外の候補から探す）
+            for sub in non_staple_substitutes:
+                if sub in used_substitutes:
+                    continue
+                sub_cats = set(user_categories.get(sub, []))
+                if real_cats & sub_cats:
+                    best = sub
+                    break
+
+            # ③ 主食系同士の代替（本物食材が主食系のときだけ）
+            if best is None and "主食系" in real_cats:
+                for sub in staple_substitutes:
+                    if sub not in used_substitutes:
+                        best = sub
+                        break
+
+            # ④ カテゴリ不問フォールバック（未割り当ての非主食系食材を順番に割り当て）
+            if best is None:
+                for sub in non_staple_substitutes:
+                    if sub not in used_substitutes:
+                        best = sub
+                        break
+
+            if best:
+                mapping[real] = f"{best}（代替）"
+                used_substitutes.add(best)
+            else:
+                mapping[real] = real  # 代替なし→そのまま
+
+    return mapping
+
+
+@functools.lru_cache(maxsize=256)
+def _compile_step_replacer(mapping_items: tuple) -> tuple:
+    """マッピングから一括置換用の正規表現と置換先辞書を作る（マッピングごとに1回だけ）"""
+    # 長い食材名を先に並べて、同じ位置では最長一致を優先する（部分一致の誤爆を防ぐ）
+    # ★完全一致食材（表示名 == 本物）も置換対象に含める
+    #   （手順テキストに明示された食材名をそのまま残し、「具材」などの抽象表現にしないため）
+    replacements = {real: user_name.replace("（代替）", "") for real, user_name in mapping_items}
+    keys = sorted(replacements, key=lambda k: -len(k))
+    pattern = re.compile("|".join(re.escape(k) for k in keys)) if keys else None
+    return pattern, replacements
+
+
+def replace_steps(steps: list, mapping: dict) -> list:
+    """加工手順の食材名をマッピングに従って1パスで置換する"""
+    pattern, replacements = _compile_step_replacer(tuple(sorted(mapping.items())))
+    if pattern is None:
+        return list(steps)
+    return [pattern.sub(lambda m: replacements[m.group(0)], step) for step in steps]
+
+
+# ────────────────────────────
+# 食材正規化（ローカル優先・分からない単語があるときだけGroq）
+# ────────────────────────────
+@st.cache_resource
+def get_normalizer_vocab() -> dict:
+    """ローカル正規化用の辞書（食材名・表記ゆれ・料理名）を返す"""
+    return local_normalizer.build_vocabulary(
+        get_ingredient_catalog()["ingredients"], get_recipe_catalog()["recipes"]
+    )
+
+
+def normalize_ingredients(user_input: str) -> tuple[list[str], str]:
+    """
+    入力テキストを正規化する。ローカルのルールで全部分かればGroqを呼ばない。
+    戻り値・失敗時の扱いは groq_normalize_ingredients() と同じ。
+    """
+    user_input = canonical.normalize_width(user_input)
+    resolved, unresolved = local_normalizer.normalize(user_input, get_normalizer_vocab())
+    if resolved and not unresolved:
+        return resolved, local_normalizer.build_message(resolved)
+    return groq_normalize_ingredients(user_input)
 
 
 # ────────────────────────────
 # Groqセリフ生成（② 調理手順）
 # ────────────────────────────
+@st.cache_resource
+def get_steps_cache() -> response_cache.VariantCache:
+    """調理手順セリフのキャッシュ（全セッションで共有、ディスクにも保存）"""
+    return response_cache.VariantCache(
+        "steps_cache", STEPS_CACHE_PATH,
+        max_keys=STEPS_CACHE_MAX_KEYS, variants_per_key=STEPS_CACHE_VARIANTS,
+    )
+
+
 def groq_cooking_steps(recipe: dict, user_input_words: list) -> str:
     """
     調理手順セリフをGroqで生成する（代替食材名で話す）。
@@ -482,90 +743,16 @@ def groq_cooking_steps(recipe: dict, user_input_words: list) -> str:
     戻り値: セリフ文字列（失敗時は空文字列）
     """
     try:
-        client = get_groq_client()
-
-        # 食材マッピングを作る（本物の食材 → ユーザーが持っている食材）
-        # 優先順位：① 完全一致 → ② 同カテゴリ代替 → ③ 主食系同士代替 → ④ カテゴリ不問フォールバック
-        real_ingredients_list = recipe["本物の食材"]  # 順序を保持するためlistで扱う
         user_names = user_input_words  # Groq正規化リストを使う
         ingredient_map = get_ingredient_map()  # 食材名→カテゴリの辞書
-
-        # ユーザー食材のカテゴリを取得
-        user_categories = {name: ingredient_map.get(name, []) for name in user_names}
-
-        # 代替候補を2種類に分けて管理する
-        # ・non_staple_substitutes: 主食系以外の代替候補（肉・野菜・魚など）
-        # ・staple_substitutes: 主食系同士の代替候補（パスタ→マカロニ など）
-        # カテゴリ未登録食材はどちらからも除外する
-        non_staple_substitutes = [
-            n for n in user_names
-            if n not in real_ingredients_list
-            and "主食系" not in ingredient_map.get(n, [])
-            and len(ingredient_map.get(n, [])) > 0
-        ]
-        staple_substitutes = [
-            n for n in user_names
-            if n not in real_ingredients_list
-            and "主食系" in ingredient_map.get(n, [])
-            and len(ingredient_map.get(n, [])) > 0
-        ]
-
-        mapping = {}
-        used_substitutes = set()
-
-        for real in real_ingredients_list:
-            if real in user_names:
-                # ① 完全一致
-                mapping[real] = real
-            else:
-                real_cats = set(ingredient_map.get(real, []))
-                best = None
-
-                # ② 同カテゴリ代替（主食系以外の候補から探す）
-                for sub in non_staple_substitutes:
-                    if sub in used_substitutes:
-                        continue
-                    sub_cats = set(user_categories.get(sub, []))
-                    if real_cats & sub_cats:
-                        best = sub
-                        break
-
-                # ③ 主食系同士の代替（本物食材が主食系のときだけ）
-                if best is None and "主食系" in real_cats:
-                    for sub in staple_substitutes:
-                        if sub not in used_substitutes:
-                            best = sub
-                            break
-
-                # ④ カテゴリ不問フォールバック（未割り当ての非主食系食材を順番に割り当て）
-                if best is None:
-                    for sub in non_staple_substitutes:
-                        if sub not in used_substitutes:
-                            best = sub
-                            break
-
-                if best:
-                    mapping[real] = f"{best}（代替）"
-                    used_substitutes.add(best)
-                else:
-                    mapping[real] = real  # 代替なし→そのまま
+        mapping = build_ingredient_mapping(recipe, user_names)
 
         steps = recipe["加工手順"]
         cooking_method = recipe["必要調理法"]
         genre = recipe["ジャンル"]
 
         # 加工手順の文字列をPython側で事前に置換する（Groqに任せると揺れるため）
-        # 長い食材名から先に置換して部分一致の誤爆を防ぐ
-        replaced_steps = list(steps)
-        sorted_mapping = sorted(mapping.items(), key=lambda x: -len(x[0]))
-        for i, step in enumerate(replaced_steps):
-            for real, user_name in sorted_mapping:
-                display_name = user_name.replace("（代替）", "")
-                # ★修正：完全一致食材（display_name == real）も含めて置換する
-                #   （以前は display_name != real の場合のみ置換していたため、
-                #     ユーザーが持っている食材が手順テキストに明示されていても
-                #     置換されず「具材」などの抽象表現が残ってしまう問題があった）
-                replaced_steps[i] = replaced_steps[i].replace(real, display_name)
+        replaced_steps = replace_steps(steps, mapping)
 
         # ユーザーが持っている食材を「必ず言及」リストとしてプロンプトに渡す
         # 主食系は調理手順の主役になりやすいので含め、未登録食材は除外する
@@ -595,13 +782,24 @@ def groq_cooking_steps(recipe: dict, user_input_words: list) -> str:
 - 200文字以内で簡潔に
 - 日本語のみ使用すること"""
 
-        response = client.chat.completions.create(
-            model="llama-3.3-70b-versatile",
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=300,
-            temperature=0.8,
+        model = get_task_models()["cooking"]
+        cache = get_steps_cache()
+        # 料理IDだけだと料理DBを直したあとも古いセリフが出る（IDがずれると別の料理のセリフになる）ので、
+        # プロンプトの元になる項目のハッシュもキーに入れる
+        cache_key = response_cache.make_key(
+            STEPS_PROMPT_VERSION, model,
+            get_recipe_catalog()["name_to_id"].get(recipe["name"], recipe["name"]),
+            llm_models.cooking_source_hash(replaced_steps, cooking_method, genre),
+            mapping, set(must_mention),
         )
-        return response.choices[0].message.content.strip()
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        text = groq_chat(prompt, llm_scheduler.PRIORITY_COOKING, max_tokens=300, temperature=0.8,
+                         model=model)
+        cache.add(cache_key, text)
+        return text
     except Exception:
         return ""
 
@@ -615,42 +813,169 @@ def groq_farewell(recipe: dict) -> str:
     戻り値: セリフ文字列（失敗時は空文字列）
     """
     try:
-        client = get_groq_client()
+        prompt = llm_models.build_farewell_prompt(recipe)
+        return groq_chat(prompt, llm_scheduler.PRIORITY_FAREWELL, max_tokens=200, temperature=0.8,
+                         model=get_task_models()["farewell"])
+    except Exception:
+        return ""
 
-        real_ingredients = recipe["本物の食材"]
-        description = recipe["説明文"]
 
-        prompt = f"""あなたは「ゆるゆるコックさん」というキャラクターです。
-語尾は「〜ぞい」「〜だぞい」「〜するぞい」を使い、全力肯定でやさしくお見送りします。
+@st.cache_resource
+def get_farewell_db() -> dict:
+    """
+    事前生成したお見送りセリフ（pregen_farewells.py で作る）を 料理名→パターンリスト で返す。
+    ファイルがない・料理DBの内容が変わった料理は含めない（その料理はその場でGroqに聞く）
+    --local（Groqなしの動作確認用）で作ったファイルは使わない
+    """
+    try:
+        with open(FAREWELL_DB_PATH, encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+    if data.get("generator") == llm_models.FAREWELL_LOCAL_GENERATOR:
+        return {}
+    current = {
+        r["name"]: llm_models.farewell_source_hash(r) for r in get_recipe_catalog()["recipes"]
+    }
+    return {
+        name: entry["variants"]
+        for name, entry in data.get("recipes", {}).items()
+        if entry.get("variants") and current.get(name) == entry.get("hash")
+    }
 
-料理名：{recipe['name']}
-本物の食材：{json.dumps(real_ingredients, ensure_ascii=False)}
-説明文：{description}
 
-上記を参考に、料理の魅力を伝えながら「またいつでも来てほしいぞい」という気持ちのお見送りセリフを100文字以内で書いてください。
-注意：これはまだ「作り方を提案した段階」です。「おいしかった」「食べた」などの過去形は使わず、「きっとおいしいぞい」「得意料理になるぞい」「また来てほしいぞい」のような未来・期待のニュアンスにしてください。
-セリフだけを返してください。必ず日本語のみで出力してください。"""
+def pick_farewell_message(recipe: dict) -> str:
+    """お見送りセリフ：事前生成したものがあればその中から選び、なければGroqで生成する"""
+    variants = get_farewell_db().get(recipe["name"])
+    if variants:
+        metrics.inc("farewell.pregenerated")
+        return random.choice(variants)
+    metrics.inc("farewell.live")
+    return groq_farewell(recipe)
 
-        response = client.chat.completions.create(
-            model="llama-3.3-70b-versatile",
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=200,
-            temperature=0.8,
-        )
-        return response.choices[0].message.content.strip()
-    except Exception:
-        return ""
+
+# ────────────────────────────
+# LLM呼び出しの締め切り
+# ────────────────────────────
+# 締め切りまでに返ってこなければテンプレートのセリフで画面を出し、
+# 遅れて結果が届いたら（LLM_LATE_GRACE_SEC 以内なら）その場で差し替える。
+_llm_thread_state = threading.local()
+
+
+def current_session_id() -> str:
+    """今のセッションID（締め切り用のワーカースレッドからは呼び出し元のセッションを返す）"""
+    session_id = getattr(_llm_thread_state, "session_id", None)
+    if session_id is not None:
+        return session_id
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx is not None else ""
+
+
+@st.cache_resource
+def get_llm_executor() -> ThreadPoolExecutor:
+    """締め切りつきのLLM呼び出しを流すスレッドプール（全セッションで共有）"""
+    return ThreadPoolExecutor(max_workers=LLM_DEADLINE_WORKERS, thread_name_prefix="llm_deadline")
+
+
+def call_with_deadline(kind: str, fn, *args):
+    """
+    fn(*args) を別スレッドで始めて LLM_DEADLINE_SEC[kind] 秒まで待つ。
+    戻り値: (結果, None)。間に合わなかったときは (None, Future)
+    """
+    session_id = current_session_id()
+
+    def run():
+        _llm_thread_state.session_id = session_id
+        try:
+            return fn(*args)
+        finally:
+            _llm_thread_state.session_id = None
+
+    future = get_llm_executor().submit(run)
+    try:
+        result = future.result(timeout=LLM_DEADLINE_SEC[kind])
+    except TimeoutError:
+        metrics.inc(f"llm.deadline.missed.{kind}")
+        return None, future
+    metrics.inc(f"llm.deadline.met.{kind}")
+    return result, None
+
+
+def set_late_llm(kind: str, future, state_key: str):
+    """締め切りに間に合わなかった呼び出しを、次の画面で待つために覚えておく"""
+    st.session_state.pending_llm[kind] = (future, time.monotonic(), state_key)
+
+
+def settle_late_llm():
+    """画面を離れるとき用：もう届いている結果だけ取り込み、待っている呼び出しは忘れる"""
+    for future, _, state_key in st.session_state.pending_llm.values():
+        if future.done() and future.exception() is None and future.result():
+            st.session_state[state_key] = future.result()
+    st.session_state.pending_llm = {}
+
+
+def late_llm_slot(kind: str, fallback):
+    """
+    LLMのセリフがまだないときに表示する枠。fallback() でテンプレートを出しておき、
+    締め切りに間に合わなかった結果が届いたら（または待ちきれなくなったら）画面全体を描き直して差し替える。
+    """
+    pending = st.session_state.pending_llm.get(kind)
+    if pending is None:
+        fallback()
+        return
+    future, missed_at, state_key = pending
+
+    @st.fragment(run_every=LLM_LATE_POLL_SEC)
+    def slot():
+        if future.done() or time.monotonic() - missed_at > LLM_LATE_GRACE_SEC:
+            del st.session_state.pending_llm[kind]
+            if future.done() and future.exception() is None and future.result():
+                st.session_state[state_key] = future.result()
+                metrics.inc(f"llm.deadline.late.{kind}")
+            else:
+                metrics.inc(f"llm.deadline.abandoned.{kind}")
+            st.rerun()
+        fallback()
+
+    slot()
 
 
 # ────────────────────────────
 # ingredient_db読み込み（カテゴリ検索用）
 # ────────────────────────────
+@st.cache_resource
+def get_data_catalog() -> dict:
+    """
+    料理DB・食材DBの全件（data_pack.load_catalog()）。
+    build_data_pack.py で作ったパックがJSONより新しければパックを mmap で開き、なければJSONから読む
+    """
+    catalog = data_pack.load_catalog()
+    metrics.set_gauge("data_catalog.from_pack", int(catalog["source"] == "pack"))
+    return catalog
+
+
+@st.cache_resource
+def get_ingredient_catalog() -> dict:
+    """食材DB全件と 食材名→ID の辞書を返す（セッションにはIDだけ持たせる）"""
+    catalog = get_data_catalog()
+    return {
+        "ingredients": catalog["ingredients"],
+        "name_to_id": catalog["ingredient_name_to_id"],
+    }
+
+
+@st.cache_resource
+def get_ingredient_variants() -> canonical.VariantDictionary:
+    """表記ゆれ（かな/カタカナ・半角・長音・別名）→ 食材名 の辞書"""
+    return canonical.VariantDictionary(
+        get_ingredient_catalog()["name_to_id"], local_normalizer.CANONICAL_RULES
+    )
+
+
 @st.cache_resource
 def get_ingredient_map() -> dict:
     """食材名→カテゴリの辞書を返す（Groq正規化リストのカテゴリ引き用）"""
-    with open("./data/ingredient_db.json", encoding="utf-8") as f:
-        db = json.load(f)
-    return {item["食材名"]: item["カテゴリ"] for item in db}
+    return {item["食材名"]: item["カテゴリ"] for item in get_ingredient_catalog()["ingredients"]}
 
 
 def get_categories_from_words(words: list, ingredient_map: dict) -> list:
@@ -665,24 +990,45 @@ def get_categories_from_words(words: list, ingredient_map: dict) -> list:
 
 
 # ────────────────────────────
-# ChromaDB登録用ドキュメント生成（setup_chroma.pyと同一ロジック）
+# recipe_db読み込み（全件一致率スコアリング用）
 # ────────────────────────────
-def _build_recipe_document(recipe: dict) -> str:
-    """料理DBの1件をベクトル検索用のテキストに変換する"""
-    ingredients = "、".join(recipe["本物の食材"])
-    categories = "、".join(recipe["使える食材カテゴリ"])
-    steps = "、".join(recipe.get("加工手順", []))
-    return (
-        f"{recipe['name']}。"
-        f"ジャンル：{recipe['ジャンル']}。"
-        f"食材：{ingredients}。"
-        f"使える食材カテゴリ：{categories}。"
-        f"調理法：{recipe['必要調理法']}。"
-        f"手順：{steps}。"
-        f"{recipe['説明文']}"
-    )
+@st.cache_resource
+def get_recipe_catalog() -> dict:
+    """
+    料理DB全件と、料理×食材の疎行列（CSR形式のインデックス配列）を返す。
+    一致率を全料理まとめて計算するために使う（疎行列はパックなら作成済みのものを使う）。
+    """
+    catalog = get_data_catalog()
+    return {
+        "recipes": catalog["recipes"],
+        "name_to_id": catalog["recipe_name_to_id"],
+        # 料理ごとの派生項目（コンロ・レンジ・主食・カテゴリのビットマスクなど。料理IDで引く）
+        "features": catalog_compiler.RecipeFeatures.from_catalog(catalog),
+        "heated": np.array([r["加熱"] for r in catalog["recipes"]], dtype=bool),
+        **catalog["recipe_csr"],   # ingredient_ids（食材名→列番号）・row_ids・col_ids・sizes
+    }
 
 
+def calc_match_rates(catalog: dict, user_words: list) -> np.ndarray:
+    """全料理の一致率をまとめて計算する（calc_match_rateと同じ採点：食材80点＋調理法20点）"""
+    ingredient_ids = catalog["ingredient_ids"]
+    owned = np.zeros(len(ingredient_ids), dtype=np.float64)
+    for word in user_words:
+        col = ingredient_ids.get(word)
+        if col is not None:
+            owned[col] = 1.0
+
+    sizes = catalog["sizes"]
+    matched = np.bincount(catalog["row_ids"], weights=owned[catalog["col_ids"]],
+                          minlength=len(sizes))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ingredient_score = np.where(sizes > 0, np.floor(matched / sizes * 80), 0)
+    return np.minimum(ingredient_score.astype(np.int32) + 20, 100)
+
+
+# ────────────────────────────
+# ChromaDB登録用ドキュメント生成（setup_chroma.pyと同一ロジック・料理はrecipe_store.py）
+# ────────────────────────────
 def _build_ingredient_document(ingredient: dict) -> str:
     """食材DBの1件をベクトル検索用のテキストに変換する（食材名3回で表記ゆれ対策）"""
     categories = "、".join(ingredient["カテゴリ"])
@@ -703,52 +1049,40 @@ def _build_ingredient_document(ingredient: dict) -> str:
 @st.cache_resource
 def get_collections():
     client = chromadb.PersistentClient(path=CHROMA_DIR)
-    embed_fn = embedding_functions.SentenceTransformerEmbeddingFunction(
-        model_name=EMBED_MODEL
-    )
+    # YURU_EMBED_SERVER があれば共有の埋め込みサーバーを使う（なければプロセス内でモデルを読む）
+    embed_fn = get_embedding_function()
 
-    existing = [c.name for c in client.list_collections()]
+    existing = [c.name if hasattr(c, "name") else c for c in client.list_collections()]
 
-    # ── レシピコレクション ──
-    if RECIPE_COLLECTION not in existing:
+    # ── レシピコレクション（シャード）──
+    # 形式が古い・シャード数やHNSWの設定が変わったときは作り直す
+    recipe_col = open_recipe_store(client, embed_fn)
+    if recipe_col is None:
         with st.spinner("レシピDBを準備中だぞい…（初回だけ少し時間がかかるぞい）"):
-            recipe_col = client.create_collection(
-                name=RECIPE_COLLECTION,
-                embedding_function=embed_fn,
-                metadata={"hnsw:space": "cosine"},
-            )
-            with open("./data/recipe_db.json", encoding="utf-8") as f:
-                recipes = json.load(f)
-            ids, docs, metas = [], [], []
-            for i, r in enumerate(recipes):
-                ids.append(f"recipe_{i:03d}")
-                docs.append(_build_recipe_document(r))
-                metas.append({
-                    "name": r["name"],
-                    "ジャンル": r["ジャンル"],
-                    "必要調理法": r["必要調理法"],
-                    "加熱": str(r["加熱"]),
-                    "本物の食材": json.dumps(r["本物の食材"], ensure_ascii=False),
-                    "使える食材カテゴリ": json.dumps(r["使える食材カテゴリ"], ensure_ascii=False),
-                    "加工手順": json.dumps(r.get("加工手順", []), ensure_ascii=False),
-                    "説明文": r["説明文"],
-                })
-            recipe_col.add(ids=ids, documents=docs, metadatas=metas)
-    else:
-        recipe_col = client.get_collection(
-            name=RECIPE_COLLECTION, embedding_function=embed_fn
-        )
+            recipe_col = create_recipe_store(client, embed_fn)
+            catalog = get_recipe_catalog()
+            features = catalog["features"]
+            ingest_recipes(recipe_col, catalog["recipes"],
+                           derived=lambda i: catalog_compiler.index_metadata(features.fields(i)))
 
     # ── 食材コレクション ──
+    # HNSWの M / construction_ef が設定と違うときは作り直す（search_ef はそのまま設定し直す）
+    if INGREDIENT_COLLECTION in existing:
+        ingredient_col = client.get_collection(
+            name=INGREDIENT_COLLECTION, embedding_function=embed_fn
+        )
+        if not hnsw_matches(ingredient_col):
+            client.delete_collection(INGREDIENT_COLLECTION)
+            existing.remove(INGREDIENT_COLLECTION)
+
     if INGREDIENT_COLLECTION not in existing:
         with st.spinner("食材DBを準備中だぞい…"):
             ingredient_col = client.create_collection(
                 name=INGREDIENT_COLLECTION,
                 embedding_function=embed_fn,
-                metadata={"hnsw:space": "cosine"},
+                metadata=hnsw_metadata(),
             )
-            with open("./data/ingredient_db.json", encoding="utf-8") as f:
-                ingredients = json.load(f)
+            ingredients = get_ingredient_catalog()["ingredients"]
             ids, docs, metas = [], [], []
             for i, item in enumerate(ingredients):
                 ids.append(f"ingredient_{i:03d}")
@@ -761,9 +1095,7 @@ def get_collections():
                 })
             ingredient_col.add(ids=ids, documents=docs, metadatas=metas)
     else:
-        ingredient_col = client.get_collection(
-            name=INGREDIENT_COLLECTION, embedding_function=embed_fn
-        )
+        apply_search_ef(ingredient_col)
 
     return recipe_col, ingredient_col
 
@@ -771,13 +1103,76 @@ def get_collections():
 # ────────────────────────────
 # 検索ロジック
 # ────────────────────────────
-def search_one_ingredient(ingredient_col, word: str) -> dict | None:
-    """1単語で食材を1件検索する"""
-    results = ingredient_col.query(query_texts=[word], n_results=1)
+@st.cache_resource
+def get_recipe_prefilter() -> recipe_retriever.RecipePrefilter:
+    """料理の語彙の転置インデックス（2段構えの検索の1段目）"""
+    return recipe_retriever.RecipePrefilter(get_recipe_catalog()["recipes"])
+
+
+@st.cache_resource
+def get_recipe_vectors() -> embedding_store.EmbeddingStore | None:
+    """
+    2段目の並べ替えに使う、小さくした料理の埋め込み（setup_chroma.py で作る）。
+    ないとき・料理DBや形式が変わっているときは None（ChromaDBから取り出す）
+    """
+    vectors = embedding_store.EmbeddingStore.load(
+        embedding_store.EMBED_STORE_PATH,
+        data_pack.source_stamp([data_pack.RECIPE_JSON]),
+        embedding_store.store_config(EMBED_MODEL),
+    )
+    metrics.set_gauge("recipe_vectors.bytes", vectors.nbytes if vectors is not None else 0)
+    return vectors
+
+
+@st.cache_resource
+def get_category_rankings() -> recipe_retriever.CategoryRankings:
+    """
+    カテゴリの組ごとの料理ランキング。build_category_rankings.py の事前計算があれば読み込む
+    （料理DB・埋め込みモデル・検索の設定が変わっていたら使わず、その場で計算してメモする）
+    """
+    vectors = get_recipe_vectors()
+    table = recipe_retriever.load_rankings(
+        recipe_retriever.CATEGORY_RANKINGS_PATH,
+        data_pack.source_stamp([data_pack.RECIPE_JSON]),
+        recipe_retriever.rankings_config(
+            EMBED_MODEL,
+            vectors=embedding_store.store_config(EMBED_MODEL) if vectors is not None else "chroma",
+        ),
+    )
+    metrics.set_gauge("recipe_ranking.precomputed", len(table))
+    return recipe_retriever.CategoryRankings(table)
+
+
+@st.cache_resource
+def get_ingredient_index() -> ingredient_index.IngredientIndex:
+    """食材名・別名の文字列索引（SQLite FTS5）。ベクトル検索の前に引く"""
+    return ingredient_index.IngredientIndex(get_ingredient_catalog()["ingredients"])
+
+
+@st.cache_data(max_entries=1024, show_spinner=False)
+def _query_ingredient_vector(_ingredient_col, key: str, _word: str):
+    """
+    ベクトル検索で一番近い食材の (メタデータ, 距離) を返す（なければ None）。
+    キャッシュは canonical_key() だけで引くので、「ネギ」と「ねぎ」は1回の検索で済む
+    """
+    results = _ingredient_col.query(query_texts=[_word], n_results=1)
     if not results["metadatas"][0]:
         return None
-    meta = results["metadatas"][0][0]
-    distance = results["distances"][0][0]
+    return results["metadatas"][0][0], results["distances"][0][0]
+
+
+def search_one_ingredient(ingredient_col, word: str) -> dict | None:
+    """1単語で食材を1件検索する（名前・別名で引けなければベクトル検索）"""
+    word = canonical.normalize_width(word)
+    hit = get_ingredient_index().lookup(word)
+    if hit is not None:
+        metrics.inc("ingredient_lookup.text")
+        return hit
+    metrics.inc("ingredient_lookup.vector")
+    found = _query_ingredient_vector(ingredient_col, canonical.canonical_key(word), word)
+    if found is None:
+        return None
+    meta, distance = found
     if distance > 0.35:
         return None
     return {
@@ -789,61 +1184,145 @@ def search_one_ingredient(ingredient_col, word: str) -> dict | None:
     }
 
 
+def _recipe_from_meta(meta: dict) -> dict:
+    """ChromaDBのメタデータを料理DBと同じ形のdictに戻す"""
+    return {
+        "name": meta["name"],
+        "ジャンル": meta["ジャンル"],
+        "必要調理法": meta["必要調理法"],
+        "加熱": bool(meta["加熱"]),
+        "本物の食材": json.loads(meta["本物の食材"]),
+        "使える食材カテゴリ": json.loads(meta["使える食材カテゴリ"]),
+        "加工手順": json.loads(meta["加工手順"]),
+        "説明文": meta["説明文"],
+    }
+
+
+def _build_recipe_hit(recipe: dict, rid: int, features, category_mask: int, tools: list,
+                      distance: float, match_rate: int) -> dict:
+    """
+    料理1件を検索結果の形にする（道具の有無・カテゴリ一致数を付ける）。
+    コンロ・レンジ・カテゴリは catalog_compiler で事前に計算した派生項目を料理IDで引く
+    """
+    has_stove = "コンロ" in tools
+    has_microwave = "電子レンジ" in tools
+
+    # ゆるゆるコックさん：道具がなくても除外しない（誰かの力を借りればOK）
+    # 加熱不要な料理はいつでもOK。加熱必要な料理も道具の有無に関係なく提案する。
+
+    match_count = features.match_count(rid, category_mask)
+
+    # 道具なし = コンロもレンジもない かつ 加熱が必要な料理
+    no_tools = not has_stove and not has_microwave
+    needs_heat = bool(features.needs_stove[rid])
+    uses_microwave_instead = bool(features.microwave_ok[rid]) and not has_stove and has_microwave
+
+    return {
+        "name": recipe["name"],
+        "ジャンル": recipe["ジャンル"],
+        "必要調理法": recipe["必要調理法"],
+        "加熱": recipe["加熱"],
+        "本物の食材": recipe["本物の食材"],
+        "使える食材カテゴリ": recipe["使える食材カテゴリ"],
+        "加工手順": recipe.get("加工手順", []),
+        "説明文": recipe["説明文"],
+        "一致カテゴリ数": match_count,
+        "食材一致率": match_rate,
+        "道具なし": no_tools and needs_heat,          # コンロもレンジもない＋加熱必要
+        "レンジ代用": uses_microwave_instead,          # レンジでコンロを代用
+        "距離": round(distance, 4),
+    }
+
+
 def search_recipes(recipe_col, categories: list, tools: list,
-                   temperature: str, exclude_names: list, n=5) -> list:
-    """カテゴリ・道具・温度で料理を検索する"""
-    query = "、".join(categories) + "を使った料理"
-    results = recipe_col.query(query_texts=[query], n_results=20)
+                   temperature: str, exclude_names: list, n=5,
+                   user_words: list = None) -> list:
+    """カテゴリ・道具・温度で料理を検索する
+    user_words: ユーザーの食材名リスト。あれば全料理の一致率を計算してランキングに混ぜる。
+    """
+    catalog = get_recipe_catalog()
+    rates = calc_match_rates(catalog, user_words or [])
+
+    # カテゴリの組ごとのランキング（事前計算 → プロセス内メモ → その場で計算）
+    rankings = get_category_rankings()
+    key = recipe_retriever.category_key(categories)
+    ranking = rankings.get(key)
+    if ranking is None:
+        metrics.inc("recipe_ranking.miss")
+        ranking = recipe_retriever.rank_categories(
+            recipe_col, get_recipe_prefilter(), categories, catalog["recipes"],
+            vectors=get_recipe_vectors(),
+        )
+        rankings.put(key, ranking)
+    else:
+        metrics.inc("recipe_ranking.hit")
+
+    # 除外・温度はユーザーごとの条件なので、ランキングを引いたあとで当てる
+    exclude_ids = [catalog["name_to_id"][name] for name in exclude_names
+                   if name in catalog["name_to_id"]]
+    heated_only = temperature == "あったかいのがいい"
+    results = recipe_retriever.ranking_results(ranking, catalog["recipes"], exclude_ids, heated_only)
+    if len(results["ids"][0]) < n and len(ranking[0]) >= recipe_retriever.RANKING_DEPTH:
+        # 覚えている上位だけでは除外・温度で足りなくなったので、先に絞ってから件数を切らずに並べ直す
+        metrics.inc("recipe_ranking.too_short")
+        ranking = recipe_retriever.rank_categories(
+            recipe_col, get_recipe_prefilter(), categories, catalog["recipes"],
+            depth=None, vectors=get_recipe_vectors(), exclude_ids=exclude_ids, heated_only=heated_only,
+        )
+        results = recipe_retriever.ranking_results(ranking, catalog["recipes"], exclude_ids, heated_only)
+    hits = _collect_recipe_hits(results, catalog, rates, categories, tools,
+                                temperature, exclude_names, user_words)
+
+    # カテゴリ一致数に食材一致率（0〜1に換算）を重み付きで足してランキングする
+    hits.sort(key=lambda x: (
+        -(x["一致カテゴリ数"] + MATCH_RATE_WEIGHT * (x["食材一致率"] - 20) / 80),
+        x["距離"],
+    ))
+    return hits[:n]
 
-    hits = []
-    for i, meta in enumerate(results["metadatas"][0]):
-        name = meta["name"]
 
+def _collect_recipe_hits(results: dict, catalog: dict, rates, categories: list, tools: list,
+                         temperature: str, exclude_names: list, user_words: list) -> list:
+    """カテゴリのランキングと一致率上位の料理をまとめて、条件に合うものだけ返す"""
+    candidates = {}   # 料理名 → (料理dict, 距離)
+    for i, meta in enumerate(results["metadatas"][0]):
+        candidates[meta["name"]] = (_recipe_from_meta(meta), results["distances"][0][i])
+
+    # ベクトル検索で拾えなかった料理も、一致率が高ければ候補に加える
+    # （本物の食材が全部揃っている料理を取りこぼさないため）
+    if user_words:
+        # 除外・温度で落ちる料理に上位の枠を取られないよう、先に一致率を0にしておく
+        eligible = rates.copy()
+        eligible[[catalog["name_to_id"][n] for n in exclude_names if n in catalog["name_to_id"]]] = 0
+        if temperature == "あったかいのがいい":
+            eligible[~catalog["heated"]] = 0
+        top_ids = np.argsort(-eligible, kind="stable")[:MATCH_RATE_CANDIDATES]
+        for rid in top_ids:
+            if eligible[rid] <= 20:   # 食材が1つも一致していない（か、条件に合わない）
+                break
+            recipe = catalog["recipes"][rid]
+            candidates.setdefault(recipe["name"], (recipe, MATCH_RATE_DEFAULT_DISTANCE))
+
+    features = catalog["features"]
+    category_mask = features.categories_mask(categories)
+    hits = []
+    for name, (recipe, distance) in candidates.items():
         if name in exclude_names:
             continue
 
-        is_heated = meta["加熱"] == "True"
-        if temperature == "あったかいのがいい" and not is_heated:
+        if temperature == "あったかいのがいい" and not recipe["加熱"]:
             continue
 
-        cooking_method = meta["必要調理法"]
-        needs_stove = cooking_method in ["炒め", "炒め煮", "煮る", "煮込み", "焼き", "茹でる", "炊く"]
-        needs_microwave = False
-
-        has_stove = "コンロ" in tools
-        has_microwave = "電子レンジ" in tools
-        no_heat_needed = cooking_method == "なし"
-
-        # ゆるゆるコックさん：道具がなくても除外しない（誰かの力を借りればOK）
-        # 加熱不要な料理はいつでもOK。加熱必要な料理も道具の有無に関係なく提案する。
-
-        recipe_categories = json.loads(meta["使える食材カテゴリ"])
-        match_count = len(set(categories) & set(recipe_categories))
-
-        # 道具なし = コンロもレンジもない かつ 加熱が必要な料理
-        no_tools = not has_stove and not has_microwave
-        needs_heat = needs_stove and not no_heat_needed
-        uses_microwave_instead = needs_stove and not has_stove and has_microwave
-
-        hits.append({
-            "name": name,
-            "ジャンル": meta["ジャンル"],
-            "必要調理法": cooking_method,
-            "加熱": is_heated,
-            "本物の食材": json.loads(meta["本物の食材"]),
-            "使える食材カテゴリ": recipe_categories,
-            "加工手順": json.loads(meta["加工手順"]),
-            "説明文": meta["説明文"],
-            "一致カテゴリ数": match_count,
-            "道具なし": no_tools and needs_heat,          # コンロもレンジもない＋加熱必要
-            "レンジ代用": uses_microwave_instead,          # レンジでコンロを代用
-            "距離": round(results["distances"][0][i], 4),
-        })
+        rid = catalog["name_to_id"].get(name)
+        if rid is None:
+            continue   # recipe_db.jsonにない料理（古いインデックスの残り）
+        match_rate = int(rates[rid])
+        hit = _build_recipe_hit(recipe, rid, features, category_mask, tools, distance, match_rate)
+        hit["recipe_id"] = rid
+        hits.append(hit)
 
     # カテゴリ一致が1件もない料理は除外（ベクトル類似度だけで引っかかるのを防ぐ）
-    hits = [h for h in hits if h["一致カテゴリ数"] > 0]
-    hits.sort(key=lambda x: (-x["一致カテゴリ数"], x["距離"]))
-    return hits[:n]
+    return [h for h in hits if h["一致カテゴリ数"] > 0]
 
 
 def calc_match_rate(recipe: dict, found_ingredients: list,
@@ -921,23 +1400,96 @@ def init_session():
         "user_input": "",
         "temperature": "どっちでもいい",
         "tools": [],
-        "found_ingredients": [],
+        "found_ingredient_ids": [],    # 食材DBのID（get_ingredient_catalog()の並び順）
         "found_categories": [],
         "groq_normalized_words": [],   # Groqが正規化した食材名リスト（命名・詳細で使う）
-        "selected_recipe": None,
+        "selected_recipe_id": None,    # 料理DBのID（get_recipe_catalog()の並び順）
+        "tool_note": "",               # 「道具なし」「レンジ代用」のどちらか（なければ空）
         "recipe_name": "",
         "match_rate": 0,
-        "last_recipes": [],
+        "last_recipes": [],            # 直近に提案した料理ID（LAST_RECIPES_MAX件まで）
         "groq_analyze_message": "",    # ① 食材解析セリフ（Groq）
         "groq_cooking_message": "",    # ② 調理手順セリフ（Groq）
         "groq_farewell_message": "",   # ③ お見送りセリフ（Groq）
         "groq_error": False,           # Groqエラーフラグ
+        "pending_llm": {},             # 締め切りに間に合わなかったLLM呼び出し（種類→Future）
     }
     for key, val in defaults.items():
         if key not in st.session_state:
             st.session_state[key] = val
 
 
+def get_selected_recipe() -> dict | None:
+    """セッションの料理IDから料理dictを組み立てる（道具メモだけセッション固有）"""
+    rid = st.session_state.get("selected_recipe_id")
+    if rid is None:
+        return None
+    note = st.session_state.get("tool_note", "")
+    return {
+        **get_recipe_catalog()["recipes"][rid],
+        "道具なし": note == "道具なし",
+        "レンジ代用": note == "レンジ代用",
+    }
+
+
+def get_found_ingredients() -> list:
+    """セッションの食材IDから食材DBのエントリを返す（共有カタログをそのまま参照）"""
+    ingredients = get_ingredient_catalog()["ingredients"]
+    return [ingredients[i] for i in st.session_state.get("found_ingredient_ids", [])]
+
+
+# ────────────────────────────
+# セッションのメモリ計測
+# ────────────────────────────
+def _deep_sizeof(obj, seen=None) -> int:
+    """オブジェクトが抱えている中身まで含めたおおよそのバイト数"""
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(_deep_sizeof(k, seen) + _deep_sizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(_deep_sizeof(v, seen) for v in obj)
+    return size
+
+
+@st.cache_resource
+def _session_registry() -> dict:
+    """全セッションのメモリ使用量（プロセスで1つだけ共有する）"""
+    return {"lock": threading.Lock(), "sessions": {}}
+
+
+def record_session_memory():
+    """このセッションのキーごとのバイト数を記録し、全セッション合計をメトリクスに出す"""
+    ctx = get_script_run_ctx()
+    if ctx is None:
+        return
+    per_key = {key: _deep_sizeof(st.session_state[key]) for key in st.session_state.keys()}
+    now = time.time()
+
+    registry = _session_registry()
+    with registry["lock"]:
+        sessions = registry["sessions"]
+        sessions[ctx.session_id] = (now, per_key)
+        # しばらく動いていないセッションは集計から外す
+        for sid in [s for s, (ts, _) in sessions.items() if now - ts > SESSION_ACCOUNTING_TTL_SEC]:
+            del sessions[sid]
+        totals = {}
+        for _, keys in sessions.values():
+            for key, size in keys.items():
+                totals[key] = totals.get(key, 0) + size
+        num_sessions = len(sessions)
+
+    metrics.set_gauge("session_state.sessions", num_sessions)
+    metrics.set_gauge("session_state.bytes_total", sum(totals.values()))
+    # もうどのセッションにも無いキーのゲージは消す
+    metrics.replace_gauges("session_state.bytes.", totals)
+    metrics.set_gauge("session_state.bytes_this_session", sum(per_key.values()))
+
+
 # ────────────────────────────
 # 画面①：トップ
 # ────────────────────────────
@@ -1000,17 +1552,23 @@ def show_top():
 
         # ─── Groqで食材を正規化 ───
         with st.spinner("食材を解析中だぞい…"):
-            normalized_words, analyze_message = groq_normalize_ingredients(user_input)
+            normalized, late = call_with_deadline("normalize", normalize_ingredients, user_input)
+        if late is None:
+            normalized_words, analyze_message = normalized
+        else:
+            # 締め切りに間に合わなければローカルの正規化だけで進める
+            # （検索結果が変わってしまうので、遅れて届いた結果は使わない）
+            normalized_words, _ = local_normalizer.normalize(user_input, get_normalizer_vocab())
+            analyze_message = local_normalizer.build_message(normalized_words) if normalized_words else ""
 
-        # Groq成功 → 正規化リストを使う / 失敗 → 従来方式にフォールバック
+        # 正規化成功 → 正規化リストを使う / 失敗 → ローカルの単語分割にフォールバック
+        # （分からない部分は助詞で割ると「はんぺん→んぺん」のように壊れるので、句読点だけで区切る）
         if normalized_words:
             words_for_search = normalized_words
         else:
-            words_for_search = [
-                w.strip()
-                for w in user_input.replace("、", " ").replace(",", " ").split()
-                if w.strip()
-            ]
+            resolved, unresolved = local_normalizer.normalize(user_input, get_normalizer_vocab(),
+                                                              split_particles=False)
+            words_for_search = resolved + unresolved
 
         # ─── ChromaDBで食材検索 ───
         found_ingredients = []
@@ -1018,6 +1576,9 @@ def show_top():
             hit = search_one_ingredient(ingredient_col, word)
             if hit and hit["食材名"] not in [f["食材名"] for f in found_ingredients]:
                 found_ingredients.append(hit)
+        ingredient_ids = get_ingredient_catalog()["name_to_id"]
+        found_ingredient_ids = [ingredient_ids[ing["食材名"]] for ing in found_ingredients
+                                if ing["食材名"] in ingredient_ids]
 
         # ─── カテゴリ取得（Groq正規化リスト優先・失敗時はChromaDB結果で代替）───
         if normalized_words:
@@ -1044,7 +1605,9 @@ def show_top():
         if found_categories:
             recipes = search_recipes(
                 recipe_col, found_categories, tools, temperature,
-                exclude_names=st.session_state.last_recipes
+                exclude_names=[get_recipe_catalog()["recipes"][rid]["name"]
+                               for rid in st.session_state.last_recipes],
+                user_words=normalized_words or [ing["食材名"] for ing in found_ingredients],
             )
         else:
             recipes = []
@@ -1053,7 +1616,7 @@ def show_top():
         st.session_state.user_input = user_input
         st.session_state.temperature = temperature
         st.session_state.tools = tools
-        st.session_state.found_ingredients = found_ingredients
+        st.session_state.found_ingredient_ids = found_ingredient_ids
         st.session_state.found_categories = found_categories
         st.session_state.groq_normalized_words = normalized_words
         st.session_state.groq_analyze_message = analyze_message
@@ -1062,19 +1625,27 @@ def show_top():
 
         # Groqエラー時は必ず救済画面へ（レシピが見つかっても通常画面に進まない）
         if is_groq_error:
-            st.session_state.selected_recipe = None
+            st.session_state.selected_recipe_id = None
             st.session_state.screen = "analyze_rescue"
         elif recipes:
             top_recipes = recipes[:3]
             selected = random.choice(top_recipes)
             recipe_name, match_rate = build_recipe_name(selected, found_ingredients, user_input_words=normalized_words)
-            st.session_state.selected_recipe = selected
+            st.session_state.selected_recipe_id = selected["recipe_id"]
+            if selected["道具なし"]:
+                st.session_state.tool_note = "道具なし"
+            elif selected["レンジ代用"]:
+                st.session_state.tool_note = "レンジ代用"
+            else:
+                st.session_state.tool_note = ""
             st.session_state.recipe_name = recipe_name
             st.session_state.match_rate = match_rate
-            st.session_state.last_recipes = st.session_state.get("last_recipes", []) + [selected["name"]]
+            # 直近の履歴だけ残す（セッションごとに無限に伸びないように）
+            last_recipes = st.session_state.get("last_recipes", []) + [selected["recipe_id"]]
+            st.session_state.last_recipes = last_recipes[-LAST_RECIPES_MAX:]
             st.session_state.screen = "analyze"
         else:
-            st.session_state.selected_recipe = None
+            st.session_state.selected_recipe_id = None
             st.session_state.screen = "analyze_rescue"
 
         st.rerun()
@@ -1086,10 +1657,10 @@ def show_top():
 def show_analyze():
     show_titlebar("メニューを決めるぞい")
 
-    recipe = st.session_state.selected_recipe
+    recipe = get_selected_recipe()
     recipe_name = st.session_state.recipe_name
     match_rate = st.session_state.match_rate
-    found_ingredients = st.session_state.found_ingredients
+    found_ingredients = get_found_ingredients()
     analyze_message = st.session_state.groq_analyze_message
 
     # ─── 食材解析セリフ（ふきだし）───
@@ -1165,8 +1736,13 @@ def show_analyze():
 
     if st.button("作り方を説明するぞい →", use_container_width=True, type="primary"):
         with st.spinner("作り方を考え中だぞい…"):
-            cooking_message = groq_cooking_steps(recipe, st.session_state.get("groq_normalized_words", []))
-        st.session_state.groq_cooking_message = cooking_message
+            cooking_message, late = call_with_deadline(
+                "cooking", groq_cooking_steps, recipe, st.session_state.get("groq_normalized_words", []),
+            )
+        st.session_state.groq_cooking_message = cooking_message or ""
+        if late is not None:
+            set_late_llm("cooking", late, "groq_cooking_message")
+        st.session_state.groq_analyze_message = ""   # 解析セリフはこの画面でしか使わない
         st.session_state.screen = "detail"
         st.rerun()
 
@@ -1200,8 +1776,8 @@ def show_analyze_rescue():
 def show_detail():
     show_titlebar("作り方を教えるぞい")
 
-    recipe = st.session_state.selected_recipe
-    found_ingredients = st.session_state.found_ingredients
+    recipe = get_selected_recipe()
+    found_ingredients = get_found_ingredients()
     recipe_name = st.session_state.recipe_name
     cooking_message = st.session_state.groq_cooking_message
     groq_words = st.session_state.get("groq_normalized_words", [])
@@ -1236,10 +1812,16 @@ def show_detail():
         if cooking_message:
             st.write(cooking_message)
         else:
-            if recipe["加工手順"]:
-                steps_str = "、".join(recipe["加工手順"])
-                cooking = recipe["必要調理法"]
-                st.write(f"{steps_str}して、{cooking}したらできるぞい！")
+            def template_steps():
+                if recipe["加工手順"]:
+                    # LLMなしでも手持ちの食材名で手順を出す（groq_cooking_stepsと同じ置換）
+                    mapping = build_ingredient_mapping(recipe, groq_words)
+                    steps_str = "、".join(replace_steps(recipe["加工手順"], mapping))
+                    cooking = recipe["必要調理法"]
+                    st.write(f"{steps_str}して、{cooking}したらできるぞい！")
+
+            # 締め切りに間に合わなかったときは、届いたらこの場で差し替える
+            late_llm_slot("cooking", template_steps)
 
         st.divider()
 
@@ -1251,8 +1833,7 @@ def show_detail():
 
         section_label("食べ方のヒント")
         found_categories = st.session_state.get("found_categories", [])
-        recipe_categories = recipe.get("使える食材カテゴリ", [])
-        has_staple = "主食系" in recipe_categories
+        has_staple = get_recipe_catalog()["features"].staple[st.session_state.selected_recipe_id]
         if has_staple:
             eating_hint = "これだけで立派な一食になるぞい！お好みで汁物を添えるといいぞい"
         else:
@@ -1262,9 +1843,12 @@ def show_detail():
     bubble("よかったよかった。これでおなかいっぱいになるぞい 🎉")
 
     if st.button("次へ →", use_container_width=True, type="primary"):
+        settle_late_llm()
         with st.spinner("お見送りの言葉を考え中だぞい…"):
-            farewell_message = groq_farewell(recipe)
-        st.session_state.groq_farewell_message = farewell_message
+            farewell_message, late = call_with_deadline("farewell", pick_farewell_message, recipe)
+        st.session_state.groq_farewell_message = farewell_message or ""
+        if late is not None:
+            set_late_llm("farewell", late, "groq_farewell_message")
         st.session_state.screen = "farewell"
         st.rerun()
 
@@ -1283,7 +1867,7 @@ def show_farewell():
     if farewell_message:
         bubble(farewell_message)
     else:
-        bubble("また、何か作りたくなったら来るといいぞい 🍳")
+        late_llm_slot("farewell", lambda: bubble("また、何か作りたくなったら来るといいぞい 🍳"))
 
     # st.info("💡 「トップに戻るぞい」で同じ食材のまま別のメニューを相談できるぞい！")
 
@@ -1355,10 +1939,10 @@ def show_farewell():
 
     if st.button("トップに戻るぞい", use_container_width=True):
         for key in ["screen", "temperature", "tools",
-                    "found_ingredients", "found_categories",
-                    "selected_recipe", "recipe_name", "match_rate",
+                    "found_ingredient_ids", "found_categories",
+                    "selected_recipe_id", "tool_note", "recipe_name", "match_rate",
                     "groq_analyze_message", "groq_cooking_message", "groq_farewell_message",
-                    "groq_error"]:
+                    "groq_error", "pending_llm"]:
             if key in st.session_state:
                 del st.session_state[key]
         st.rerun()
@@ -1392,15 +1976,30 @@ def show_farewell_rescue():
 
     if st.button("トップに戻るぞい", use_container_width=True):
         for key in ["screen", "temperature", "tools",
-                    "found_ingredients", "found_categories",
-                    "selected_recipe", "recipe_name", "match_rate",
+                    "found_ingredient_ids", "found_categories",
+                    "selected_recipe_id", "tool_note", "recipe_name", "match_rate",
                     "groq_analyze_message", "groq_cooking_message", "groq_farewell_message",
-                    "groq_error"]:
+                    "groq_error", "pending_llm"]:
             if key in st.session_state:
                 del st.session_state[key]
         st.rerun()
 
 
+# ────────────────────────────
+# メトリクス表示（?metrics=<METRICS_TOKEN>）
+# ────────────────────────────
+def metrics_page_allowed() -> bool:
+    """secrets.toml の METRICS_TOKEN と ?metrics= が一致するときだけ見せる（未設定なら見せない）"""
+    token = st.secrets.get("METRICS_TOKEN", "")
+    given = st.query_params.get("metrics", "")
+    return bool(token) and hmac.compare_digest(str(given).encode("utf-8"), str(token).encode("utf-8"))
+
+
+def show_metrics():
+    show_titlebar("メトリクス")
+    st.json(metrics.snapshot())
+
+
 # ────────────────────────────
 # 画面ルーティング
 # ────────────────────────────
@@ -1408,7 +2007,9 @@ init_session()
 
 screen = st.session_state.screen
 
-if screen == "top":
+if metrics_page_allowed():
+    show_metrics()
+elif screen == "top":
     show_top()
 elif screen == "analyze":
     show_analyze()
@@ -1420,3 +2021,5 @@ elif screen == "farewell":
     show_farewell()
 elif screen == "farewell_rescue":
     show_farewell_rescue()
+
+record_session_memory()
@@ -0,0 +1,127 @@
+"""
+bench_embedding_storage.py
+埋め込みストア（embedding_store.py）の形式ごとに、メモリと検索結果の変わり方を比べるレポート。
+float32 で全件の距離を計算した上位k件を正解として、各形式の上位k件がどれだけ一致するか（recall@k）と、
+上位k件の距離のずれを測る。
+
+・合成データ：実際の文章埋め込みに近いよう、低ランクの成分＋ノイズで作ったベクトル（件数を増やして見る）
+・--chroma：setup_chroma.py で登録済みの料理の埋め込みと、カテゴリの組のクエリ（埋め込みモデルが必要）
+
+使い方：
+    python bench_embedding_storage.py                          # 合成データ 10000,100000 件
+    python bench_embedding_storage.py --sizes 10000,1000000
+    python bench_embedding_storage.py --chroma                 # 今の料理DBで
+"""
+
+import argparse
+import itertools
+import time
+
+import numpy as np
+
+from embedding_store import EmbeddingStore
+
+DIM = 768
+TOP_K = 10
+QUERIES = 200
+SYNTHETIC_RANK = 96      # 合成データの実質的な次元数
+SYNTHETIC_NOISE = 0.15
+
+# (形式, PCAの次元数)
+CONFIGS = [
+    ("float32", 0), ("float16", 0), ("int8", 0),
+    ("float16", 256), ("int8", 256), ("int8", 128),
+]
+
+
+def synthetic_embeddings(size: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    basis = rng.standard_normal((SYNTHETIC_RANK, DIM)).astype(np.float32)
+    weights = (1.0 / np.sqrt(np.arange(1, SYNTHETIC_RANK + 1))).astype(np.float32)
+    latent = rng.standard_normal((size, SYNTHETIC_RANK)).astype(np.float32) * weights
+    vectors = latent @ basis + SYNTHETIC_NOISE * rng.standard_normal((size, DIM)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def synthetic_queries(vectors: np.ndarray, count: int, seed: int = 1) -> np.ndarray:
+    """データの近くにあるクエリ（ランダムに選んだ料理の埋め込み＋ノイズ）"""
+    rng = np.random.default_rng(seed)
+    picked = vectors[rng.choice(len(vectors), count, replace=False)]
+    queries = picked + 0.5 * rng.standard_normal(picked.shape).astype(np.float32) / np.sqrt(DIM)
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+
+def chroma_embeddings():
+    """登録済みの料理の埋め込みと、カテゴリ1〜2個の組のクエリの埋め込み"""
+    import chromadb
+
+    import data_pack
+    import recipe_retriever
+    from embedding import get_embedding_function
+    from recipe_store import open_recipe_store, recipe_id, recipe_index
+
+    recipes = data_pack.load_catalog()["recipes"]
+    store = open_recipe_store(chromadb.PersistentClient(path="./chroma_db"), get_embedding_function())
+    if store is None:
+        raise SystemExit("レシピDBの形式が古いぞい。setup_chroma.py を実行してほしいぞい")
+    got = store.get(ids=[recipe_id(i) for i in range(len(recipes))], include=["embeddings"])
+    vectors = np.zeros((len(recipes), len(got["embeddings"][0])), dtype=np.float32)
+    vectors[[recipe_index(doc_id) for doc_id in got["ids"]]] = np.asarray(got["embeddings"])
+
+    categories = sorted({c for r in recipes for c in r["使える食材カテゴリ"]})
+    combos = [c for size in (1, 2) for c in itertools.combinations(categories, size)]
+    queries = np.asarray(store.embed([recipe_retriever.category_query(c) for c in combos]),
+                         dtype=np.float32)
+    return vectors, queries
+
+
+def report(vectors: np.ndarray, queries: np.ndarray, label: str):
+    k = min(TOP_K, len(vectors))
+    rows = np.arange(len(vectors))
+    exact = EmbeddingStore.build(vectors, "float32", 0)
+    expected = [np.argsort(exact.distances(rows, q), kind="stable")[:k] for q in queries]
+
+    print(f"\n{label}（{len(vectors)}件・{vectors.shape[1]}次元・クエリ{len(queries)}件・recall@{k}）")
+    print(f"{'形式':>12} {'バイト/件':>9} {'100万件(MB)':>12} {'削減':>6} "
+          f"{'recall':>7} {'距離ずれ平均':>12} {'作成(秒)':>9} {'検索(ms)':>9}")
+    base_bytes = None
+    for dtype, pca_dim in CONFIGS:
+        if pca_dim >= vectors.shape[1] or (pca_dim and pca_dim > len(vectors)):
+            continue
+        t0 = time.perf_counter()
+        store = EmbeddingStore.build(vectors, dtype, pca_dim)
+        build_sec = time.perf_counter() - t0
+
+        recalls, drift = [], []
+        t0 = time.perf_counter()
+        for q, truth in zip(queries, expected):
+            distances = store.distances(rows, q)
+            got = np.argpartition(distances, k - 1)[:k]
+            recalls.append(len(set(got) & set(truth)) / k)
+            drift.append(np.abs(distances[truth] - exact.distances(truth, q)).mean())
+        query_ms = (time.perf_counter() - t0) * 1000 / len(queries)
+
+        per_vector = store.codes.itemsize * store.dim + (4 if store.scales is not None else 0)
+        base_bytes = base_bytes or per_vector
+        name = dtype if not pca_dim else f"{dtype}+PCA{pca_dim}"
+        print(f"{name:>12} {per_vector:>9} {per_vector * 1e6 / 2 ** 20:>12.0f} "
+              f"{base_bytes / per_vector:>5.1f}x {np.mean(recalls):>7.3f} {np.mean(drift):>12.4f} "
+              f"{build_sec:>9.2f} {query_ms:>9.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="埋め込みストアの形式ごとのメモリ・recall 比較")
+    parser.add_argument("--sizes", default="10000,100000", help="合成データの件数（カンマ区切り）")
+    parser.add_argument("--chroma", action="store_true", help="登録済みの料理の埋め込みで比べる")
+    args = parser.parse_args()
+
+    if args.chroma:
+        vectors, queries = chroma_embeddings()
+        report(vectors, queries, "料理DB")
+    for size in [int(s) for s in args.sizes.split(",") if s]:
+        vectors = synthetic_embeddings(size)
+        report(vectors, synthetic_queries(vectors, min(QUERIES, size)), "合成データ")
+
+
+if __name__ == "__main__":
+    main()
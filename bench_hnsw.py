@@ -0,0 +1,121 @@
+"""
+bench_hnsw.py
+HNSWのパラメータ（M・construction_ef・search_ef）を振って、登録時間・インデックスのサイズ・
+検索レイテンシ・recall@k（numpyで全件の距離を計算した正解との一致）を測るチューニング用ベンチマーク。
+件数を増やした合成データで測り、カタログが大きくなったときの設定を数字で決めるためのもの。
+
+埋め込みは bench_embedding_storage.py と同じ合成ベクトル（低ランク＋ノイズ）を直接登録するので、
+埋め込みモデルは要らない。search_ef は登録し直さなくても変えられるので、(M, construction_ef) ごとに
+1回だけ登録して search_ef を順に切り替えて測る。ただし ChromaDB は一度読み込んだインデックスの
+search_ef を変えないので、切り替えるたびにクライアントを開き直す（アプリでは起動時に反映される）。
+
+使い方：
+    python bench_hnsw.py
+    python bench_hnsw.py --sizes 10000,100000 --m 8,16,32 --construction-ef 100,200 --search-ef 10,50,100,200
+
+結果を見て、recipe_store.py の YURU_HNSW_M / YURU_HNSW_CONSTRUCTION_EF / YURU_HNSW_SEARCH_EF を設定する。
+"""
+
+import argparse
+import os
+import shutil
+import statistics
+import tempfile
+import time
+
+import chromadb
+import numpy as np
+from chromadb.api.client import SharedSystemClient
+
+from bench_embedding_storage import synthetic_embeddings, synthetic_queries
+from recipe_store import apply_search_ef, hnsw_metadata
+
+TOP_K = 10
+QUERIES = 200
+ADD_BATCH = 5000
+
+
+def dir_size(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, f))
+               for root, _, files in os.walk(path) for f in files)
+
+
+def exact_top_k(vectors: np.ndarray, queries: np.ndarray, k: int) -> list:
+    """全件のコサイン距離から求めた正解（ベクトルは長さ1にそろえてある）"""
+    truth = []
+    for q in queries:
+        scores = vectors @ q
+        top = np.argpartition(-scores, k - 1)[:k]
+        truth.append({f"v{i}" for i in top})
+    return truth
+
+
+def bench_build(vectors: np.ndarray, queries: np.ndarray, truth: list,
+                m: int, construction_ef: int, search_efs: list) -> list:
+    tmp = tempfile.mkdtemp(prefix="yuru_hnsw_")
+    try:
+        client = chromadb.PersistentClient(path=tmp)
+        col = client.create_collection(
+            name="bench", embedding_function=None,
+            metadata=hnsw_metadata(m, construction_ef, search_efs[0]),
+        )
+        ids = [f"v{i}" for i in range(len(vectors))]
+        t0 = time.perf_counter()
+        for start in range(0, len(vectors), ADD_BATCH):
+            col.add(ids=ids[start:start + ADD_BATCH], embeddings=vectors[start:start + ADD_BATCH])
+        col.query(query_embeddings=queries[:1], n_results=1)   # インデックスの書き出しを済ませる
+        build_sec = time.perf_counter() - t0
+        size_mb = dir_size(tmp) / 2 ** 20
+
+        rows = []
+        for search_ef in search_efs:
+            SharedSystemClient.clear_system_cache()   # 読み込み済みのインデックスを捨てる
+            col = chromadb.PersistentClient(path=tmp).get_collection("bench")
+            apply_search_ef(col, search_ef)
+            latencies, recalls = [], []
+            for q, expected in zip(queries, truth):
+                t0 = time.perf_counter()
+                res = col.query(query_embeddings=[q], n_results=TOP_K, include=[])
+                latencies.append((time.perf_counter() - t0) * 1000)
+                recalls.append(len(set(res["ids"][0]) & expected) / TOP_K)
+            latencies.sort()
+            rows.append({
+                "m": m, "construction_ef": construction_ef, "search_ef": search_ef,
+                "build_sec": build_sec, "size_mb": size_mb,
+                "p50_ms": statistics.median(latencies),
+                "p95_ms": latencies[int(len(latencies) * 0.95) - 1],
+                "recall": statistics.mean(recalls),
+            })
+        return rows
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HNSWパラメータのチューニング用ベンチマーク")
+    parser.add_argument("--sizes", default="10000,100000", help="合成データの件数（カンマ区切り）")
+    parser.add_argument("--m", default="8,16,32", help="M（カンマ区切り）")
+    parser.add_argument("--construction-ef", default="100,200", help="construction_ef（カンマ区切り）")
+    parser.add_argument("--search-ef", default="10,50,100,200", help="search_ef（カンマ区切り）")
+    args = parser.parse_args()
+
+    def ints(text):
+        return [int(s) for s in text.split(",")]
+
+    for size in ints(args.sizes):
+        vectors = synthetic_embeddings(size)
+        queries = synthetic_queries(vectors, min(QUERIES, size))
+        truth = exact_top_k(vectors, queries, TOP_K)
+        print(f"\n{size}件（recall@{TOP_K}・クエリ{len(queries)}件）")
+        print(f"{'M':>4} {'c_ef':>5} {'s_ef':>5} {'登録(秒)':>9} {'サイズ(MB)':>10} "
+              f"{'p50(ms)':>8} {'p95(ms)':>8} {'recall':>7}")
+        for m in ints(args.m):
+            for construction_ef in ints(args.construction_ef):
+                for r in bench_build(vectors, queries, truth, m, construction_ef, ints(args.search_ef)):
+                    print(f"{r['m']:>4} {r['construction_ef']:>5} {r['search_ef']:>5} "
+                          f"{r['build_sec']:>9.1f} {r['size_mb']:>10.1f} "
+                          f"{r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f} {r['recall']:>7.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+bench_ingredient_lookup.py
+食材の引き当てを、文字列索引（ingredient_index.py）とベクトル検索（ChromaDB）で比べるベンチマーク。
+test_search.py と同じ入力を同じように分割し、さらに表記ゆれの入力を足して、正解率とレイテンシを測る。
+
+使い方：
+    python bench_ingredient_lookup.py              # 文字列索引だけ（埋め込みモデルなしで動く）
+    python bench_ingredient_lookup.py --vector     # ChromaDB（setup_chroma.py 実行済み）とも比べる
+"""
+
+import argparse
+import json
+import statistics
+import time
+
+from ingredient_index import IngredientIndex
+from test_search import split_input
+
+INGREDIENT_JSON = "./data/ingredient_db.json"
+REPEAT = 200
+
+# test_search.py のテスト入力
+TEST_SEARCH_INPUTS = [
+    "卵とご飯とねぎ",
+    "魚肉ソーセージとピーマン",
+    "キムチと豆腐",
+    "冷蔵庫に肉と野菜がある",
+    "砂糖と塩",
+]
+
+# 単語 → 正解の食材名（None は食材DBにない＝見つからないのが正解）
+EXPECTED = {
+    "卵": "卵", "ご飯": "ご飯", "ねぎ": "ねぎ", "魚肉ソーセージ": "魚肉ソーセージ",
+    "ピーマン": "ピーマン", "キムチ": "キムチ", "豆腐": "豆腐",
+    "冷蔵庫": None, "肉": None, "野菜がある": None, "砂糖": None, "塩": None,
+    # 表記ゆれ
+    "ネギ": "ねぎ", "葱": "ねぎ", "冷ご飯": "ご飯", "ごはん": "ご飯", "たまご": "卵", "玉子": "卵",
+    "人参": "にんじん", "ニンジン": "にんじん", "玉葱": "玉ねぎ", "タマネギ": "玉ねぎ",
+    "シーチキン": "ツナ缶", "ソーセージ": "ウインナー", "ほうれんそう": "ほうれん草",
+    "鶏むね": "鶏むね肉", "しゃけ": "鮭", "ジャガイモ": "じゃがいも", "ミンチ": "豚ひき肉",
+    # 半角・長音・小書き（canonical.py）
+    "ﾈｷﾞ": "ねぎ", "ﾀﾏｺﾞ": "卵", "ｳｨﾝﾅｰ": "ウインナー", "ブロッコリ": "ブロッコリー", "シャケ": "鮭",
+    " トマト ": "トマト",
+    # 部分一致（trigram）
+    "じゃがいもスライス": "じゃがいも", "ツナ缶詰": "ツナ缶", "いかそうめん": None,
+}
+
+
+def bench_words() -> list:
+    words = []
+    for text in TEST_SEARCH_INPUTS:
+        words += split_input(text)
+    words += [w for w in EXPECTED if w not in words]
+    return words
+
+
+def evaluate(name: str, lookup, words: list):
+    correct, latencies = 0, []
+    misses = []
+    for word in words:
+        hit = lookup(word)
+        got = hit["食材名"] if hit else None
+        if got == EXPECTED.get(word):
+            correct += 1
+        else:
+            misses.append(f"{word}→{got}")
+        t0 = time.perf_counter()
+        for _ in range(REPEAT):
+            lookup(word)
+        latencies.append((time.perf_counter() - t0) / REPEAT * 1e6)
+    latencies.sort()
+    print(f"{name:<10} 正解率 {correct}/{len(words)}  "
+          f"p50 {statistics.median(latencies):>9.1f}µs  p95 {latencies[int(len(latencies) * 0.95) - 1]:>9.1f}µs")
+    if misses:
+        print(f"{'':<10} 外れ：{'、'.join(misses)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="食材引き当て（文字列索引／ベクトル検索）のベンチマーク")
+    parser.add_argument("--vector", action="store_true", help="ChromaDBのベクトル検索とも比べる")
+    args = parser.parse_args()
+
+    with open(INGREDIENT_JSON, encoding="utf-8") as f:
+        ingredients = json.load(f)
+    words = bench_words()
+
+    t0 = time.perf_counter()
+    index = IngredientIndex(ingredients)
+    print(f"文字列索引の作成：{(time.perf_counter() - t0) * 1000:.1f}ms（別名{len(index)}件）")
+    evaluate("文字列索引", index.lookup, words)
+
+    if args.vector:
+        from test_search import get_collections, search_one_ingredient
+
+        _, ingredient_col = get_collections()
+        evaluate("ベクトル", lambda w: search_one_ingredient(ingredient_col, w), words)
+
+        def combined(word):
+            return index.lookup(word) or search_one_ingredient(ingredient_col, word)
+
+        evaluate("索引→ベクトル", combined, words)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""
+bench_llm_tiering.py
+食材正規化のモデルの使い分け（小さいモデルのみ／大きいモデルのみ／段階的）を
+レイテンシと正確さで比べるベンチマーク。
+
+モード：
+    python bench_llm_tiering.py                       # ローカルのスタブ（ネットワークなし）
+    python bench_llm_tiering.py --record              # Groqに実際に聞いて応答を記録する（GROQ_API_KEY が必要）
+    python bench_llm_tiering.py --fixtures            # 記録した応答を再生して比べる
+
+スタブは local_normalizer.py で応答を組み立てる擬似モデルで、レイテンシは設定値を足し上げるだけ。
+段階的な呼び出しの流れ（聞き直しの回数・合計レイテンシ）の確認用で、正確さの比較は記録した応答で行う。
+"""
+
+import argparse
+import json
+import os
+import statistics
+import time
+
+import llm_models
+import local_normalizer
+
+INGREDIENT_JSON = "./data/ingredient_db.json"
+RECIPE_JSON = "./data/recipe_db.json"
+FIXTURES_PATH = "./data/bench/llm_tiering_fixtures.json"
+
+# ローカル正規化だけでは分からない単語が残る入力（＝実際にGroqまで来る入力）と正解
+CASES = [
+    {"input": "ビッグマック", "expected": ["牛肉", "パン", "チーズ"]},
+    {"input": "チーズバーガー", "expected": ["牛肉", "パン", "チーズ"]},
+    {"input": "ハムサンド", "expected": ["ハム", "パン"]},
+    {"input": "ぎゅうにゅうとたまご", "expected": ["牛乳", "卵"]},
+    {"input": "玉ネギとニンジン", "expected": ["玉ねぎ", "にんじん"]},
+    {"input": "シャケとほうれんそう", "expected": ["鮭", "ほうれん草"]},
+    {"input": "とりむね肉とブロッコリ", "expected": ["鶏むね肉", "ブロッコリー"]},
+    {"input": "きゃべつともやしとぶたにく", "expected": ["キャベツ", "もやし", "豚肉"]},
+    {"input": "冷凍のえだまめ", "expected": ["冷凍枝豆"]},
+    {"input": "ジャガイモとベーコン", "expected": ["じゃがいも", "ベーコン"]},
+    {"input": "コンビニの鮭おにぎり", "expected": ["鮭", "おにぎり"]},
+    {"input": "シーチキンマヨおにぎり", "expected": ["ツナ缶", "おにぎり"]},
+]
+
+# スタブの擬似レイテンシ（ミリ秒）
+STUB_LATENCY_MS = {llm_models.MODEL_SMALL: 150.0, llm_models.MODEL_LARGE: 700.0}
+
+
+class StubModels:
+    """
+    ローカルの擬似モデル。
+    小さいモデル役：辞書で分からない単語もそのまま食材として返す（名前が長すぎる・空のときだけ聞き直しになる）
+    大きいモデル役：辞書で分かった食材だけを返す
+    """
+
+    def __init__(self):
+        with open(INGREDIENT_JSON, encoding="utf-8") as f:
+            ingredients = json.load(f)
+        with open(RECIPE_JSON, encoding="utf-8") as f:
+            recipes = json.load(f)
+        self.vocab = local_normalizer.build_vocabulary(ingredients, recipes)
+
+    def respond(self, model: str, user_input: str) -> tuple[str, float]:
+        resolved, unresolved = local_normalizer.normalize(user_input, self.vocab)
+        names = resolved + unresolved if model == llm_models.MODEL_SMALL else resolved
+        raw = json.dumps({"ingredients": names, "message": local_normalizer.build_message(names)},
+                         ensure_ascii=False)
+        return raw, STUB_LATENCY_MS.get(model, STUB_LATENCY_MS[llm_models.MODEL_LARGE])
+
+
+class FixtureModels:
+    """記録した応答を再生する（レイテンシも記録した値を使う）"""
+
+    def __init__(self, path: str):
+        with open(path, encoding="utf-8") as f:
+            self.responses = json.load(f)["responses"]
+
+    def respond(self, model: str, user_input: str) -> tuple[str, float]:
+        entry = self.responses[model][user_input]
+        return entry["raw"], entry["latency_ms"]
+
+
+def record_fixtures(path: str, models: list):
+    """Groqに実際に聞いて、モデル×入力ごとの応答とレイテンシを記録する"""
+    from groq import Groq
+
+    client = Groq(api_key=os.environ["GROQ_API_KEY"])
+    responses = {}
+    for model in models:
+        responses[model] = {}
+        for case in CASES:
+            prompt = llm_models.build_normalize_prompt(case["input"])
+            t0 = time.perf_counter()
+            response = client.chat.completions.create(
+                model=model,
+                messages=[{"role": "user", "content": prompt}],
+                max_tokens=300,
+                temperature=0.7,
+            )
+            latency_ms = (time.perf_counter() - t0) * 1000
+            responses[model][case["input"]] = {
+                "raw": response.choices[0].message.content.strip(),
+                "latency_ms": latency_ms,
+            }
+            print(f"  {model} {case['input']} {latency_ms:.0f}ms")
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"recorded_at": time.strftime("%Y-%m-%d %H:%M:%S"), "responses": responses},
+                  f, ensure_ascii=False, indent=2)
+    print(f"✅ 記録しました：{path}")
+
+
+def f1_score(predicted: list, expected: list) -> float:
+    predicted, expected = set(predicted), set(expected)
+    if not predicted or not expected:
+        return float(predicted == expected)
+    hit = len(predicted & expected)
+    if hit == 0:
+        return 0.0
+    precision, recall = hit / len(predicted), hit / len(expected)
+    return 2 * precision * recall / (precision + recall)
+
+
+def run_policy(backend, policy: str) -> dict:
+    """1つの方針で全ケースを流して、レイテンシ・正確さ・聞き直し率を集計する"""
+    latencies, scores, exact, escalations = [], [], 0, 0
+    for case in CASES:
+        elapsed = [0.0]
+
+        def call_model(model, prompt, user_input=case["input"]):
+            raw, latency_ms = backend.respond(model, user_input)
+            elapsed[0] += latency_ms
+            return raw
+
+        if policy == "tiered":
+            try:
+                result = llm_models.normalize_tiered(call_model, case["input"])
+            except llm_models.NormalizeParseError:
+                result = {"ingredients": [], "escalated": True}
+            escalations += result["escalated"]
+            ingredients = result["ingredients"]
+        else:
+            model = llm_models.MODEL_SMALL if policy == "small" else llm_models.MODEL_LARGE
+            prompt = llm_models.build_normalize_prompt(case["input"])
+            parsed = llm_models.parse_normalize_response(call_model(model, prompt))
+            ingredients = parsed[0] if parsed else []
+
+        latencies.append(elapsed[0])
+        scores.append(f1_score(ingredients, case["expected"]))
+        exact += set(ingredients) == set(case["expected"])
+
+    latencies.sort()
+    return {
+        "policy": policy,
+        "mean_ms": statistics.mean(latencies),
+        "p95_ms": latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)],
+        "f1": statistics.mean(scores),
+        "exact": exact / len(CASES),
+        "escalated": escalations / len(CASES),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="食材正規化のモデル使い分けベンチマーク")
+    parser.add_argument("--record", action="store_true", help="Groqに実際に聞いて応答を記録する")
+    parser.add_argument("--fixtures", action="store_true", help="記録した応答を再生して比べる")
+    parser.add_argument("--path", default=FIXTURES_PATH, help="記録ファイルのパス")
+    args = parser.parse_args()
+
+    if args.record:
+        record_fixtures(args.path, [llm_models.MODEL_SMALL, llm_models.MODEL_LARGE])
+        return
+
+    backend = FixtureModels(args.path) if args.fixtures else StubModels()
+    print(f"バックエンド：{'記録した応答 ' + args.path if args.fixtures else 'ローカルスタブ'}")
+
+    print(f"{'方針':<8} {'平均(ms)':>9} {'p95(ms)':>9} {'F1':>6} {'完全一致':>8} {'聞き直し':>8}")
+    for policy in ("small", "large", "tiered"):
+        r = run_policy(backend, policy)
+        print(f"{r['policy']:<8} {r['mean_ms']:>9.0f} {r['p95_ms']:>9.0f} {r['f1']:>6.2f} "
+              f"{r['exact']:>8.0%} {r['escalated']:>8.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""
+bench_recipe_retrieval.py
+料理検索の2段構え（recipe_retriever.py）を、従来のコレクション全体のベクトル検索と比べるベンチマーク。
+合成レシピ（bench_recipe_shards.py と同じ作り方）で件数を増やしながら、
+従来の検索結果（上位n件）を2段構えがどれだけ拾えているか（recall）とレイテンシを測る。
+
+・候補recall：従来の上位n件のうち、1段目の候補に入っていた割合（前絞りで落としていないか）
+・上位recall：従来の上位n件のうち、2段構えの上位n件にも入っていた割合
+並べ方は search_recipes() と同じ（カテゴリ一致数の多い順 → 距離の近い順。一致率は使わない）。
+
+使い方：
+    python bench_recipe_retrieval.py                        # 擬似埋め込み（インデックス側の伸び方を見る）
+    python bench_recipe_retrieval.py --model --sizes 1000   # 本物の埋め込みモデルで recall を見る
+    python bench_recipe_retrieval.py --candidates 500 --lexical-weight 0.1
+
+擬似埋め込みは距離がランダムなので、件数が増えると従来の上位n件もランダムに決まり recall は下がる。
+候補数・重みの調整は --model で見ること。
+"""
+
+import argparse
+import json
+import random
+import shutil
+import statistics
+import tempfile
+import time
+
+import chromadb
+
+import recipe_retriever
+from bench_recipe_shards import HashEmbeddingFunction, synthetic_recipes
+from recipe_store import create_recipe_store, ingest_recipes
+
+RECIPE_JSON = "./data/recipe_db.json"
+INGREDIENT_JSON = "./data/ingredient_db.json"
+BENCH_QUERIES = 100
+TOP_N = 5
+
+
+def rank(metadatas: list, distances: list, categories: list, n: int) -> list:
+    """search_recipes() と同じ並べ方で上位n件の料理名を返す（カテゴリ一致なしは除く）"""
+    hits = []
+    for meta, distance in zip(metadatas, distances):
+        match_count = len(set(categories) & set(json.loads(meta["使える食材カテゴリ"])))
+        if match_count > 0:
+            hits.append((-match_count, distance, meta["name"]))
+    return [name for _, _, name in sorted(hits)[:n]]
+
+
+def percentile(values: list, p: float) -> float:
+    values = sorted(values)
+    return values[max(int(len(values) * p) - 1, 0)]
+
+
+def bench_one(recipes: list, embed_fn, queries: list, limit: int, lexical_weight: float) -> dict:
+    tmp = tempfile.mkdtemp(prefix="yuru_retrieval_")
+    try:
+        client = chromadb.PersistentClient(path=tmp)
+        store = create_recipe_store(client, embed_fn, 1)
+        ingest_recipes(store, recipes)
+        t0 = time.perf_counter()
+        prefilter = recipe_retriever.RecipePrefilter(recipes)
+        prefilter_ms = (time.perf_counter() - t0) * 1000
+
+        candidate_recall, top_recall = [], []
+        vector_ms, two_stage_ms = [], []
+        for categories, words, heated_only in queries:
+            query = recipe_retriever.category_query(categories)
+
+            t0 = time.perf_counter()
+            results = store.query(query_texts=[query],
+                                  n_results=min(recipe_retriever.VECTOR_FETCH_MAX, len(recipes)),
+                                  where={"加熱": 1} if heated_only else None)
+            vector_ms.append((time.perf_counter() - t0) * 1000)
+            expected = rank(results["metadatas"][0], results["distances"][0], categories, TOP_N)
+
+            t0 = time.perf_counter()
+            ids, scores = prefilter.candidates(categories, words, limit=limit, heated_only=heated_only)
+            results = recipe_retriever.rerank(store, query, ids, scores, recipes, lexical_weight)
+            two_stage_ms.append((time.perf_counter() - t0) * 1000)
+            got = rank(results["metadatas"][0], results["distances"][0], categories, TOP_N)
+
+            if expected:
+                candidates = {recipes[int(i)]["name"] for i in ids}
+                candidate_recall.append(len(candidates & set(expected)) / len(expected))
+                top_recall.append(len(set(got) & set(expected)) / len(expected))
+
+        return {
+            "prefilter_ms": prefilter_ms,
+            "candidate_recall": statistics.mean(candidate_recall) if candidate_recall else 0.0,
+            "top_recall": statistics.mean(top_recall) if top_recall else 0.0,
+            "vector_p50": statistics.median(vector_ms),
+            "vector_p95": percentile(vector_ms, 0.95),
+            "two_stage_p50": statistics.median(two_stage_ms),
+            "two_stage_p95": percentile(two_stage_ms, 0.95),
+        }
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def make_queries(base: list, ingredients: list, count: int, seed: int = 1) -> list:
+    """アプリの検索と同じ形の条件（カテゴリ1〜3個・食材名0〜3個・温度）を作る"""
+    rng = random.Random(seed)
+    categories = sorted({c for r in base for c in r["使える食材カテゴリ"]})
+    names = [item["食材名"] for item in ingredients]
+    return [
+        (rng.sample(categories, rng.randint(1, 3)), rng.sample(names, rng.randint(0, 3)),
+         rng.random() < 0.5)
+        for _ in range(count)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="料理検索（2段構え／ベクトル検索）のベンチマーク")
+    parser.add_argument("--sizes", default="1000,10000,100000", help="合成レシピの件数（カンマ区切り）")
+    parser.add_argument("--model", action="store_true", help="擬似埋め込みではなく本物の埋め込みモデルを使う")
+    parser.add_argument("--candidates", type=int, default=recipe_retriever.PREFILTER_CANDIDATES,
+                        help="1段目の候補の上限")
+    parser.add_argument("--lexical-weight", type=float, default=recipe_retriever.LEXICAL_WEIGHT,
+                        help="fused距離での BM25 の重み")
+    args = parser.parse_args()
+
+    with open(RECIPE_JSON, encoding="utf-8") as f:
+        base = json.load(f)
+    with open(INGREDIENT_JSON, encoding="utf-8") as f:
+        ingredients = json.load(f)
+    if args.model:
+        from embedding import get_embedding_function
+        embed_fn = get_embedding_function()
+    else:
+        embed_fn = HashEmbeddingFunction()
+    queries = make_queries(base, ingredients, BENCH_QUERIES)
+
+    print(f"候補上限 {args.candidates}件・BM25の重み {args.lexical_weight}・上位{TOP_N}件で比較")
+    print(f"{'件数':>9} {'索引(ms)':>9} {'候補recall':>10} {'上位recall':>10} "
+          f"{'従来p50':>8} {'従来p95':>8} {'2段p50':>8} {'2段p95':>8}")
+    for size in [int(s) for s in args.sizes.split(",")]:
+        r = bench_one(list(synthetic_recipes(base, size)), embed_fn, queries,
+                      args.candidates, args.lexical_weight)
+        print(f"{size:>9} {r['prefilter_ms']:>9.0f} {r['candidate_recall']:>10.3f} {r['top_recall']:>10.3f} "
+              f"{r['vector_p50']:>8.2f} {r['vector_p95']:>8.2f} "
+              f"{r['two_stage_p50']:>8.2f} {r['two_stage_p95']:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
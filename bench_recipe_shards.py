@@ -0,0 +1,116 @@
+"""
+bench_recipe_shards.py
+レシピストアのシャード数ごとの登録時間・検索レイテンシを測るベンチマーク。
+recipe_db.json をもとに合成レシピを作って、件数を増やしながら測定する。
+
+埋め込みモデルの速度ではなくインデックス側の伸び方を見たいので、
+埋め込みは文字列ハッシュから作る擬似ベクトルを使う。
+
+使い方：
+    python bench_recipe_shards.py
+    python bench_recipe_shards.py --sizes 10000,100000 --shards 1,4,8
+"""
+
+import argparse
+import json
+import random
+import shutil
+import statistics
+import tempfile
+import time
+import zlib
+
+import chromadb
+import numpy as np
+from chromadb.api.types import EmbeddingFunction
+
+from recipe_store import create_recipe_store, ingest_recipes
+
+RECIPE_JSON = "./data/recipe_db.json"
+BENCH_DIM = 768
+BENCH_QUERIES = 200
+
+
+class HashEmbeddingFunction(EmbeddingFunction):
+    """文字列ハッシュをシードにした擬似埋め込み（同じ文字列なら同じベクトル）"""
+
+    def __init__(self, dim: int = BENCH_DIM):
+        self.dim = dim
+
+    def __call__(self, input):
+        vectors = []
+        for text in input:
+            rng = np.random.default_rng(zlib.crc32(text.encode("utf-8")))
+            v = rng.standard_normal(self.dim).astype(np.float32)
+            vectors.append(v / np.linalg.norm(v))
+        return vectors
+
+
+def synthetic_recipes(base: list, size: int, seed: int = 0):
+    """元のレシピの食材・カテゴリを組み替えた合成レシピを size 件生成する"""
+    rng = random.Random(seed)
+    all_ingredients = sorted({i for r in base for i in r["本物の食材"]})
+    for i in range(size):
+        src = base[i % len(base)]
+        yield {
+            **src,
+            "name": f"{src['name']}_{i}",
+            "加熱": rng.random() < 0.7,
+            "本物の食材": rng.sample(all_ingredients, rng.randint(2, 6)),
+        }
+
+
+def bench_one(base: list, size: int, num_shards: int, categories: list) -> dict:
+    tmp = tempfile.mkdtemp(prefix="yuru_bench_")
+    try:
+        client = chromadb.PersistentClient(path=tmp)
+        embed_fn = HashEmbeddingFunction()
+        store = create_recipe_store(client, embed_fn, num_shards)
+
+        t0 = time.perf_counter()
+        ingest_recipes(store, synthetic_recipes(base, size))
+        build_sec = time.perf_counter() - t0
+
+        rng = random.Random(1)
+        latencies = []
+        for _ in range(BENCH_QUERIES):
+            cats = rng.sample(categories, rng.randint(1, 3))
+            query = "、".join(cats) + "を使った料理"
+            where = {"加熱": 1} if rng.random() < 0.5 else None
+            t0 = time.perf_counter()
+            store.query(query_texts=[query], n_results=20, where=where)
+            latencies.append((time.perf_counter() - t0) * 1000)
+
+        latencies.sort()
+        return {
+            "size": size,
+            "shards": num_shards,
+            "build_sec": build_sec,
+            "p50_ms": statistics.median(latencies),
+            "p95_ms": latencies[int(len(latencies) * 0.95) - 1],
+        }
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="レシピストアのシャード数ベンチマーク")
+    parser.add_argument("--sizes", default="10000,100000,1000000",
+                        help="合成レシピの件数（カンマ区切り）")
+    parser.add_argument("--shards", default="1,4,8", help="シャード数（カンマ区切り）")
+    args = parser.parse_args()
+
+    with open(RECIPE_JSON, encoding="utf-8") as f:
+        base = json.load(f)
+    categories = sorted({c for r in base for c in r["使える食材カテゴリ"]})
+
+    print(f"{'件数':>9} {'シャード':>6} {'登録(秒)':>9} {'p50(ms)':>8} {'p95(ms)':>8}")
+    for size in [int(s) for s in args.sizes.split(",")]:
+        for num_shards in [int(s) for s in args.shards.split(",")]:
+            r = bench_one(base, size, num_shards, categories)
+            print(f"{r['size']:>9} {r['shards']:>6} {r['build_sec']:>9.1f} "
+                  f"{r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
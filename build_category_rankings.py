@@ -0,0 +1,91 @@
+"""
+build_category_rankings.py
+カテゴリの組ごとの料理ランキングを事前に計算して data/category_rankings.npz に保存するスクリプト。
+アプリはこれを起動時に読み込み、表にある組の検索では埋め込みを計算しない。
+setup_chroma.py のあと（料理DBを変えたら、登録し直したあと）に実行する。
+
+使い方：
+    python build_category_rankings.py                  # カテゴリの全部の組（12種類まで）
+    python build_category_rankings.py --max-size 3     # 3個までの組だけ
+
+料理DB・埋め込みモデル・検索の設定（recipe_retriever.py）が変わると、アプリはこの表を使わなくなる。
+"""
+
+import argparse
+import itertools
+import time
+
+import chromadb
+
+import data_pack
+import embedding_store
+import recipe_retriever
+from embedding import EMBED_MODEL, get_embedding_function
+from recipe_store import open_recipe_store
+
+CHROMA_DIR = "./chroma_db"
+ALL_SUBSETS_MAX_CATEGORIES = 12   # これ以下のカテゴリ数なら全部の組を作る（2^12 − 1 = 4095組）
+DEFAULT_MAX_SIZE = 3              # カテゴリがそれより多いときの組の大きさの上限
+
+
+def category_sets(categories: list, max_size: int) -> list:
+    """大きさ1〜max_size のカテゴリの組を全部列挙する"""
+    return [
+        list(combo)
+        for size in range(1, max_size + 1)
+        for combo in itertools.combinations(sorted(categories), size)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="カテゴリの組ごとの料理ランキングの事前計算")
+    parser.add_argument("--max-size", type=int, default=0,
+                        help="組の大きさの上限（0ならカテゴリ数に応じて自動）")
+    parser.add_argument("--output", default=recipe_retriever.CATEGORY_RANKINGS_PATH, help="出力ファイル")
+    args = parser.parse_args()
+
+    catalog = data_pack.load_catalog()
+    recipes = catalog["recipes"]
+    categories = sorted(
+        {c for r in recipes for c in r["使える食材カテゴリ"]}
+        | {c for item in catalog["ingredients"] for c in item["カテゴリ"]}
+    )
+    max_size = args.max_size or (
+        len(categories) if len(categories) <= ALL_SUBSETS_MAX_CATEGORIES else DEFAULT_MAX_SIZE
+    )
+
+    client = chromadb.PersistentClient(path=CHROMA_DIR)
+    store = open_recipe_store(client, get_embedding_function())
+    if store is None:
+        raise SystemExit("レシピDBの形式が古いぞい。setup_chroma.py を実行してほしいぞい")
+    prefilter = recipe_retriever.RecipePrefilter(recipes)
+    stamp = data_pack.source_stamp([data_pack.RECIPE_JSON])
+    vectors = embedding_store.EmbeddingStore.load(
+        embedding_store.EMBED_STORE_PATH, stamp, embedding_store.store_config(EMBED_MODEL),
+    )
+
+    sets = category_sets(categories, max_size)
+    print(f"カテゴリ{len(categories)}種類・{max_size}個までの組：{len(sets)}組"
+          f"（検索方式：{recipe_retriever.RECIPE_RETRIEVER}）")
+    rankings = {}
+    t0 = time.perf_counter()
+    for i, combo in enumerate(sets, 1):
+        rankings[recipe_retriever.category_key(combo)] = recipe_retriever.rank_categories(
+            store, prefilter, combo, recipes, vectors=vectors,
+        )
+        if i % 100 == 0:
+            print(f"  {i}/{len(sets)}組")
+
+    recipe_retriever.save_rankings(
+        args.output, rankings, stamp,
+        recipe_retriever.rankings_config(
+            EMBED_MODEL,
+            vectors=embedding_store.store_config(EMBED_MODEL) if vectors is not None else "chroma",
+        ),
+    )
+    print(f"✅ {len(rankings)}組のランキングを保存しました：{args.output}"
+          f"（{time.perf_counter() - t0:.1f}秒）")
+
+
+if __name__ == "__main__":
+    main()
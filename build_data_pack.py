@@ -0,0 +1,98 @@
+"""
+build_data_pack.py
+recipe_db.json・ingredient_db.json からバイナリのデータパック（data/yuru_pack.bin）を作るスクリプト。
+JSONを編集したら実行し直す（実行し直さなくても、アプリは古いパックを使わずJSONから読む）。
+
+使い方：
+    python build_data_pack.py                          # data/yuru_pack.bin を作る
+    python build_data_pack.py --bench 10000,100000     # 合成データで読み込み時間をJSONと比べる
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+
+import catalog_stream
+from data_pack import (
+    INGREDIENT_JSON, PACK_PATH, RECIPE_JSON, DataPack, build_pack, load_catalog, source_stamp,
+)
+
+
+def load_json(path: str) -> list:
+    return catalog_stream.load_records(path)
+
+
+def build(output: str):
+    recipes = load_json(RECIPE_JSON)
+    ingredients = load_json(INGREDIENT_JSON)
+    t0 = time.perf_counter()
+    build_pack(recipes, ingredients, output, source_stamp([RECIPE_JSON, INGREDIENT_JSON]))
+    elapsed = time.perf_counter() - t0
+
+    pack = DataPack(output)
+    assert list(pack.recipes) == recipes and list(pack.ingredients) == ingredients
+    print(f"✅ {output}：料理{len(recipes)}件・食材{len(ingredients)}件・"
+          f"{os.path.getsize(output) / 1024:.1f}KB（{elapsed * 1000:.0f}ms）")
+
+
+def synthetic(base: list, size: int, seed: int = 0) -> list:
+    """元のレシピを名前・説明文を変えて size 件に増やす"""
+    rng = random.Random(seed)
+    return [
+        {**base[i % len(base)], "name": f"{base[i % len(base)]['name']}_{i}",
+         "説明文": f"{base[i % len(base)]['説明文']}（{rng.randint(0, 10 ** 6)}）"}
+        for i in range(size)
+    ]
+
+
+def bench(sizes: list):
+    base = load_json(RECIPE_JSON)
+    ingredients = load_json(INGREDIENT_JSON)
+    tmp = tempfile.mkdtemp(prefix="yuru_pack_")
+    try:
+        print(f"{'件数':>9} {'JSON読込(ms)':>12} {'パック読込(ms)':>14} {'JSON(MB)':>9} {'パック(MB)':>10}")
+        for size in sizes:
+            recipes = synthetic(base, size)
+            recipe_json = os.path.join(tmp, "recipe_db.json")
+            ingredient_json = os.path.join(tmp, "ingredient_db.json")
+            pack_path = os.path.join(tmp, "yuru_pack.bin")
+            with open(recipe_json, "w", encoding="utf-8") as f:
+                json.dump(recipes, f, ensure_ascii=False)
+            with open(ingredient_json, "w", encoding="utf-8") as f:
+                json.dump(ingredients, f, ensure_ascii=False)
+
+            t0 = time.perf_counter()
+            load_catalog(pack_path, recipe_json, ingredient_json)   # パックがないのでJSONから
+            json_ms = (time.perf_counter() - t0) * 1000
+
+            build_pack(recipes, ingredients, pack_path, source_stamp([recipe_json, ingredient_json]))
+            t0 = time.perf_counter()
+            catalog = load_catalog(pack_path, recipe_json, ingredient_json)
+            pack_ms = (time.perf_counter() - t0) * 1000
+            assert catalog["source"] == "pack"
+
+            print(f"{size:>9} {json_ms:>12.1f} {pack_ms:>14.1f} "
+                  f"{os.path.getsize(recipe_json) / 2 ** 20:>9.1f} {os.path.getsize(pack_path) / 2 ** 20:>10.1f}")
+            os.remove(pack_path)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="データパックの作成")
+    parser.add_argument("--output", default=PACK_PATH, help="出力ファイル")
+    parser.add_argument("--bench", default="", help="合成データの件数（カンマ区切り）で読み込み時間を比べる")
+    args = parser.parse_args()
+
+    if args.bench:
+        bench([int(s) for s in args.bench.split(",")])
+    else:
+        build(args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+canonical.py
+食材名の表記ゆれをそろえるモジュール（文字列索引・ローカル正規化・キャッシュのキーで共通に使う）。
+「ねぎ」「ネギ」「ﾈｷﾞ」「葱」が別々の検索・別々のキャッシュキーにならないようにする。
+
+・normalize_width()：NFKC（半角カナ→全角、全角英数→半角）と前後の空白除去。表示用の文字はそのまま
+・fold()：カタカナ→ひらがな、小書きかな→普通のかな、波線・ハイフン→長音「ー」、英字→小文字。
+  文字数を変えないので、たたんだ文字列の位置で元の文字列を切り出せる
+・canonical_key()：NFKC ＋ fold ＋ 長音と空白の除去。完全一致を引くためのキー
+  （「ブロッコリー」と「ブロッコリ」、「ウィンナー」と「ウインナー」が同じキーになる）
+・VariantDictionary：食材DBの食材名と別名表（VARIANTS）から作る、キー → 食材名 の辞書
+"""
+
+import unicodedata
+
+# 食材名 → 別名（漢字・よくある言い方）。かな/カタカナ・長音・小書きの違いは canonical_key() で吸収する
+VARIANTS = {
+    "ねぎ": ["葱", "青ねぎ", "万能ねぎ", "白ねぎ"],
+    "玉ねぎ": ["玉葱", "たまねぎ", "オニオン"],
+    "にんじん": ["人参"],
+    "じゃがいも": ["じゃが芋", "馬鈴薯", "ポテト"],
+    "さつまいも": ["さつま芋", "薩摩芋"],
+    "里芋": ["さといも"],
+    "長芋": ["ながいも", "山芋"],
+    "しょうが": ["生姜"],
+    "にんにく": ["大蒜", "ガーリック"],
+    "なす": ["茄子", "なすび"],
+    "きゅうり": ["胡瓜"],
+    "ほうれん草": ["ほうれんそう"],
+    "小松菜": ["こまつな"],
+    "白菜": ["はくさい"],
+    "大根": ["だいこん"],
+    "ごぼう": ["牛蒡"],
+    "れんこん": ["蓮根"],
+    "しいたけ": ["椎茸"],
+    "えのき": ["えのき茸", "えのきだけ"],
+    "もやし": ["萌やし"],
+    "ブロッコリー": ["ブロッコリ"],
+    "鮭": ["さけ", "しゃけ", "サーモン切り身"],
+    "アジ": ["鯵"],
+    "サンマ": ["秋刀魚"],
+    "イカ": ["烏賊"],
+    "タコ": ["蛸"],
+    "エビ": ["海老"],
+    "卵": ["玉子", "たまご", "鶏卵"],
+    "豆腐": ["とうふ"],
+    "納豆": ["なっとう"],
+    "牛乳": ["ぎゅうにゅう", "ミルク"],
+    "鶏肉": ["とりにく", "鳥肉", "チキン"],
+    "豚肉": ["ぶたにく"],
+    "牛肉": ["ぎゅうにく", "ビーフ"],
+    "鶏むね肉": ["鶏胸肉", "むね肉", "とりむね肉"],
+    "ご飯": ["ごはん", "めし"],
+    "うどん": ["饂飩"],
+    "そば": ["蕎麦"],
+}
+
+LONG_VOWEL = "ー"
+# NFKC のあとに残る、長音として打たれがちな記号
+_LONG_VOWEL_LIKE = set("〜~－-‐―—─")
+_SMALL_KANA = dict(zip("ぁぃぅぇぉっゃゅょゎゕゖ", "あいうえおつやゆよわかけ"))
+
+
+def _is_kana(c: str) -> bool:
+    return "ぁ" <= c <= "ゖ" or "ァ" <= c <= "ヺ" or c == LONG_VOWEL
+
+
+def normalize_width(text: str) -> str:
+    """NFKC で全角・半角をそろえ、前後の空白を取る（LLMや画面に渡す文字列用）"""
+    return unicodedata.normalize("NFKC", text).strip()
+
+
+def fold(text: str) -> str:
+    """
+    かなの書き分けをたたむ（文字数は変えない）。
+    NFKC 済みの文字列を渡す前提（半角カナは normalize_width() で先に全角にしておく）
+    """
+    out = []
+    for i, c in enumerate(text):
+        if "ァ" <= c <= "ヶ":
+            c = chr(ord(c) - 0x60)
+        if c in _SMALL_KANA:
+            c = _SMALL_KANA[c]
+        elif c in _LONG_VOWEL_LIKE and i > 0 and _is_kana(text[i - 1]):
+            c = LONG_VOWEL
+        elif "A" <= c <= "Z":
+            c = c.lower()
+        out.append(c)
+    return "".join(out)
+
+
+def canonical_key(text: str) -> str:
+    """完全一致用のキー（NFKC ＋ fold ＋ 長音・空白の除去）"""
+    folded = fold(normalize_width(text))
+    return "".join(c for c in folded if c != LONG_VOWEL and not c.isspace())
+
+
+class VariantDictionary:
+    """
+    canonical_key() → 食材名 の辞書。
+    優先順位：食材名そのもの ＞ VARIANTS ＞ extra（先に入ったものが勝つ）
+    """
+
+    def __init__(self, names, extra: dict | None = None):
+        names = list(names)
+        known = set(names)
+        pairs = [(name, name) for name in names]
+        for name, aliases in VARIANTS.items():
+            if name in known:
+                pairs += [(alias, name) for alias in aliases]
+        for alias, name in (extra or {}).items():
+            if name in known:
+                pairs.append((alias, name))
+        self._by_key = {}
+        for alias, name in pairs:
+            self._by_key.setdefault(canonical_key(alias), name)
+
+    def __len__(self):
+        return len(self._by_key)
+
+    def __contains__(self, text) -> bool:
+        return isinstance(text, str) and canonical_key(text) in self._by_key
+
+    def items(self):
+        """(キー, 食材名) の組を返す"""
+        return self._by_key.items()
+
+    def resolve(self, text: str) -> str | None:
+        """表記ゆれを食材名に引き当てる。知らない言葉なら None"""
+        return self._by_key.get(canonical_key(text))
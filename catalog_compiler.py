@@ -0,0 +1,283 @@
+"""
+catalog_compiler.py
+料理DB・食材DBの確認と、料理ごとの派生項目の事前計算（データコンパイラ）。
+
+・確認：必須項目・型（catalog_stream.py と同じ）に加えて、名前の重複、
+        料理の「本物の食材」が食材DBにあるか（ないと調理手順の代替がうまく働かない）、
+        「使える食材カテゴリ」が食材DBのカテゴリにあるか、「必要調理法」が知っているものか
+・派生項目：コンロが要るか・レンジで代用できるか・主食か・本物の食材の食材DBでのID・カテゴリのビットマスク
+        setup_chroma.py はこれをインデックスのメタデータに入れ、アプリは起動時に配列にして
+        検索・詳細画面では料理IDで引くだけにする（調理法のリストや主食の判定をその場でしない）
+
+使い方：
+    python catalog_compiler.py           # 料理DB・食材DBを確認して結果を表示する（エラーがあれば終了コード1）
+"""
+
+import json
+import sys
+from collections import Counter
+
+import numpy as np
+
+import catalog_stream
+import data_pack
+
+# コンロを使う調理法（これ以外は加熱なし）
+STOVE_METHODS = ("炒め", "炒め煮", "煮る", "煮込み", "焼き", "茹でる", "炊く")
+# レンジで代用できる調理法（今はコンロの調理法を全部「レンジでなんとかする」扱い）
+MICROWAVE_METHODS = STOVE_METHODS
+NO_HEAT_METHOD = "なし"
+COOKING_METHODS = STOVE_METHODS + (NO_HEAT_METHOD,)
+MAX_CATEGORIES = 63   # ChromaDB のメタデータは符号付き64ビット整数なので、ビットマスクは63ビットまで
+
+REPORT_EXAMPLES = 5   # 同じ種類の問題を表示する件数
+
+
+# ────────────────────────────
+# カテゴリのビット
+# ────────────────────────────
+class CategoryBits:
+    """カテゴリ名 → ビット位置。初めて見たカテゴリに順に割り当てる（データパックの CATS と同じ順）"""
+
+    def __init__(self, names=()):
+        self.names = []
+        self._index = {}
+        for name in names:
+            self.bit(name)
+
+    def bit(self, name: str) -> int:
+        index = self._index.get(name)
+        if index is None:
+            if len(self.names) >= MAX_CATEGORIES:
+                raise ValueError(f"カテゴリが{MAX_CATEGORIES}種類を超えるとビットマスクに入りません")
+            index = self._index[name] = len(self.names)
+            self.names.append(name)
+        return index
+
+    def mask(self, names, assign: bool = True) -> int:
+        """カテゴリ名のリスト → ビットマスク（assign=False なら知らないカテゴリは無視する）"""
+        mask = 0
+        for name in names:
+            if assign:
+                mask |= 1 << self.bit(name)
+            elif name in self._index:
+                mask |= 1 << self._index[name]
+        return mask
+
+
+# ────────────────────────────
+# 料理ごとの派生項目
+# ────────────────────────────
+def derive_recipe_fields(recipe: dict, ingredient_ids, bits: CategoryBits) -> dict:
+    """料理1件の派生項目（ingredient_ids は食材名→食材DBのID）"""
+    method = recipe["必要調理法"]
+    return {
+        "needs_stove": method in STOVE_METHODS,
+        "microwave_ok": method in MICROWAVE_METHODS,
+        "staple": data_pack.STAPLE_CATEGORY in recipe["使える食材カテゴリ"],
+        "ingredient_ids": [ingredient_ids.get(name, -1) for name in recipe["本物の食材"]],
+        "category_mask": bits.mask(recipe["使える食材カテゴリ"]),
+    }
+
+
+def index_metadata(fields: dict) -> dict:
+    """派生項目をChromaDBのメタデータにする（boolは受け付けないので0/1）"""
+    return {
+        "要コンロ": int(fields["needs_stove"]),
+        "レンジ代用可": int(fields["microwave_ok"]),
+        "主食": int(fields["staple"]),
+        "食材ID": json.dumps(fields["ingredient_ids"]),
+        "カテゴリマスク": int(fields["category_mask"]),
+    }
+
+
+class RecipeFeatures:
+    """全料理の派生項目を料理IDで引ける配列にしたもの（読み込み専用）"""
+
+    def __init__(self, needs_stove, microwave_ok, staple, category_mask,
+                 ingredient_offsets, ingredient_ids, categories: list):
+        self.needs_stove = needs_stove
+        self.microwave_ok = microwave_ok
+        self.staple = staple
+        self.category_mask = category_mask
+        self._ingredient_offsets = ingredient_offsets
+        self._ingredient_ids = ingredient_ids
+        self.bits = CategoryBits(categories)
+
+    @classmethod
+    def compile(cls, recipes, ingredients) -> "RecipeFeatures":
+        """料理DB・食材DBのリスト（JSONから読んだもの）から作る"""
+        ingredient_ids = {item["食材名"]: i for i, item in enumerate(ingredients)}
+        bits = CategoryBits(c for item in ingredients for c in item["カテゴリ"])
+        rows = [derive_recipe_fields(recipe, ingredient_ids, bits) for recipe in recipes]
+        sizes = [len(r["ingredient_ids"]) for r in rows]
+        return cls(
+            np.array([r["needs_stove"] for r in rows], dtype=bool),
+            np.array([r["microwave_ok"] for r in rows], dtype=bool),
+            np.array([r["staple"] for r in rows], dtype=bool),
+            np.array([r["category_mask"] for r in rows], dtype=np.uint64),
+            np.concatenate([[0], np.cumsum(sizes, dtype=np.int64)]),
+            np.array([i for r in rows for i in r["ingredient_ids"]], dtype=np.int32),
+            bits.names,
+        )
+
+    @classmethod
+    def from_pack(cls, pack: data_pack.DataPack) -> "RecipeFeatures":
+        """データパックから作る（主食・カテゴリ・食材IDはパックに入っているものをそのまま使う）"""
+        rows = pack.recipe_rows
+        method_ids = np.unique(rows["method"])
+        stove = [sid for sid in method_ids if pack.string(int(sid)) in STOVE_METHODS]
+        microwave = [sid for sid in method_ids if pack.string(int(sid)) in MICROWAVE_METHODS]
+        offsets = np.concatenate([[0], np.cumsum(rows["ing_count"], dtype=np.int64)])
+        ids = [pack.recipe_ingredient_ids(i) for i in range(len(rows))]
+        ids = np.concatenate(ids) if ids else np.zeros(0, dtype=np.int32)
+        return cls(
+            np.isin(rows["method"], stove), np.isin(rows["method"], microwave),
+            rows["staple"].astype(bool), rows["cat_mask"].astype(np.uint64),
+            offsets, ids.astype(np.int32), pack.categories,
+        )
+
+    @classmethod
+    def from_catalog(cls, catalog: dict) -> "RecipeFeatures":
+        """data_pack.load_catalog() の戻り値から作る"""
+        if catalog["pack"] is not None:
+            return cls.from_pack(catalog["pack"])
+        return cls.compile(catalog["recipes"], catalog["ingredients"])
+
+    def __len__(self):
+        return len(self.needs_stove)
+
+    def fields(self, rid: int) -> dict:
+        """料理1件の派生項目（derive_recipe_fields() と同じ形）"""
+        return {
+            "needs_stove": bool(self.needs_stove[rid]),
+            "microwave_ok": bool(self.microwave_ok[rid]),
+            "staple": bool(self.staple[rid]),
+            "ingredient_ids": [int(i) for i in self.ingredient_ids(rid)],
+            "category_mask": int(self.category_mask[rid]),
+        }
+
+    def ingredient_ids(self, rid: int) -> np.ndarray:
+        """料理の本物の食材の、食材DBでのID（食材DBにないものは -1）"""
+        return self._ingredient_ids[self._ingredient_offsets[rid]:self._ingredient_offsets[rid + 1]]
+
+    def categories_mask(self, names) -> int:
+        """検索条件のカテゴリ → ビットマスク（料理にないカテゴリは無視する）"""
+        return self.bits.mask(names, assign=False)
+
+    def match_count(self, rid: int, mask: int) -> int:
+        """料理のカテゴリと検索条件のカテゴリの一致数"""
+        return (int(self.category_mask[rid]) & mask).bit_count()
+
+
+# ────────────────────────────
+# 確認
+# ────────────────────────────
+class CatalogValidator:
+    """
+    食材DB → 料理DBの順に1件ずつ確認して、問題を貯める（ファイルを全部読み込まなくても使える）。
+    問題は (レベル, 種類, 場所, 内容)。レベルは "error"（データを直すべき）か "warning"
+    """
+
+    def __init__(self):
+        self.issues = []
+        self.ingredient_ids = {}
+        self.ingredient_categories = set()
+        self.bits = CategoryBits()
+        self._recipe_names = set()
+
+    def _add(self, level: str, kind: str, where: str, message: str):
+        self.issues.append((level, kind, where, message))
+
+    def check_ingredient(self, index: int, item, where: str = "") -> bool:
+        where = where or f"食材{index + 1}件目"
+        try:
+            catalog_stream.check_fields(item, catalog_stream.INGREDIENT_FIELDS, where=where)
+        except ValueError as e:
+            self._add("error", "形式", where, str(e).removeprefix(f"{where}："))
+            return False
+        name = item["食材名"]
+        if name in self.ingredient_ids:
+            self._add("error", "重複", where, f"食材名「{name}」が重複しています")
+        else:
+            self.ingredient_ids[name] = index
+        if not item["カテゴリ"]:
+            self._add("warning", "カテゴリなし", where, f"「{name}」にカテゴリがありません")
+        self.ingredient_categories.update(item["カテゴリ"])
+        self.bits.mask(item["カテゴリ"])
+        return True
+
+    def check_recipe(self, index: int, recipe, where: str = ""):
+        """料理1件を確認して派生項目を返す（形式が壊れているときは None）"""
+        where = where or f"料理{index + 1}件目"
+        try:
+            catalog_stream.check_fields(recipe, catalog_stream.RECIPE_FIELDS,
+                                        catalog_stream.RECIPE_OPTIONAL_FIELDS, where)
+        except ValueError as e:
+            self._add("error", "形式", where, str(e).removeprefix(f"{where}："))
+            return None
+        name = recipe["name"]
+        where = f"{where}「{name}」"
+        if name in self._recipe_names:
+            self._add("error", "重複", where, "料理名が重複しています")
+        self._recipe_names.add(name)
+        if not recipe["本物の食材"]:
+            self._add("warning", "食材なし", where, "本物の食材がありません")
+        for ingredient in recipe["本物の食材"]:
+            if ingredient not in self.ingredient_ids:
+                self._add("error", "食材DBにない食材", where, f"「{ingredient}」が食材DBにありません")
+        for category in recipe["使える食材カテゴリ"]:
+            if category not in self.ingredient_categories:
+                self._add("error", "知らないカテゴリ", where, f"カテゴリ「{category}」の食材が食材DBにありません")
+        if recipe["必要調理法"] not in COOKING_METHODS:
+            self._add("warning", "知らない調理法", where,
+                      f"調理法「{recipe['必要調理法']}」はコンロなし扱いになります")
+        return derive_recipe_fields(recipe, self.ingredient_ids, self.bits)
+
+    @property
+    def errors(self) -> list:
+        return [issue for issue in self.issues if issue[0] == "error"]
+
+    def report(self) -> list:
+        """種類ごとにまとめた表示用の行"""
+        lines = []
+        counts = Counter((level, kind) for level, kind, _, _ in self.issues)
+        for (level, kind), count in sorted(counts.items()):
+            mark = "❌" if level == "error" else "⚠️"
+            lines.append(f"{mark} {kind}：{count}件")
+            examples = [(w, m) for lv, k, w, m in self.issues if (lv, k) == (level, kind)]
+            for where, message in examples[:REPORT_EXAMPLES]:
+                lines.append(f"    {where}：{message}")
+            if count > REPORT_EXAMPLES:
+                lines.append(f"    …ほか{count - REPORT_EXAMPLES}件")
+        return lines
+
+
+def validate_files(recipe_path: str = data_pack.RECIPE_JSON,
+                   ingredient_path: str = data_pack.INGREDIENT_JSON) -> CatalogValidator:
+    """料理DB・食材DBのファイルを1件ずつ読んで確認する"""
+    validator = CatalogValidator()
+    for i, item in enumerate(catalog_stream.iter_records(ingredient_path)):
+        validator.check_ingredient(i, item, f"{ingredient_path}：食材{i + 1}件目")
+    for i, recipe in enumerate(catalog_stream.iter_records(recipe_path)):
+        validator.check_recipe(i, recipe, f"{recipe_path}：料理{i + 1}件目")
+    return validator
+
+
+def main():
+    try:
+        validator = validate_files()
+    except ValueError as e:   # JSONとして読めない
+        print(f"❌ {e}")
+        sys.exit(1)
+    lines = validator.report()
+    if not lines:
+        print("✅ 料理DB・食材DBに問題はありませんでした")
+        return
+    print("\n".join(lines))
+    if validator.errors:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
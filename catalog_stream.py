@@ -0,0 +1,174 @@
+"""
+catalog_stream.py
+料理DB・食材DBを1件ずつ読むリーダー（setup_chroma.py の登録で使う）。
+ファイル全体をリストにしないので、カタログが何GBになっても読み込みのメモリは一定。
+
+・JSON：トップレベルが配列のファイル（今の recipe_db.json / ingredient_db.json）を、
+        少しずつ読みながら要素を1件ずつ取り出す
+・JSON Lines（.jsonl / .ndjson）：1行に1件
+どちらも1件ごとに必須項目と型を確かめ、おかしいときは何件目（何行目）かを付けて ValueError にする。
+形式は拡張子で決める（setup_chroma.py とアプリの data_pack.load_catalog() で同じ読み方になるように）。
+"""
+
+import json
+import os
+
+READ_CHUNK_CHARS = 1 << 20   # 1回に読む文字数
+
+JSONL_SUFFIXES = (".jsonl", ".ndjson")
+JSON_WHITESPACE = " \t\r\n"
+_NUMBER_CHARS = set("0123456789.eE+-")
+
+# 必須項目と型（加工手順は無くてもよい）
+RECIPE_FIELDS = {
+    "name": str,
+    "ジャンル": str,
+    "加熱": bool,
+    "本物の食材": list,
+    "使える食材カテゴリ": list,
+    "必要調理法": str,
+    "説明文": str,
+}
+RECIPE_OPTIONAL_FIELDS = {"加工手順": list}
+INGREDIENT_FIELDS = {
+    "食材名": str,
+    "カテゴリ": list,
+    "生食可": bool,
+    "説明": str,
+}
+
+
+# ────────────────────────────
+# 読み込み
+# ────────────────────────────
+def _number_may_continue(item, buf: str, end: int) -> bool:
+    """buf[:end] まで読んだ数値が、まだ続いているかもしれないか"""
+    if isinstance(item, bool) or not isinstance(item, (int, float)):
+        return False
+    return end == len(buf) or buf[end] in _NUMBER_CHARS
+
+
+def iter_json_array(path: str, chunk_chars: int = READ_CHUNK_CHARS):
+    """トップレベルが配列のJSONファイルから、要素を1件ずつ返す（要素の間はカンマ1つだけ）"""
+    decoder = json.JSONDecoder()
+    with open(path, encoding="utf-8") as f:
+        buf = f.read(chunk_chars)
+        eof = len(buf) < chunk_chars   # テキストの read は最後以外は指定した文字数を返す
+        pos = 1 if buf.startswith("\ufeff") else 0
+
+        def next_char() -> str:
+            """空白を飛ばして次の文字を返す（ファイルの終わりなら ""）"""
+            nonlocal buf, pos, eof
+            while True:
+                while pos < len(buf) and buf[pos] in JSON_WHITESPACE:
+                    pos += 1
+                if pos < len(buf) or eof:
+                    return buf[pos] if pos < len(buf) else ""
+                buf, pos = f.read(chunk_chars), 0
+                eof = len(buf) < chunk_chars
+
+        if next_char() != "[":
+            raise ValueError(f"{path}：トップレベルが配列ではありません")
+        pos += 1
+        ch = next_char()
+        if ch == "]":
+            return
+        index = 0
+        while True:
+            if ch == "":
+                raise ValueError(f"{path}：配列が閉じていません")
+            if ch == ",":
+                raise ValueError(f"{path}：{index + 1}件目の前に余分なカンマがあります")
+            # 1件分がバッファに収まるまで読み足す
+            while True:
+                try:
+                    item, end = decoder.raw_decode(buf, pos)
+                    # 数値はバッファの端で切れていても短く読めてしまう（7.5e3 → 7.5）ので、続きが見えるまで読み足す
+                    if eof or not _number_may_continue(item, buf, end):
+                        break
+                    error = None
+                except json.JSONDecodeError as e:
+                    error = e
+                if eof:
+                    raise ValueError(f"{path}：{index + 1}件目を読めません（{error.msg}）") from None
+                more = f.read(chunk_chars)
+                eof = len(more) < chunk_chars
+                buf, pos = buf[pos:] + more, 0
+            yield item
+            index += 1
+            pos = end
+            if pos > chunk_chars:   # 読み終えた分は捨てる
+                buf, pos = buf[pos:], 0
+
+            ch = next_char()
+            if ch == "]":
+                return
+            if ch == "":
+                raise ValueError(f"{path}：配列が閉じていません")
+            if ch != ",":
+                raise ValueError(f"{path}：{index}件目のあとにカンマがありません")
+            pos += 1
+            ch = next_char()
+            if ch == "]":
+                raise ValueError(f"{path}：配列の最後に余分なカンマがあります")
+
+
+def iter_jsonl(path: str):
+    """JSON Lines ファイルから1行1件ずつ返す（空行は飛ばす）"""
+    with open(path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"{path}：{line_no}行目を読めません（{e.msg}）") from None
+
+
+def detect_format(path: str, fmt: str = "auto") -> str:
+    if fmt != "auto":
+        return fmt
+    return "jsonl" if os.path.splitext(path)[1].lower() in JSONL_SUFFIXES else "json"
+
+
+def iter_records(path: str, fmt: str = "auto"):
+    """JSON（配列）か JSON Lines のファイルから1件ずつ返す"""
+    if detect_format(path, fmt) == "jsonl":
+        return iter_jsonl(path)
+    return iter_json_array(path)
+
+
+# ────────────────────────────
+# 1件ごとの確認
+# ────────────────────────────
+def check_fields(record, fields: dict, optional: dict = None, where: str = "") -> dict:
+    """必須項目がそろっていて型が合っているか確かめる。おかしいときは ValueError"""
+    if not isinstance(record, dict):
+        raise ValueError(f"{where}：オブジェクトではありません")
+    for key, kind in {**fields, **(optional or {})}.items():
+        if key not in record:
+            if key in fields:
+                raise ValueError(f"{where}：「{key}」がありません")
+            continue
+        value = record[key]
+        if not isinstance(value, kind):
+            raise ValueError(f"{where}：「{key}」の型が {kind.__name__} ではありません")
+        if kind is list and not all(isinstance(v, str) for v in value):
+            raise ValueError(f"{where}：「{key}」に文字列でない要素があります")
+    return record
+
+
+def iter_recipes(path: str, fmt: str = "auto"):
+    for i, recipe in enumerate(iter_records(path, fmt)):
+        yield check_fields(recipe, RECIPE_FIELDS, RECIPE_OPTIONAL_FIELDS, f"{path}：料理{i + 1}件目")
+
+
+def iter_ingredients(path: str, fmt: str = "auto"):
+    for i, item in enumerate(iter_records(path, fmt)):
+        yield check_fields(item, INGREDIENT_FIELDS, where=f"{path}：食材{i + 1}件目")
+
+
+def load_records(path: str, fmt: str = "auto") -> list:
+    """全件をリストで返す（JSON Lines も読める json.load の代わり）"""
+    return list(iter_records(path, fmt))
@@ -1,12 +1,12 @@
 # check_chroma.py
 import chromadb
-from chromadb.utils import embedding_functions
+
+from embedding import get_embedding_function
 
 CHROMA_DIR = "./chroma_db"
-EMBED_MODEL = "paraphrase-multilingual-mpnet-base-v2"
 
 client = chromadb.PersistentClient(path=CHROMA_DIR)
-embed_fn = embedding_functions.SentenceTransformerEmbeddingFunction(model_name=EMBED_MODEL)
+embed_fn = get_embedding_function()
 
 col = client.get_collection(name="ingredients", embedding_function=embed_fn)
 
@@ -0,0 +1,405 @@
+"""
+data_pack.py
+recipe_db.json・ingredient_db.json をまとめた読み込み専用のバイナリパック。
+
+JSONが編集用の正本で、パックは build_data_pack.py で作る読み込み用のコピー。
+パックは mmap で開くだけなので、件数が増えても読み込み時間・メモリはほぼ増えない
+（料理・食材の dict は使うときに1件ずつ組み立てる）。
+
+形式（リトルエンディアン、各セクションは8バイト境界）：
+    ヘッダー     : マジック "YURUPACK"・バージョン・セクション数・元JSONのスタンプ
+    セクション表 : (タグ4文字, 先頭位置, バイト数) × セクション数
+    STRO / STRB  : 文字列プール（同じ文字列は1回だけ持つ）。STROは各文字列の開始位置
+    CATS         : カテゴリ名（文字列ID）。カテゴリの順番がビットマスクのビット位置
+    INGR / RECP  : 食材・料理の固定長レコード（INGREDIENT_DTYPE / RECIPE_DTYPE）
+    ICAT / RCAT  : 各レコードのカテゴリ（CATSの番号、元の並び順のまま）
+    RING / RIID  : 料理の本物の食材（文字列ID）と、その食材DBでのID（なければ -1）
+    STEP         : 料理の加工手順（文字列ID）
+    COLS / RCOL  : 一致率計算用の食材の列（文字列ID）と、料理ごとの列番号（重複なし）
+    ISRT / RSRT  : 名前順に並べたレコードID（名前→IDの二分探索用）
+
+JSONがパックより新しい（スタンプが合わない）ときは、load_catalog() がJSONから読む。
+"""
+
+import mmap
+import os
+import struct
+import zlib
+from collections.abc import Mapping, Sequence
+
+import numpy as np
+
+import catalog_stream
+
+PACK_PATH = "./data/yuru_pack.bin"
+# 元データ（JSON Lines でもよい。拡張子が .jsonl / .ndjson なら1行1件として読む）
+RECIPE_JSON = os.environ.get("YURU_RECIPE_JSON", "./data/recipe_db.json")
+INGREDIENT_JSON = os.environ.get("YURU_INGREDIENT_JSON", "./data/ingredient_db.json")
+
+PACK_MAGIC = b"YURUPACK"
+PACK_VERSION = 1
+STAPLE_CATEGORY = "主食系"
+
+_HEADER = struct.Struct("<8sII16s")
+_SECTION = struct.Struct("<4sQQ")
+
+INGREDIENT_DTYPE = np.dtype([
+    ("name", "<u4"), ("desc", "<u4"), ("cat_mask", "<u8"),
+    ("cat_start", "<u4"), ("cat_count", "u1"), ("raw_ok", "u1"),
+])
+RECIPE_DTYPE = np.dtype([
+    ("name", "<u4"), ("genre", "<u4"), ("method", "<u4"), ("desc", "<u4"),
+    ("cat_mask", "<u8"), ("cat_start", "<u4"), ("cat_count", "u1"),
+    ("heated", "u1"), ("staple", "u1"),
+    ("ing_start", "<u4"), ("ing_count", "<u2"),
+    ("step_start", "<u4"), ("step_count", "<u2"),
+    ("col_start", "<u4"), ("col_count", "<u2"),
+])
+
+_SECTION_DTYPES = {
+    b"STRO": np.dtype("<u8"), b"STRB": np.dtype("u1"), b"CATS": np.dtype("<u4"),
+    b"INGR": INGREDIENT_DTYPE, b"RECP": RECIPE_DTYPE,
+    b"ICAT": np.dtype("u1"), b"RCAT": np.dtype("u1"),
+    b"RING": np.dtype("<u4"), b"RIID": np.dtype("<i4"), b"STEP": np.dtype("<u4"),
+    b"COLS": np.dtype("<u4"), b"RCOL": np.dtype("<u4"),
+    b"ISRT": np.dtype("<u4"), b"RSRT": np.dtype("<u4"),
+}
+
+
+def source_stamp(paths: list) -> bytes:
+    """元JSONのサイズと更新時刻から作るスタンプ（中身を読まずにパックの鮮度を確かめるため）"""
+    parts = []
+    for path in paths:
+        st = os.stat(path)
+        parts.append(f"{os.path.basename(path)}:{st.st_size}:{st.st_mtime_ns}")
+    digest = "|".join(parts).encode("utf-8")
+    return struct.pack("<IIII", *(zlib.crc32(digest, seed) for seed in range(4)))
+
+
+def build_recipe_csr(recipes) -> dict:
+    """
+    料理×食材の疎行列（CSR形式のインデックス配列）を作る。一致率を全料理まとめて計算するために使う。
+    ingredient_ids: 食材名 → 列番号
+    """
+    ingredient_ids = {}
+    row_ids, col_ids, sizes = [], [], []
+    for i, recipe in enumerate(recipes):
+        real = dict.fromkeys(recipe["本物の食材"])   # 重複を除く（順番は保つ）
+        for name in real:
+            row_ids.append(i)
+            col_ids.append(ingredient_ids.setdefault(name, len(ingredient_ids)))
+        sizes.append(len(real))
+    return {
+        "ingredient_ids": ingredient_ids,
+        "row_ids": np.array(row_ids, dtype=np.int32),
+        "col_ids": np.array(col_ids, dtype=np.int32),
+        "sizes": np.array(sizes, dtype=np.int32),
+    }
+
+
+# ────────────────────────────
+# 書き出し
+# ────────────────────────────
+class _StringPool:
+    def __init__(self):
+        self.ids = {}
+        self.blobs = []
+
+    def add(self, text: str) -> int:
+        sid = self.ids.get(text)
+        if sid is None:
+            sid = self.ids[text] = len(self.blobs)
+            self.blobs.append(text.encode("utf-8"))
+        return sid
+
+
+def build_pack(recipes: list, ingredients: list, path: str, stamp: bytes = b"\0" * 16):
+    """料理・食材のリストからパックを作って path に書き出す（一時ファイル経由で置き換える）"""
+    strings = _StringPool()
+    categories = []
+    category_index = {}
+
+    def category_ids(names: list) -> list:
+        ids = []
+        for name in names:
+            if name not in category_index:
+                if len(categories) >= 64:
+                    raise ValueError("カテゴリが64種類を超えるとビットマスクに入りません")
+                category_index[name] = len(categories)
+                categories.append(strings.add(name))
+            ids.append(category_index[name])
+        return ids
+
+    def mask_of(ids: list) -> int:
+        mask = 0
+        for c in ids:
+            mask |= 1 << c
+        return mask
+
+    ingredient_rows = np.zeros(len(ingredients), dtype=INGREDIENT_DTYPE)
+    ingredient_cats = []
+    for i, item in enumerate(ingredients):
+        cats = category_ids(item["カテゴリ"])
+        ingredient_rows[i] = (
+            strings.add(item["食材名"]), strings.add(item["説明"]), mask_of(cats),
+            len(ingredient_cats), len(cats), bool(item["生食可"]),
+        )
+        ingredient_cats.extend(cats)
+    ingredient_ids = {item["食材名"]: i for i, item in enumerate(ingredients)}
+
+    csr = build_recipe_csr(recipes)
+    columns = [strings.add(name) for name in csr["ingredient_ids"]]
+    recipe_rows = np.zeros(len(recipes), dtype=RECIPE_DTYPE)
+    recipe_cats, real_sids, real_ids, steps = [], [], [], []
+    col_start = 0
+    for i, recipe in enumerate(recipes):
+        cats = category_ids(recipe["使える食材カテゴリ"])
+        recipe_rows[i] = (
+            strings.add(recipe["name"]), strings.add(recipe["ジャンル"]),
+            strings.add(recipe["必要調理法"]), strings.add(recipe["説明文"]),
+            mask_of(cats), len(recipe_cats), len(cats),
+            bool(recipe["加熱"]), STAPLE_CATEGORY in recipe["使える食材カテゴリ"],
+            len(real_sids), len(recipe["本物の食材"]),
+            len(steps), len(recipe["加工手順"]),
+            col_start, int(csr["sizes"][i]),
+        )
+        col_start += int(csr["sizes"][i])
+        recipe_cats.extend(cats)
+        for name in recipe["本物の食材"]:
+            real_sids.append(strings.add(name))
+            real_ids.append(ingredient_ids.get(name, -1))
+        steps.extend(strings.add(step) for step in recipe["加工手順"])
+
+    offsets = np.zeros(len(strings.blobs) + 1, dtype="<u8")
+    offsets[1:] = np.cumsum([len(b) for b in strings.blobs])
+
+    def sorted_ids(rows) -> np.ndarray:
+        order = sorted(range(len(rows)), key=lambda i: strings.blobs[rows[i]["name"]])
+        return np.array(order, dtype="<u4")
+
+    sections = [
+        (b"STRO", offsets),
+        (b"STRB", np.frombuffer(b"".join(strings.blobs), dtype="u1")),
+        (b"CATS", np.array(categories, dtype="<u4")),
+        (b"INGR", ingredient_rows),
+        (b"RECP", recipe_rows),
+        (b"ICAT", np.array(ingredient_cats, dtype="u1")),
+        (b"RCAT", np.array(recipe_cats, dtype="u1")),
+        (b"RING", np.array(real_sids, dtype="<u4")),
+        (b"RIID", np.array(real_ids, dtype="<i4")),
+        (b"STEP", np.array(steps, dtype="<u4")),
+        (b"COLS", np.array(columns, dtype="<u4")),
+        (b"RCOL", csr["col_ids"].astype("<u4")),
+        (b"ISRT", sorted_ids(ingredient_rows)),
+        (b"RSRT", sorted_ids(recipe_rows)),
+    ]
+
+    position = _align(_HEADER.size + _SECTION.size * len(sections))
+    table, payloads = [], []
+    for tag, array in sections:
+        data = array.tobytes()
+        table.append(_SECTION.pack(tag, position, len(data)))
+        payloads.append((position, data))
+        position = _align(position + len(data))
+
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(_HEADER.pack(PACK_MAGIC, PACK_VERSION, len(sections), stamp))
+        f.write(b"".join(table))
+        for offset, data in payloads:
+            f.write(b"\0" * (offset - f.tell()))
+            f.write(data)
+    os.replace(tmp, path)
+
+
+def _align(n: int) -> int:
+    return (n + 7) & ~7
+
+
+# ────────────────────────────
+# 読み込み
+# ────────────────────────────
+class DataPack:
+    """mmap で開いたパック。配列はファイルの中身をそのまま指す（コピーしない）"""
+
+    def __init__(self, path: str = PACK_PATH):
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count, self.stamp = _HEADER.unpack_from(self._mmap, 0)
+        if magic != PACK_MAGIC or version != PACK_VERSION:
+            raise ValueError(f"データパックの形式が違います：{path}")
+        self._sections = {}
+        for i in range(count):
+            tag, offset, size = _SECTION.unpack_from(self._mmap, _HEADER.size + i * _SECTION.size)
+            dtype = _SECTION_DTYPES[tag]
+            self._sections[tag] = np.frombuffer(self._mmap, dtype=dtype,
+                                                count=size // dtype.itemsize, offset=offset)
+        s = self._sections
+        self._string_offsets, self._string_bytes = s[b"STRO"], s[b"STRB"]
+        self.categories = [self.string(sid) for sid in s[b"CATS"]]
+        self.ingredient_rows, self.recipe_rows = s[b"INGR"], s[b"RECP"]
+        self.ingredients = _Records(self._ingredient, len(self.ingredient_rows))
+        self.recipes = _Records(self._recipe, len(self.recipe_rows))
+        self.ingredient_name_to_id = _NameIndex(self, self.ingredient_rows, s[b"ISRT"])
+        self.recipe_name_to_id = _NameIndex(self, self.recipe_rows, s[b"RSRT"])
+
+    def string_bytes(self, sid: int) -> bytes:
+        start, end = self._string_offsets[sid], self._string_offsets[sid + 1]
+        return self._string_bytes[start:end].tobytes()
+
+    def string(self, sid: int) -> str:
+        return self.string_bytes(sid).decode("utf-8")
+
+    def _strings(self, tag: bytes, start: int, count: int) -> list:
+        return [self.string(sid) for sid in self._sections[tag][start:start + count]]
+
+    def _categories(self, tag: bytes, start: int, count: int) -> list:
+        return [self.categories[c] for c in self._sections[tag][start:start + count]]
+
+    def _ingredient(self, i: int) -> dict:
+        row = self.ingredient_rows[i]
+        return {
+            "食材名": self.string(row["name"]),
+            "カテゴリ": self._categories(b"ICAT", row["cat_start"], row["cat_count"]),
+            "生食可": bool(row["raw_ok"]),
+            "説明": self.string(row["desc"]),
+        }
+
+    def _recipe(self, i: int) -> dict:
+        row = self.recipe_rows[i]
+        return {
+            "name": self.string(row["name"]),
+            "ジャンル": self.string(row["genre"]),
+            "加熱": bool(row["heated"]),
+            "本物の食材": self._strings(b"RING", row["ing_start"], row["ing_count"]),
+            "使える食材カテゴリ": self._categories(b"RCAT", row["cat_start"], row["cat_count"]),
+            "必要調理法": self.string(row["method"]),
+            "加工手順": self._strings(b"STEP", row["step_start"], row["step_count"]),
+            "説明文": self.string(row["desc"]),
+        }
+
+    def recipe_ingredient_ids(self, i: int) -> np.ndarray:
+        """料理の本物の食材の、食材DBでのID（食材DBにないものは -1）"""
+        row = self.recipe_rows[i]
+        return self._sections[b"RIID"][row["ing_start"]:row["ing_start"] + row["ing_count"]]
+
+    def category_mask(self, names: list) -> int:
+        """カテゴリ名のリスト → ビットマスク（パックにないカテゴリは無視）"""
+        mask = 0
+        for name in names:
+            if name in self.categories:
+                mask |= 1 << self.categories.index(name)
+        return mask
+
+    def recipe_csr(self) -> dict:
+        """build_recipe_csr() と同じ形の疎行列（パックに入っている列番号をそのまま使う）"""
+        sizes = self.recipe_rows["col_count"].astype(np.int32)
+        return {
+            "ingredient_ids": {self.string(sid): col for col, sid in enumerate(self._sections[b"COLS"])},
+            "row_ids": np.repeat(np.arange(len(sizes), dtype=np.int32), sizes),
+            "col_ids": self._sections[b"RCOL"].astype(np.int32),
+            "sizes": sizes,
+        }
+
+
+class _Records(Sequence):
+    """レコードを使うときに1件ずつ dict に組み立てるリスト風のオブジェクト"""
+
+    def __init__(self, build, length: int):
+        self._build = build
+        self._length = length
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._build(j) for j in range(*i.indices(self._length))]
+        if i < 0:
+            i += self._length
+        if not 0 <= i < self._length:
+            raise IndexError(i)
+        return self._build(i)
+
+
+class _NameIndex(Mapping):
+    """名前 → レコードID の読み込み専用の辞書（名前順のID表を二分探索する）"""
+
+    def __init__(self, pack: DataPack, rows: np.ndarray, order: np.ndarray):
+        self._pack = pack
+        self._names = rows["name"]
+        self._order = order
+
+    def _find(self, name) -> int:
+        if not isinstance(name, str):
+            return -1
+        key = name.encode("utf-8")
+        lo, hi = 0, len(self._order)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._pack.string_bytes(self._names[self._order[mid]]) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self._order):
+            record = int(self._order[lo])
+            if self._pack.string_bytes(self._names[record]) == key:
+                return record
+        return -1
+
+    def __getitem__(self, name):
+        record = self._find(name)
+        if record < 0:
+            raise KeyError(name)
+        return record
+
+    def __contains__(self, name):
+        return self._find(name) >= 0
+
+    def __iter__(self):
+        for record in self._order:
+            yield self._pack.string(self._names[record])
+
+    def __len__(self):
+        return len(self._order)
+
+
+# ────────────────────────────
+# 読み込み口（パックが新しければパック、なければJSON）
+# ────────────────────────────
+def load_catalog(pack_path: str = PACK_PATH, recipe_json: str = RECIPE_JSON,
+                 ingredient_json: str = INGREDIENT_JSON) -> dict:
+    """
+    料理・食材の全件を返す。
+    戻り値: {"source", "pack", "ingredients", "recipes", "ingredient_name_to_id", "recipe_name_to_id", "recipe_csr"}
+      source は "pack" か "json"。pack のとき ingredients・recipes は1件ずつ組み立てる読み込み専用のリスト、
+      pack は DataPack（JSONから読んだときは None）
+    """
+    stamp = source_stamp([recipe_json, ingredient_json])
+    if os.path.exists(pack_path):
+        try:
+            pack = DataPack(pack_path)
+        except (ValueError, KeyError, struct.error):
+            pack = None
+        if pack is not None and pack.stamp == stamp:
+            return {
+                "source": "pack",
+                "pack": pack,
+                "ingredients": pack.ingredients,
+                "recipes": pack.recipes,
+                "ingredient_name_to_id": pack.ingredient_name_to_id,
+                "recipe_name_to_id": pack.recipe_name_to_id,
+                "recipe_csr": pack.recipe_csr(),
+            }
+
+    ingredients = catalog_stream.load_records(ingredient_json)
+    recipes = catalog_stream.load_records(recipe_json)
+    return {
+        "source": "json",
+        "pack": None,
+        "ingredients": ingredients,
+        "recipes": recipes,
+        "ingredient_name_to_id": {item["食材名"]: i for i, item in enumerate(ingredients)},
+        "recipe_name_to_id": {r["name"]: i for i, r in enumerate(recipes)},
+        "recipe_csr": build_recipe_csr(recipes),
+    }
@@ -0,0 +1,112 @@
+"""
+embed_server.py
+埋め込みモデルを1回だけ読み込んで、同じマシンの複数プロセスに埋め込みを返すサーバー。
+Streamlitを複数プロセスで動かすときや、setup_chroma.py などのスクリプトと同時に使うときに、
+プロセスごとにモデルを読み込まなくて済むようにする。
+
+使い方：
+    python embed_server.py                                 # unix:/tmp/yuru_embed.sock で待ち受け
+    python embed_server.py --listen 127.0.0.1:8765         # localhost のTCPで待ち受け
+
+クライアント側は環境変数 YURU_EMBED_SERVER に同じアドレスを設定する（embedding.py 参照）。
+"""
+
+import argparse
+import json
+import os
+import socket
+import socketserver
+
+import numpy as np
+
+from embedding import (
+    EMBED_BATCH_MAX_ITEMS, EMBED_BATCH_WAIT_MS, EMBED_MODEL, MicroBatcher,
+    parse_address, recv_frame, send_frame,
+)
+
+DEFAULT_LISTEN = "unix:/tmp/yuru_embed.sock"
+ENCODE_BATCH_SIZE = 32
+
+
+class EmbedHandler(socketserver.BaseRequestHandler):
+    """1接続ぶんのリクエストを順番に処理する（接続は使い回される）"""
+
+    def handle(self):
+        while True:
+            try:
+                request = json.loads(recv_frame(self.request))
+            except (ConnectionError, OSError):
+                return
+            try:
+                vectors = self.server.encode(request["texts"])
+            except Exception as e:
+                send_frame(self.request, json.dumps({"error": str(e)}).encode("utf-8"))
+                continue
+            header = {"count": int(vectors.shape[0]), "dim": int(vectors.shape[1])}
+            send_frame(self.request, json.dumps(header).encode("utf-8"))
+            self.request.sendall(vectors.astype(np.float32).tobytes())
+
+
+class _EmbedServerMixin:
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def setup_model(self, model_name: str, max_wait_ms: float, max_items: int):
+        from sentence_transformers import SentenceTransformer
+
+        print(f"埋め込みモデルを読み込み中…（{model_name}）")
+        self.model = SentenceTransformer(model_name)
+        # 接続をまたいで同時に来たリクエストを1回のバッチ推論にまとめる
+        # （推論は専用スレッド1本だけで行うのでCPUの取り合いも起きない）
+        self.batcher = MicroBatcher(self._encode_batch, max_wait_ms, max_items,
+                                    metrics_prefix="embed_server")
+
+    def _encode_batch(self, texts: list) -> np.ndarray:
+        return self.model.encode(
+            texts, batch_size=ENCODE_BATCH_SIZE, convert_to_numpy=True,
+            normalize_embeddings=False,
+        )
+
+    def encode(self, texts: list) -> np.ndarray:
+        return np.asarray(self.batcher.encode(texts), dtype=np.float32)
+
+
+class UnixEmbedServer(_EmbedServerMixin, socketserver.ThreadingUnixStreamServer):
+    pass
+
+
+class TCPEmbedServer(_EmbedServerMixin, socketserver.ThreadingTCPServer):
+    pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ゆるゆるコックさん 埋め込みサーバー")
+    parser.add_argument("--listen", default=DEFAULT_LISTEN,
+                        help="待ち受けアドレス（unix:/path または host:port）")
+    parser.add_argument("--model", default=EMBED_MODEL, help="埋め込みモデル名")
+    parser.add_argument("--batch-wait-ms", type=float, default=EMBED_BATCH_WAIT_MS,
+                        help="リクエストを待ち合わせる時間（ミリ秒）")
+    parser.add_argument("--batch-max-items", type=int, default=EMBED_BATCH_MAX_ITEMS,
+                        help="1バッチの最大件数")
+    args = parser.parse_args()
+
+    family, target = parse_address(args.listen)
+    if family == socket.AF_UNIX:
+        if os.path.exists(target):
+            os.remove(target)   # 前回の残りのソケットファイル
+        server = UnixEmbedServer(target, EmbedHandler)
+    else:
+        server = TCPEmbedServer(target, EmbedHandler)
+
+    server.setup_model(args.model, args.batch_wait_ms, args.batch_max_items)
+    print(f"✅ 埋め込みサーバー起動：{args.listen}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if family == socket.AF_UNIX and os.path.exists(target):
+            os.remove(target)
+
+
+if __name__ == "__main__":
+    main()
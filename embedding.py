@@ -0,0 +1,253 @@
+"""
+embedding.py
+埋め込み関数をまとめて用意するモジュール。
+app.py・setup_chroma.py・test_search.py・check_chroma.py から共通で使う。
+
+環境変数 YURU_EMBED_SERVER が設定されていれば、embed_server.py で起動した
+埋め込みサーバーに問い合わせる（モデルはサーバーのプロセスで1回だけ読み込む）。
+設定がなければ、これまでどおりプロセス内でモデルを読み込む。
+
+    YURU_EMBED_SERVER=unix:/tmp/yuru_embed.sock   # Unixソケット
+    YURU_EMBED_SERVER=127.0.0.1:8765              # localhost のTCP
+
+どちらの場合も、同時に来た埋め込みリクエストは MicroBatcher で短い時間だけ待ち合わせて、
+1回のバッチ推論にまとめる（1件ずつ推論するよりずっと安い）。
+"""
+
+import json
+import os
+import queue
+import socket
+import struct
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+from chromadb.api.types import EmbeddingFunction
+from chromadb.utils import embedding_functions
+
+import metrics
+
+EMBED_MODEL = "paraphrase-multilingual-mpnet-base-v2"
+EMBED_SERVER = os.environ.get("YURU_EMBED_SERVER", "")
+EMBED_SERVER_TIMEOUT_SEC = 30
+
+# マイクロバッチ（待ち時間0でバッチなし）
+EMBED_BATCH_WAIT_MS = float(os.environ.get("YURU_EMBED_BATCH_WAIT_MS", "3"))
+EMBED_BATCH_MAX_ITEMS = int(os.environ.get("YURU_EMBED_BATCH_MAX_ITEMS", "32"))
+
+
+# ────────────────────────────
+# 通信フォーマット（embed_server.py と共通）
+# ────────────────────────────
+# 1フレーム = 4バイトの長さ（ビッグエンディアン）＋本体
+# リクエスト：JSON {"texts": [...]}
+# レスポンス：JSON {"count": n, "dim": d} のあとに float32 の生バイト列 n*d*4 バイト
+#            失敗時は JSON {"error": "..."} だけ
+def parse_address(address: str):
+    """「unix:/path」または「host:port」を (ソケット種別, 接続先) に変換する"""
+    if address.startswith("unix:"):
+        return socket.AF_UNIX, address[len("unix:"):]
+    host, _, port = address.rpartition(":")
+    return socket.AF_INET, (host or "127.0.0.1", int(port))
+
+
+def send_frame(sock, payload: bytes):
+    sock.sendall(struct.pack(">I", len(payload)) + payload)
+
+
+def recv_exact(sock, size: int) -> bytes:
+    buf = bytearray()
+    while len(buf) < size:
+        chunk = sock.recv(size - len(buf))
+        if not chunk:
+            raise ConnectionError("埋め込みサーバーとの接続が切れました")
+        buf.extend(chunk)
+    return bytes(buf)
+
+
+def recv_frame(sock) -> bytes:
+    (size,) = struct.unpack(">I", recv_exact(sock, 4))
+    return recv_exact(sock, size)
+
+
+# ────────────────────────────
+# 埋め込みサーバーのクライアント
+# ────────────────────────────
+class RemoteEmbeddingFunction(EmbeddingFunction):
+    """
+    埋め込みサーバーに問い合わせる埋め込み関数。
+    サーバーと同じモデルのベクトルを返すので、ChromaDBからは
+    SentenceTransformerEmbeddingFunction と同じものとして扱わせる（既存のDBをそのまま使える）。
+    """
+
+    def __init__(self, address: str = EMBED_SERVER, model_name: str = EMBED_MODEL):
+        self.address = address
+        self.model_name = model_name
+        self._local = threading.local()   # スレッドごとに接続を持つ
+
+    def _connect(self):
+        family, target = parse_address(self.address)
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.settimeout(EMBED_SERVER_TIMEOUT_SEC)
+        sock.connect(target)
+        return sock
+
+    def _request(self, texts: list) -> np.ndarray:
+        sock = getattr(self._local, "sock", None)
+        if sock is None:
+            sock = self._local.sock = self._connect()
+        try:
+            send_frame(sock, json.dumps({"texts": texts}, ensure_ascii=False).encode("utf-8"))
+            header = json.loads(recv_frame(sock))
+            if "error" in header:
+                raise RuntimeError(f"埋め込みサーバーのエラー：{header['error']}")
+            body = recv_exact(sock, header["count"] * header["dim"] * 4)
+        except OSError:
+            # 接続が切れていたら次回つなぎ直す
+            sock.close()
+            self._local.sock = None
+            raise
+        return np.frombuffer(body, dtype=np.float32).reshape(header["count"], header["dim"])
+
+    def __call__(self, input):
+        texts = list(input)
+        if not texts:
+            return []
+        try:
+            vectors = self._request(texts)
+        except OSError:
+            vectors = self._request(texts)   # サーバー再起動などで切れていたら1回だけ再試行
+        return [v for v in vectors]
+
+    @staticmethod
+    def name() -> str:
+        return "sentence_transformer"
+
+    def get_config(self) -> dict:
+        return {
+            "model_name": self.model_name,
+            "device": "cpu",
+            "normalize_embeddings": False,
+            "kwargs": {},
+        }
+
+    @staticmethod
+    def build_from_config(config: dict) -> "RemoteEmbeddingFunction":
+        return RemoteEmbeddingFunction(model_name=config.get("model_name", EMBED_MODEL))
+
+
+# ────────────────────────────
+# マイクロバッチ
+# ────────────────────────────
+class MicroBatcher:
+    """
+    別々のスレッドから来た埋め込みリクエストを、max_wait_ms だけ待ち合わせて
+    （または max_items 件たまったら）1回の encode_fn 呼び出しにまとめる。
+    結果はリクエストごとに切り分けて返す。
+    """
+
+    def __init__(self, encode_fn, max_wait_ms: float = EMBED_BATCH_WAIT_MS,
+                 max_items: int = EMBED_BATCH_MAX_ITEMS, metrics_prefix: str = "embed_batch"):
+        self.encode_fn = encode_fn
+        self.max_wait = max_wait_ms / 1000
+        self.max_items = max_items
+        self.metrics_prefix = metrics_prefix
+        self._queue = queue.Queue()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+
+    def encode(self, texts: list) -> list:
+        """texts の埋め込みを返す（バッチにまとめられて処理されるまで待つ）"""
+        future = Future()
+        self._queue.put((list(texts), future, time.perf_counter()))
+        metrics.set_gauge(f"{self.metrics_prefix}.queue_depth", self._queue.qsize())
+        self._ensure_worker()
+        return future.result()
+
+    def _ensure_worker(self):
+        if self._worker is not None:
+            return
+        with self._worker_lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, daemon=True,
+                                                name=f"{self.metrics_prefix}_worker")
+                self._worker.start()
+
+    def _collect(self) -> list:
+        """最初の1件が来てから、待ち時間か件数の上限までリクエストを集める"""
+        batch = [self._queue.get()]
+        count = len(batch[0][0])
+        deadline = time.perf_counter() + self.max_wait
+        while count < self.max_items:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(item)
+            count += len(item[0])
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            metrics.set_gauge(f"{self.metrics_prefix}.queue_depth", self._queue.qsize())
+            texts = [t for item in batch for t in item[0]]
+            started = time.perf_counter()
+            try:
+                vectors = self.encode_fn(texts)
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+
+            metrics.inc(f"{self.metrics_prefix}.batches")
+            metrics.observe(f"{self.metrics_prefix}.items", len(texts))
+            metrics.observe(f"{self.metrics_prefix}.requests", len(batch))
+            metrics.observe(f"{self.metrics_prefix}.encode_ms", (time.perf_counter() - started) * 1000)
+            offset = 0
+            for item_texts, future, queued_at in batch:
+                metrics.observe(f"{self.metrics_prefix}.queue_wait_ms", (started - queued_at) * 1000)
+                future.set_result(list(vectors[offset:offset + len(item_texts)]))
+                offset += len(item_texts)
+
+
+class BatchingEmbeddingFunction(EmbeddingFunction):
+    """埋め込み関数をマイクロバッチ越しに呼ぶラッパー（ChromaDBからは中身と同じものに見える）"""
+
+    def __init__(self, inner, max_wait_ms: float = EMBED_BATCH_WAIT_MS,
+                 max_items: int = EMBED_BATCH_MAX_ITEMS):
+        self.inner = inner
+        self.batcher = MicroBatcher(lambda texts: inner(texts), max_wait_ms, max_items)
+
+    def __call__(self, input):
+        return self.batcher.encode(list(input))
+
+    @staticmethod
+    def name() -> str:
+        return "sentence_transformer"
+
+    def get_config(self) -> dict:
+        return self.inner.get_config()
+
+    @staticmethod
+    def build_from_config(config: dict) -> "EmbeddingFunction":
+        return embedding_functions.SentenceTransformerEmbeddingFunction.build_from_config(config)
+
+
+def get_embedding_function(batching: bool = True):
+    """
+    設定に応じて、埋め込みサーバーのクライアントかプロセス内モデルを返す。
+    batching=False ならマイクロバッチを挟まない（自分でバッチにまとめて呼ぶ index_build.py 用）。
+    """
+    if EMBED_SERVER:
+        embed_fn = RemoteEmbeddingFunction(EMBED_SERVER)
+    else:
+        embed_fn = embedding_functions.SentenceTransformerEmbeddingFunction(model_name=EMBED_MODEL)
+    if batching and EMBED_BATCH_WAIT_MS > 0:
+        embed_fn = BatchingEmbeddingFunction(embed_fn)
+    return embed_fn
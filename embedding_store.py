@@ -0,0 +1,156 @@
+"""
+embedding_store.py
+料理の埋め込みを小さく持っておくためのストア（2段構えの検索の2段目で使う）。
+
+ChromaDB は埋め込みを768次元の float32 で持っていて、こちらからは精度を変えられない。
+そこで2段目の並べ替えに使う埋め込みだけを、ChromaDB とは別のファイル（data/recipe_embeddings.npz）に
+小さくして持ち、候補の距離はここから計算する（ChromaDB への get がなくなる）。
+
+・float16：そのまま半精度にする（1件 768×2 バイト）
+・int8：ベクトルごとの倍率（scale）を1つ持ち、−127〜127 に丸める（1件 768＋4 バイト）
+・PCA：setup_chroma.py で主成分を求めて、pca_dim 次元に落としてから上の形式で持つ
+ベクトルは長さ1にそろえてから持つので、距離は内積から計算できる（1 − 内積＝コサイン距離）。
+PCA は平均を引かずに求め、落としたあとも長さをそろえ直さない（内積が元の内積に近いまま残るので、
+BM25 と混ぜる距離の大きさが変わらない）。
+"""
+
+import os
+
+import numpy as np
+
+# 形式（float32 / float16 / int8）と PCA の次元数（0なら使わない）
+EMBED_STORE_DTYPE = os.environ.get("YURU_EMBED_STORE_DTYPE", "int8")
+EMBED_STORE_PCA_DIM = int(os.environ.get("YURU_EMBED_STORE_PCA_DIM", "0"))
+EMBED_STORE_PATH = "./data/recipe_embeddings.npz"
+PCA_FIT_SAMPLE = 20000   # PCA を求めるのに使う最大件数（多すぎると setup が遅くなる）
+
+DTYPES = ("float32", "float16", "int8")
+
+
+def store_config(embed_model: str, dtype: str = EMBED_STORE_DTYPE,
+                 pca_dim: int = EMBED_STORE_PCA_DIM) -> str:
+    """ストアの作り方を表す文字列（変わったら保存済みのストア・事前計算のランキングは使わない）"""
+    return f"{embed_model}:{dtype}:{pca_dim}"
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1.0)
+
+
+def fit_pca(vectors: np.ndarray, dim: int, sample: int = PCA_FIT_SAMPLE, seed: int = 0) -> np.ndarray:
+    """主成分（平均を引かない）を長さ1にそろえたベクトルから求める。戻り値は dim×元の次元 の行列"""
+    vectors = _normalize(np.asarray(vectors, dtype=np.float32))
+    if len(vectors) > sample:
+        rng = np.random.default_rng(seed)
+        vectors = vectors[rng.choice(len(vectors), sample, replace=False)]
+    _, _, vt = np.linalg.svd(vectors, full_matrices=False)
+    return vt[:dim].astype(np.float32)
+
+
+def quantize(vectors: np.ndarray, dtype: str):
+    """ベクトルを指定の形式にする。戻り値は (符号, ベクトルごとの倍率 or None)"""
+    if dtype == "float32":
+        return vectors.astype(np.float32), None
+    if dtype == "float16":
+        return vectors.astype(np.float16), None
+    if dtype == "int8":
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales = np.where(scales > 0, scales, 1.0).astype(np.float32)
+        codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+        return codes, scales
+    raise ValueError(f"unknown embedding store dtype: {dtype}")
+
+
+class EmbeddingStore:
+    """行番号（＝料理DBの並び順）→ 小さくした埋め込み。読み込み専用"""
+
+    def __init__(self, codes: np.ndarray, scales=None, components=None):
+        self.codes = codes
+        self.scales = scales
+        self.components = components
+
+    @classmethod
+    def build(cls, vectors, dtype: str = EMBED_STORE_DTYPE, pca_dim: int = EMBED_STORE_PCA_DIM):
+        """float32 の埋め込み（件数×次元）から作る"""
+        vectors = _normalize(np.asarray(vectors, dtype=np.float32))
+        components = None
+        if pca_dim and pca_dim < vectors.shape[1]:
+            components = fit_pca(vectors, pca_dim)
+        return cls.build_chunks([(np.arange(len(vectors)), vectors)], len(vectors),
+                                vectors.shape[1], dtype, components)
+
+    @classmethod
+    def build_chunks(cls, chunks, count: int, dim: int, dtype: str = EMBED_STORE_DTYPE, components=None):
+        """
+        (行番号, float32 の埋め込み) のチャンクを順に小さくして詰める（全件の float32 は持たない）。
+        PCA を使うときは、fit_pca() で先に求めた主成分を components に渡す。
+        """
+        if dtype not in DTYPES:
+            raise ValueError(f"unknown embedding store dtype: {dtype}")
+        out_dim = len(components) if components is not None else dim
+        codes = np.zeros((count, out_dim), dtype=np.float32 if dtype == "float32" else dtype)
+        scales = np.ones(count, dtype=np.float32) if dtype == "int8" else None
+        for rows, vectors in chunks:
+            vectors = _normalize(np.asarray(vectors, dtype=np.float32))
+            if components is not None:
+                vectors = vectors @ components.T
+            chunk_codes, chunk_scales = quantize(vectors, dtype)
+            codes[rows] = chunk_codes
+            if scales is not None:
+                scales[rows] = chunk_scales
+        return cls(codes, scales, components)
+
+    def __len__(self):
+        return len(self.codes)
+
+    @property
+    def dtype(self) -> str:
+        return str(self.codes.dtype)
+
+    @property
+    def dim(self) -> int:
+        return self.codes.shape[1]
+
+    @property
+    def nbytes(self) -> int:
+        """持っている配列の合計バイト数（PCA の行列を含む）"""
+        return sum(a.nbytes for a in (self.codes, self.scales, self.components) if a is not None)
+
+    def project(self, query) -> np.ndarray:
+        """クエリの埋め込みをストアと同じ空間（長さ1にそろえて PCA）に移す"""
+        query = _normalize(np.asarray(query, dtype=np.float32))
+        if self.components is not None:
+            query = query @ self.components.T
+        return query
+
+    def distances(self, rows, query) -> np.ndarray:
+        """行番号 rows の埋め込みとクエリのコサイン距離（query は埋め込みモデルの出力そのまま）"""
+        rows = np.asarray(rows, dtype=np.int64)
+        codes = self.codes[rows].astype(np.float32)
+        similarity = codes @ self.project(query)
+        if self.scales is not None:
+            similarity *= self.scales[rows]
+        return 1.0 - similarity
+
+    def save(self, path: str, stamp: bytes, config: str):
+        arrays = {"codes": self.codes, "stamp": np.frombuffer(stamp, dtype=np.uint8),
+                  "config": np.asarray(config)}
+        for name in ("scales", "components"):
+            if getattr(self, name) is not None:
+                arrays[name] = getattr(self, name)
+        tmp = path + ".tmp.npz"
+        np.savez(tmp, **arrays)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str, stamp: bytes, config: str):
+        """保存したストアを読む。ないとき・料理DBや形式が変わっているときは None"""
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                if data["stamp"].tobytes() != stamp or str(data["config"]) != config:
+                    return None
+                return cls(*(data[name] if name in data else None
+                             for name in ("codes", "scales", "components")))
+        except (OSError, KeyError, ValueError):
+            return None
@@ -0,0 +1,147 @@
+"""
+index_build.py
+ChromaDB への一括登録（setup_chroma.py から使う）。
+
+・埋め込みはバッチ（batch_size 件）ごとにワーカーのプロセスで計算する（モデルはワーカーごとに1回読み込む）
+・ワーカーが次のバッチを計算している間に、計算済みのバッチをコレクションに書き込む
+・登録済みのIDは飛ばすので、途中で止まっても続きから登録し直せる（setup_chroma.py --resume）
+・進み具合と docs/sec を on_progress で知らせる
+"""
+
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+import numpy as np
+
+# ────────────────────────────
+# 設定
+# ────────────────────────────
+BUILD_BATCH_SIZE = int(os.environ.get("YURU_BUILD_BATCH_SIZE", "256"))
+# ワーカー数（0ならCPUのコア数から決める。1ならプロセスを分けずに計算と書き込みだけ重ねる）
+BUILD_WORKERS = int(os.environ.get("YURU_BUILD_WORKERS", "0"))
+BUILD_WORKERS_AUTO_MAX = 4     # 自動のときの上限（ワーカーごとにモデルを読むのでメモリを食う）
+BUILD_STATE_FILE = "build_state.json"
+
+
+def default_workers() -> int:
+    return max(1, min(os.cpu_count() or 1, BUILD_WORKERS_AUTO_MAX))
+
+
+# ────────────────────────────
+# ワーカー（プロセスごとに埋め込み関数を1つ持つ）
+# ────────────────────────────
+_worker_embed = None
+
+
+def _init_worker(threads: int):
+    global _worker_embed
+    try:
+        import torch
+        torch.set_num_threads(threads)   # ワーカーどうしでコアを取り合わないようにする
+    except ImportError:
+        pass
+    from embedding import get_embedding_function
+    _worker_embed = get_embedding_function(batching=False)
+
+
+def _encode(texts: list) -> np.ndarray:
+    return np.asarray(_worker_embed(texts), dtype=np.float32)
+
+
+# ────────────────────────────
+# 登録
+# ────────────────────────────
+def _batches(records, batch_size: int):
+    """(ID, ドキュメント, メタデータ) のイテレータを batch_size 件ずつに区切る"""
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _existing_ids(collection, ids: list) -> set:
+    return set(collection.get(ids=ids, include=[])["ids"])
+
+
+def build_index(collection, records, embedding_function=None, batch_size: int = BUILD_BATCH_SIZE,
+                workers: int = BUILD_WORKERS, resume: bool = False, on_progress=None) -> dict:
+    """
+    records（(ID, ドキュメント, メタデータ) のイテレータ）を埋め込んで collection に登録する。
+    workers が2以上ならワーカーのプロセスで、1ならこのプロセスの別スレッドで embedding_function を使って計算する。
+    resume=True なら登録済みのIDを飛ばす。
+    on_progress(登録件数, 経過秒, docs/sec) を書き込みごとに呼ぶ。
+    戻り値は {"added": 登録件数, "skipped": 飛ばした件数, "seconds": 経過秒}
+    """
+    workers = workers or default_workers()
+    if workers > 1:
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        # ChromaDB のスレッドを抱えたまま fork しないよう spawn で起動する
+        executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"),
+                                       initializer=_init_worker, initargs=(threads,))
+        encode = _encode
+    else:
+        executor = ThreadPoolExecutor(1)
+
+        def encode(texts):
+            return np.asarray(embedding_function(texts), dtype=np.float32)
+
+    added = skipped = 0
+    started = time.perf_counter()
+    pending = {}
+
+    def _write(done_futures):
+        nonlocal added
+        for future in done_futures:
+            ids, docs, metas = pending.pop(future)
+            collection.add(ids=ids, documents=docs, metadatas=metas, embeddings=list(future.result()))
+            added += len(ids)
+            if on_progress:
+                elapsed = time.perf_counter() - started
+                on_progress(added, elapsed, added / elapsed if elapsed > 0 else 0.0)
+
+    try:
+        for batch in _batches(records, batch_size):
+            if resume:
+                existing = _existing_ids(collection, [r[0] for r in batch])
+                skipped += len(existing)
+                batch = [r for r in batch if r[0] not in existing]
+                if not batch:
+                    continue
+            ids, docs, metas = (list(col) for col in zip(*batch))
+            pending[executor.submit(encode, docs)] = (ids, docs, metas)
+            # 計算中のバッチはワーカー数の2倍まで（メモリを一定に保つ）
+            while len(pending) >= workers * 2:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                _write(done)
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            _write(done)
+    finally:
+        executor.shutdown(cancel_futures=True)
+    return {"added": added, "skipped": skipped, "seconds": time.perf_counter() - started}
+
+
+# ────────────────────────────
+# 途中から再開するための記録
+# ────────────────────────────
+def load_build_state(chroma_dir: str) -> dict:
+    try:
+        with open(os.path.join(chroma_dir, BUILD_STATE_FILE), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_build_state(chroma_dir: str, state: dict):
+    os.makedirs(chroma_dir, exist_ok=True)
+    path = os.path.join(chroma_dir, BUILD_STATE_FILE)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(path + ".tmp", path)
@@ -0,0 +1,132 @@
+"""
+ingredient_index.py
+食材名の文字列検索（SQLite・FTS5のtrigramインデックス）。
+「ネギ」「冷ご飯」のような入力を、埋め込みモデルを通さずに食材DBの食材に引き当てる。
+
+・完全一致：食材名・別名（漢字・よくある言い方）を canonical_key() でそろえて引く
+  （かな/カタカナ・半角・長音・小書きの違いはキーの時点で消える）
+・部分一致：3文字以上のキーは trigram（3文字ずつ）の重なりで一番近い名前を探す
+  （「鶏むね」→ 鶏むね肉、「じゃがいもスライス」→ じゃがいも など）。重なりが足りなければ見つからない扱い
+  （「豚バラスライス」は豚バラ肉との重なりが0.29しかないので見つからない）。
+  名前の前後の残りがそれ自体別の食材の名前なら、2つの食材を合わせた料理とみなして部分一致にしない
+  （「いかそうめん」は いか＋そうめん なので、そうめんにはしない）
+見つからなかった単語だけ、これまでどおりベクトル検索に回す。
+"""
+
+import json
+import sqlite3
+import threading
+
+import canonical
+import local_normalizer
+
+# trigramの重なり（Dice係数）がこれ未満なら部分一致とみなさない
+TRIGRAM_MIN_SCORE = 0.6
+TRIGRAM_CANDIDATES = 20
+
+
+def trigrams(text: str) -> set:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def _trigram_score(a: str, b: str) -> float:
+    """trigramの重なり（Dice係数、0〜1）"""
+    ta, tb = trigrams(a), trigrams(b)
+    if not ta or not tb:
+        return 0.0
+    return 2 * len(ta & tb) / (len(ta) + len(tb))
+
+
+class IngredientIndex:
+    """食材DBの名前・別名を入れたSQLiteの索引（読み込み専用。複数スレッドから使える）"""
+
+    def __init__(self, ingredients, db_path: str = ":memory:"):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.executescript("""
+            DROP TABLE IF EXISTS ingredients;
+            DROP TABLE IF EXISTS aliases;
+            DROP TABLE IF EXISTS alias_fts;
+            CREATE TABLE ingredients (id INTEGER PRIMARY KEY, name TEXT, categories TEXT, raw_ok INTEGER);
+            CREATE TABLE aliases (alias TEXT PRIMARY KEY, id INTEGER);
+            CREATE VIRTUAL TABLE alias_fts USING fts5(alias, id UNINDEXED, tokenize='trigram');
+        """)
+        name_to_id = {}
+        for i, item in enumerate(ingredients):
+            name_to_id[item["食材名"]] = i
+            self._db.execute(
+                "INSERT INTO ingredients VALUES (?, ?, ?, ?)",
+                (i, item["食材名"], json.dumps(item["カテゴリ"], ensure_ascii=False), int(item["生食可"])),
+            )
+
+        # 食材名そのもの → 別名表 → 正規化ルール の順（canonical.VariantDictionary の優先順位）
+        variants = canonical.VariantDictionary(name_to_id, local_normalizer.CANONICAL_RULES)
+        for key, name in variants.items():
+            self._db.execute("INSERT INTO aliases VALUES (?, ?)", (key, name_to_id[name]))
+            self._db.execute("INSERT INTO alias_fts VALUES (?, ?)", (key, name_to_id[name]))
+        self._db.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM aliases").fetchone()[0]
+
+    def _exact(self, key: str):
+        row = self._db.execute("SELECT id FROM aliases WHERE alias = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _is_compound(self, key: str, alias: str, record: int) -> bool:
+        """key が alias と別の食材の名前をつなげたものか（いかそうめん＝いか＋そうめん）"""
+        start = key.find(alias)
+        if start < 0:
+            return False
+        for rest in (key[:start], key[start + len(alias):]):
+            other = self._exact(rest) if rest else None
+            if other is not None and other != record:
+                return True
+        return False
+
+    def _fuzzy(self, key: str):
+        grams = trigrams(key)
+        if not grams:
+            return None, 0.0
+        query = " OR ".join('"' + g.replace('"', '""') + '"' for g in sorted(grams))
+        rows = self._db.execute(
+            "SELECT alias, id FROM alias_fts WHERE alias_fts MATCH ? ORDER BY bm25(alias_fts) LIMIT ?",
+            (query, TRIGRAM_CANDIDATES),
+        ).fetchall()
+        best, best_score = None, 0.0
+        for alias, i in rows:
+            if self._is_compound(key, alias, i):
+                continue
+            score = _trigram_score(key, alias)
+            if score > best_score:
+                best, best_score = i, score
+        if best_score < TRIGRAM_MIN_SCORE:
+            return None, best_score
+        return int(best), best_score
+
+    def lookup(self, word: str) -> dict | None:
+        """
+        1単語を食材に引き当てる。見つからなければ None（ベクトル検索に回す）。
+        戻り値は search_one_ingredient() と同じ形（距離は 1 − 一致度、完全一致なら0）
+        """
+        word = canonical.normalize_width(word)
+        key = canonical.canonical_key(word)
+        if not key:
+            return None
+        with self._lock:
+            record, score = self._exact(key), 1.0
+            if record is None:
+                record, score = self._fuzzy(key)
+            if record is None:
+                return None
+            name, categories, raw_ok = self._db.execute(
+                "SELECT name, categories, raw_ok FROM ingredients WHERE id = ?", (record,)
+            ).fetchone()
+        return {
+            "食材名": name,
+            "カテゴリ": json.loads(categories),
+            "生食可": bool(raw_ok),
+            "距離": round(1.0 - score, 4),
+            "入力単語": word,
+        }
@@ -0,0 +1,166 @@
+"""
+llm_models.py
+Groqのモデルの使い分け（呼び出しごとのモデル設定）と、食材正規化の段階的な呼び出し。
+
+・食材正規化は短いJSONを返すだけなので、まず小さくて速いモデルに聞く
+・JSONが読めない／結果の形があやしいときだけ大きいモデルに聞き直す
+  （食材DBに無い食材こそGroqに回ってくるので、知っている名前かどうかでは判定しない）
+・調理手順・お見送りのセリフは文章の質が大事なので大きいモデルのまま
+
+app.py と bench_llm_tiering.py から共通で使う（プロンプト・判定を同じものにするため）。
+"""
+
+import json
+import zlib
+
+MODEL_SMALL = "llama-3.1-8b-instant"
+MODEL_LARGE = "llama-3.3-70b-versatile"
+
+# 呼び出しの種類 → モデル（secrets.toml の GROQ_MODEL_<種類> で上書きできる）
+TASK_MODELS = {
+    "normalize": MODEL_SMALL,
+    "normalize_escalate": MODEL_LARGE,
+    "cooking": MODEL_LARGE,
+    "farewell": MODEL_LARGE,
+}
+
+# 食材名としては長すぎる（文章が混ざっている）とみなす文字数
+NORMALIZE_MAX_NAME_LEN = 15
+# 食材名に入っていたら文章が混ざっているとみなす文字
+NORMALIZE_SENTENCE_CHARS = set("。、！？!?「」 　\n")
+
+
+class NormalizeParseError(ValueError):
+    """小さいモデルも大きいモデルも読めるJSONを返さなかったときに投げる"""
+
+
+def build_normalize_prompt(user_input: str) -> str:
+    """食材正規化のプロンプト"""
+    return f"""あなたは食材を正規化する専門家です。
+ユーザーが入力した食材テキストを解析して、以下のJSON形式で返してください。
+
+入力テキスト：「{user_input}」
+
+ルール：
+- 表記ゆれを正規化する（例：たまご→卵、冷ごはん→ご飯、ネギ→ねぎ）
+- 修飾語を除去して食材名だけにする（例：残り物のハム→ハム）
+- 日本語の一般的な食材名に統一する
+- 食材ではないもの（調理法・量・状態など）は除外する
+- 料理名・メニュー名は食材に分解する（例：牛丼→牛肉・玉ねぎ・ご飯、から揚げ弁当→鶏肉・ご飯、ビッグマック→牛肉・パン・チーズ・野菜）
+- コンビニ弁当・ファストフード・外食メニューなども同様に含まれる食材に分解する
+- パン類（食パン・トースト・ロールパン・バゲットなど）は「パン」に統一する
+- ご飯・冷ご飯・白米・米などは「ご飯」に統一する
+- うどん・そば・ラーメン・パスタなど麺類は「〇〇」とそのまま正規化するが、総称で入力された場合は「麺」にする
+- 缶詰は「〇〇缶」の形に統一する（例：ツナ→ツナ缶、シーチキン→ツナ缶、サバ→サバ缶、イワシ→イワシ缶）
+- ひき肉は種類を明示する（例：ミンチ→豚ひき肉、合いびき→合挽き肉）
+
+返すJSONの形式（他のテキストは一切含めないこと）：
+{{
+  "ingredients": ["食材1", "食材2", "食材3"],
+  "message": "○○と△△と□□があるんだぞい！ちょっと考えてみるぞい…"
+}}
+
+messageは「ゆるゆるコックさん」というキャラクターのセリフで、語尾は「〜ぞい」「〜だぞい」を使い、食材名を入れて元気よく書いてください。
+食材が1つだけのときは「〇〇があるんだぞい！」のように単体で話し、「と」で繋げないでください。
+必ず日本語のみで出力してください。"""
+
+
+def build_farewell_prompt(recipe: dict) -> str:
+    """お見送りセリフのプロンプト（料理DBの項目だけで決まるので事前生成できる：pregen_farewells.py）"""
+    return f"""あなたは「ゆるゆるコックさん」というキャラクターです。
+語尾は「〜ぞい」「〜だぞい」「〜するぞい」を使い、全力肯定でやさしくお見送りします。
+
+料理名：{recipe['name']}
+本物の食材：{json.dumps(recipe["本物の食材"], ensure_ascii=False)}
+説明文：{recipe["説明文"]}
+
+上記を参考に、料理の魅力を伝えながら「またいつでも来てほしいぞい」という気持ちのお見送りセリフを100文字以内で書いてください。
+注意：これはまだ「作り方を提案した段階」です。「おいしかった」「食べた」などの過去形は使わず、「きっとおいしいぞい」「得意料理になるぞい」「また来てほしいぞい」のような未来・期待のニュアンスにしてください。
+セリフだけを返してください。必ず日本語のみで出力してください。"""
+
+
+def cooking_source_hash(replaced_steps: list, cooking_method: str, genre: str) -> str:
+    """調理手順セリフのプロンプトの元になる項目のハッシュ（料理DBが変わったらキャッシュを使わないため）"""
+    source = json.dumps([replaced_steps, cooking_method, genre], ensure_ascii=False)
+    return f"{zlib.crc32(source.encode('utf-8')):08x}"
+
+
+# pregen_farewells.py --local（Groqなしの動作確認用）で作ったファイルの generator。アプリでは使わない
+FAREWELL_LOCAL_GENERATOR = "local"
+
+
+def farewell_source_hash(recipe: dict) -> str:
+    """お見送りセリフの元になる項目のハッシュ（料理DBが変わったら事前生成分を使わないため）"""
+    source = json.dumps([recipe["name"], recipe["本物の食材"], recipe["説明文"]], ensure_ascii=False)
+    return f"{zlib.crc32(source.encode('utf-8')):08x}"
+
+
+def parse_normalize_response(raw: str):
+    """
+    モデルの返答からJSONを取り出す。
+    戻り値: (食材リスト, セリフ)。JSONとして読めないときは None
+    """
+    start = raw.find("{")
+    end = raw.rfind("}") + 1
+    if start == -1 or end == 0:
+        return None
+    try:
+        data = json.loads(raw[start:end])
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(data, dict):
+        return None
+    ingredients = data.get("ingredients", [])
+    message = data.get("message", "")
+    if not isinstance(ingredients, list) or not all(isinstance(i, str) for i in ingredients):
+        return None
+    return ingredients, message if isinstance(message, str) else ""
+
+
+def normalize_looks_valid(ingredients: list) -> bool:
+    """
+    正規化結果の形がまともか。
+    空・空文字・長すぎる名前・文章の混ざった名前があるときは False
+    """
+    if not ingredients:
+        return False
+    return all(
+        name.strip() and len(name) <= NORMALIZE_MAX_NAME_LEN
+        and not NORMALIZE_SENTENCE_CHARS.intersection(name)
+        for name in ingredients
+    )
+
+
+def normalize_tiered(call_model, user_input: str, models: dict = TASK_MODELS) -> dict:
+    """
+    小さいモデル → （必要なら）大きいモデルの順に食材正規化を聞く。
+    call_model(model, prompt) はモデルの返答テキストを返す関数（例外はそのまま上に投げる）。
+    戻り値: {"ingredients", "message", "model", "escalated", "reason"}
+      reason: 聞き直した理由（"parse_error" / "low_confidence"）、聞き直していなければ ""
+      大きいモデルが読めない返事をした・失敗したときは、小さいモデルの結果が読めていればそれを返す
+    どちらのモデルも読めるJSONを返さなければ NormalizeParseError を投げる
+    """
+    prompt = build_normalize_prompt(user_input)
+    parsed = parse_normalize_response(call_model(models["normalize"], prompt))
+    if parsed is None:
+        reason = "parse_error"
+    elif not normalize_looks_valid(parsed[0]):
+        reason = "low_confidence"
+    else:
+        return {"ingredients": parsed[0], "message": parsed[1],
+                "model": models["normalize"], "escalated": False, "reason": ""}
+
+    try:
+        escalated = parse_normalize_response(call_model(models["normalize_escalate"], prompt))
+        model = models["normalize_escalate"]
+    except Exception:
+        if parsed is None:
+            raise
+        escalated = None
+    if escalated is None:
+        if parsed is None:
+            raise NormalizeParseError("食材正規化の返事をJSONとして読めません")
+        # 大きいモデルがだめなときは、小さいモデルの結果を使う
+        escalated, model = parsed, models["normalize"]
+    return {"ingredients": escalated[0], "message": escalated[1],
+            "model": model, "escalated": True, "reason": reason}
@@ -0,0 +1,339 @@
+"""
+llm_scheduler.py
+Groqへのリクエストをプロセス全体でまとめて流すスケジューラー。
+
+・1分あたりのリクエスト数・トークン数をトークンバケットで管理し、上限を超えないよう待たせる
+・優先度つきキュー（食材正規化 ＞ 調理手順 ＞ お見送り）
+・同じ優先度の中ではセッションごとに順番に取り出す（1人の連打で他の人が待たされないように）
+・混んできたら優先度の低いジョブから捨てる（LLMShedError）。呼び出し側はテンプレートで代替する
+・ヘッジ（任意）：p95を過ぎても返ってこない呼び出しは同じリクエストをもう1本出し、先に返った方を使う
+  追加で出す量は HedgeBudget で元のリクエスト数の1割程度に抑える
+"""
+
+import itertools
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, InvalidStateError, ThreadPoolExecutor, wait
+
+import metrics
+
+# 優先度（小さいほど先に処理する）
+PRIORITY_NORMALIZE = 0
+PRIORITY_COOKING = 1
+PRIORITY_FAREWELL = 2
+
+# 優先度ごとの最大待ち時間（秒）。これを過ぎたジョブは捨てる（submit の max_wait で呼び出しごとに変えられる）
+MAX_WAIT_SEC = {
+    PRIORITY_NORMALIZE: 20.0,
+    PRIORITY_COOKING: 20.0,
+    PRIORITY_FAREWELL: 8.0,
+}
+
+# レート制限エラー（429）を受けたときに全体を止める秒数
+RATE_LIMIT_BACKOFF_SEC = 5.0
+
+# ヘッジ：元のリクエスト1本ごとに貯まる追加リクエストの枠（0.1 → 最大で1割増し）と、貯められる上限
+HEDGE_RATIO = 0.1
+HEDGE_MAX_CREDIT = 10.0
+
+
+class LLMShedError(Exception):
+    """混雑のためジョブを捨てたときに投げる"""
+
+
+class TokenBucket:
+    """1分あたり per_minute 個まで使えるトークンバケット（上限＝1分ぶん）"""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """amount 個使えるようになるまでの秒数（0なら今すぐ使える）"""
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount: float):
+        self._refill()
+        self.tokens -= amount
+
+    def drain(self):
+        """レート制限を受けたとき用：手持ちを空にする"""
+        self._refill()
+        self.tokens = min(self.tokens, 0.0)
+
+
+class HedgeBudget:
+    """ヘッジで追加できるリクエスト数の枠。元のリクエストごとに ratio ずつ貯まり、ヘッジ1本で1使う"""
+
+    def __init__(self, ratio: float = HEDGE_RATIO, max_credit: float = HEDGE_MAX_CREDIT):
+        self.ratio = ratio
+        self.max_credit = max_credit
+        self.credit = 0.0
+        self._lock = threading.Lock()
+
+    def on_request(self):
+        with self._lock:
+            self.credit = min(self.max_credit, self.credit + self.ratio)
+
+    def try_spend(self) -> bool:
+        with self._lock:
+            if self.credit < 1.0:
+                return False
+            self.credit -= 1.0
+            return True
+
+
+def _settle(future: Future, result=None, exception: BaseException = None):
+    """Future に結果を入れる。取り消しと入れ違いで終わっていたら何もしない"""
+    try:
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+    except InvalidStateError:
+        pass
+
+
+class _Job:
+    __slots__ = ("fn", "priority", "session_id", "est_tokens", "future", "queued_at", "seq", "max_wait")
+
+    def __init__(self, fn, priority, session_id, est_tokens, seq, max_wait=None):
+        self.fn = fn
+        self.priority = priority
+        self.session_id = session_id
+        self.est_tokens = est_tokens
+        self.future = Future()
+        self.queued_at = time.monotonic()
+        self.seq = seq
+        self.max_wait = MAX_WAIT_SEC[priority] if max_wait is None else max_wait
+
+
+class LLMScheduler:
+    """
+    LLM呼び出し（引数なしの関数）を受け取って、レート制限・優先度・公平性を守りながら実行する。
+    submit() は結果が返るまで待つ。捨てられたときは LLMShedError を投げる。
+    """
+
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float,
+                 max_concurrency: int = 4, max_queue: int = 50, hedge_ratio: float = HEDGE_RATIO):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.max_queue = max_queue
+        self._pool = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="llm")
+        self._slots = threading.Semaphore(max_concurrency)
+        self._cond = threading.Condition()
+        # 優先度 → {セッションID: deque[_Job]} と、その優先度でのセッションの順番
+        self._queues = {p: {} for p in MAX_WAIT_SEC}
+        self._order = {p: deque() for p in MAX_WAIT_SEC}
+        self._size = 0
+        self._seq = itertools.count()
+        self._paused_until = 0.0
+        self.hedge_budget = HedgeBudget(hedge_ratio)
+        threading.Thread(target=self._dispatch_loop, daemon=True, name="llm_dispatch").start()
+
+    # ── 受付 ──
+    def submit(self, fn, priority: int, session_id: str = "", est_tokens: int = 0,
+               max_wait: float = None):
+        return self.submit_async(fn, priority, session_id, est_tokens, max_wait).result()
+
+    def submit_async(self, fn, priority: int, session_id: str = "", est_tokens: int = 0,
+                     max_wait: float = None) -> Future:
+        """
+        ジョブを並べて Future を返す（待たない）。
+        まだ実行が始まっていなければ cancel() で取り消せる。
+        max_wait はこのジョブの最大待ち時間（秒）。None なら優先度ごとの MAX_WAIT_SEC
+        """
+        job = _Job(fn, priority, session_id, est_tokens, next(self._seq), max_wait)
+        with self._cond:
+            if self._size >= self.max_queue and not self._shed_one_below(priority):
+                metrics.inc(f"llm.shed.p{priority}")
+                raise LLMShedError("混雑しているのでリクエストを受け付けられません")
+            self._enqueue(job)
+            self._cond.notify()
+        return job.future
+
+    def cancel(self, future: Future) -> bool:
+        """
+        submit_async() の Future を取り消す（始まっていたら False）。
+        キューの処理と入れ違わないよう、ロックを取ってから取り消す。
+        """
+        with self._cond:
+            cancelled = future.cancel()
+            self._cond.notify()
+        return cancelled
+
+    def submit_hedged(self, fn, priority: int, session_id: str = "", est_tokens: int = 0,
+                      hedge_after_sec: float = 2.0, max_wait: float = None):
+        """
+        submit() と同じだが、hedge_after_sec を過ぎても終わらなければ同じジョブをもう1本出し、
+        先に成功した方の結果を返す。キューに待ちがあるとき・枠がないときは追加しない。
+        負けた方はまだ始まっていなければ取り消す（始まっていたら結果を捨てるだけ）。
+        """
+        primary = self.submit_async(fn, priority, session_id, est_tokens, max_wait)
+        self.hedge_budget.on_request()
+        if wait([primary], timeout=hedge_after_sec).done:
+            return primary.result()
+        if self.queue_depth() > 0 or not self.hedge_budget.try_spend():
+            metrics.inc("llm.hedge.skipped")
+            return primary.result()
+
+        try:
+            backup = self.submit_async(fn, priority, session_id, est_tokens, max_wait)
+        except LLMShedError:
+            return primary.result()
+        metrics.inc("llm.hedge.sent")
+
+        done, _ = wait([primary, backup], return_when=FIRST_COMPLETED)
+        winner = primary if primary in done else backup
+        loser = backup if winner is primary else primary
+        if winner.exception() is not None:
+            # 先に返った方が失敗なら、もう片方を待つ
+            winner, loser = loser, winner
+            winner.exception()
+        elif self.cancel(loser):
+            metrics.inc("llm.hedge.cancelled")
+        if winner is backup:
+            metrics.inc("llm.hedge.won")
+        return winner.result()
+
+    def queue_depth(self) -> int:
+        with self._cond:
+            return self._size
+
+    def _enqueue(self, job: _Job):
+        sessions = self._queues[job.priority]
+        if job.session_id not in sessions:
+            sessions[job.session_id] = deque()
+            self._order[job.priority].append(job.session_id)
+        sessions[job.session_id].append(job)
+        self._size += 1
+        metrics.set_gauge("llm.queue_depth", self._size)
+
+    def _shed_one_below(self, priority: int) -> bool:
+        """
+        priority より優先度の低いジョブを1つ捨てる。
+        一番低い優先度の中で、一番多く並べているセッションの一番新しいジョブを選ぶ。
+        """
+        for p in sorted(self._queues, reverse=True):
+            if p <= priority:
+                return False
+            sessions = self._queues[p]
+            if not sessions:
+                continue
+            victim = max(sessions.values(), key=lambda q: (len(q), q[-1].seq))
+            self._remove(victim.pop(), victim)
+            return True
+        return False
+
+    def _remove(self, job: _Job, session_queue: deque, shed: bool = True):
+        if not session_queue:
+            del self._queues[job.priority][job.session_id]
+            self._order[job.priority].remove(job.session_id)
+        self._size -= 1
+        metrics.set_gauge("llm.queue_depth", self._size)
+        if shed and not job.future.cancelled():
+            metrics.inc(f"llm.shed.p{job.priority}")
+            _settle(job.future, exception=LLMShedError("混雑のためリクエストを取り消しました"))
+
+    # ── 取り出し ──
+    def _next_job(self):
+        """優先度の高い順、同じ優先度ならセッションを順番に回して1件取り出す"""
+        now = time.monotonic()
+        for p in sorted(self._queues):
+            order = self._order[p]
+            while order:
+                sid = order[0]
+                order.rotate(-1)   # 次は別のセッションから
+                q = self._queues[p][sid]
+                job = q.popleft()
+                if job.future.cancelled():
+                    self._remove(job, q, shed=False)   # ヘッジで取り消されたジョブ
+                    continue
+                if now - job.queued_at > job.max_wait:
+                    self._remove(job, q)   # 待ちすぎたジョブは捨てる
+                    continue
+                self._remove(job, q, shed=False)
+                if not job.future.set_running_or_notify_cancel():
+                    continue
+                return job
+        return None
+
+    def _peek_tokens(self) -> int:
+        for p in sorted(self._queues):
+            if self._order[p]:
+                return self._queues[p][self._order[p][0]][0].est_tokens
+        return 0
+
+    def _dispatch_loop(self):
+        while True:
+            self._slots.acquire()
+            job = None
+            try:
+                job = self._wait_for_job()
+                metrics.observe("llm.queue_wait_ms", (time.monotonic() - job.queued_at) * 1000)
+                self._pool.submit(self._run, job)
+            except Exception as e:
+                # 1件の失敗で取り出しのスレッドが止まると全員が待ちっぱなしになるので、枠を返して続ける
+                metrics.inc("llm.dispatch_errors")
+                self._slots.release()
+                if job is not None:
+                    _settle(job.future, exception=e)
+
+    def _wait_for_job(self) -> _Job:
+        """実行してよいジョブが出てくるまで待って取り出す"""
+        with self._cond:
+            while True:
+                while self._size == 0:
+                    self._cond.wait()
+                wait = max(
+                    self._paused_until - time.monotonic(),
+                    self.requests.wait_time(1),
+                    self.tokens.wait_time(self._peek_tokens()),
+                )
+                if wait <= 0:
+                    job = self._next_job()
+                    if job is not None:
+                        break
+                    continue
+                self._cond.wait(timeout=wait)
+            self.requests.take(1)
+            self.tokens.take(job.est_tokens)
+        return job
+
+    def _run(self, job: _Job):
+        started = time.monotonic()
+        try:
+            result = job.fn()
+        except Exception as e:
+            if getattr(e, "status_code", None) == 429:
+                # レート制限を受けたら手持ちを空にして少し止める
+                with self._cond:
+                    self.requests.drain()
+                    self.tokens.drain()
+                    self._paused_until = time.monotonic() + RATE_LIMIT_BACKOFF_SEC
+                metrics.inc("llm.rate_limited")
+            metrics.inc("llm.errors")
+            _settle(job.future, exception=e)
+        else:
+            # 実際に使ったトークン数で見積もりとの差を精算する
+            usage = getattr(getattr(result, "usage", None), "total_tokens", None)
+            if usage is not None:
+                with self._cond:
+                    self.tokens.take(usage - job.est_tokens)
+            metrics.inc("llm.requests")
+            _settle(job.future, result=result)
+        finally:
+            metrics.observe("llm.call_ms", (time.monotonic() - started) * 1000)
+            self._slots.release()
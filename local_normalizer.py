@@ -0,0 +1,184 @@
+"""
+local_normalizer.py
+食材の入力テキストをローカルのルールだけで正規化するモジュール。
+ほとんどの入力はここで解決して、分からない単語が残ったときだけGroqに聞く。
+
+・区切り：句読点・空白・助詞（と・や・に・も・の など）。ただし辞書にある単語と PARTICLE_WORDS の中の
+  「に」「も」「は」は区切らない（「にんじん」「もやし」「はんぺん」が割れないよう最長一致を優先する）
+・Groqが使えないときの検索語は split_particles=False で作る（分からない部分は句読点までを1語にする）
+・正規化：groq_normalize_ingredients() のプロンプトと同じルール（パン類→パン、ツナ→ツナ缶 など）
+・表記ゆれ：辞書引きは canonical.fold() でたたんだ文字列で行う（ネギ・ねぎ・ﾈｷﾞ が同じ単語になる）
+・料理名：recipe_db.json の「本物の食材」に分解する（親子丼→鶏肉・卵・玉ねぎ・ご飯）
+"""
+
+import re
+
+import canonical
+
+# 句読点・空白（ここは必ず区切る）
+PUNCTUATION_PATTERN = re.compile(r"[、，,。．.・/／\s　]+")
+
+# 助詞（辞書の単語に含まれていないときだけ区切りとして扱う）
+PARTICLES = set("とやにものがはをで")
+
+# 食材DBにはないが助詞の文字を含む食材名（助詞で割らずに1語のまま Groq・検索に回す）
+PARTICLE_WORDS = {
+    "はんぺん", "はるさめ", "はくさい", "はちみつ", "はまぐり", "のり", "なのはな", "もち", "もずく",
+    "もつ", "もも肉", "にら", "ししゃも", "さといも", "ながいも", "やまいも", "とうもろこし",
+    "ところてん", "とろろ", "わかさぎ", "のどぐろ",
+}
+
+# 量・個数（「卵2個」「ベーコン半分」など）は食材名ではないので消す
+_COUNTERS = "個|本|枚|袋|パック|玉|切れ|缶|束|株|g|ｇ|グラム|杯|人前|分"
+QUANTITY_PATTERN = re.compile(
+    rf"[0-9０-９]+\s*({_COUNTERS})?|[一二三四五六七八九十半]+({_COUNTERS})"
+)
+
+# 食材ではない言葉（捨てても結果が変わらないもの）
+NOISE_WORDS = {
+    "冷蔵庫", "冷凍庫", "ある", "あります", "あった", "残り物", "残り", "少し", "ちょっと",
+    "だけ", "など", "とか", "くらい", "ぐらい", "いっぱい", "たくさん", "コンビニ", "家",
+}
+
+# プロンプトのルールと同じ正規化（入力語 → ingredient_db の食材名）
+CANONICAL_RULES = {
+    # パン類は「パン」に統一
+    "食パン": "パン", "トースト": "パン", "ロールパン": "パン", "バゲット": "パン",
+    "フランスパン": "パン", "食パン（冷凍）": "パン",
+    # ご飯類は「ご飯」に統一
+    "ごはん": "ご飯", "ご飯（米）": "ご飯", "冷ご飯": "ご飯", "冷ごはん": "ご飯",
+    "冷やご飯": "ご飯", "白米": "ご飯", "米": "ご飯", "ライス": "ご飯", "白ご飯": "ご飯",
+    # 麺類の総称は「麺」
+    "麺類": "麺",
+    # 缶詰は「〇〇缶」
+    "ツナ": "ツナ缶", "シーチキン": "ツナ缶", "サバ": "サバ缶", "さば": "サバ缶",
+    "イワシ": "イワシ缶", "いわし": "イワシ缶",
+    # ひき肉は種類を明示
+    "ミンチ": "豚ひき肉", "ひき肉": "豚ひき肉", "豚ひき": "豚ひき肉", "鶏ひき": "鶏ひき肉",
+    "合いびき": "合挽き肉", "合挽": "合挽き肉", "合いびき肉": "合挽き肉",
+    # 表記ゆれ
+    "たまご": "卵", "玉子": "卵", "タマゴ": "卵", "ネギ": "ねぎ", "長ネギ": "ねぎ",
+    "長ねぎ": "ねぎ", "ウィンナー": "ウインナー", "ソーセージ": "ウインナー",
+}
+
+# recipe_db にない料理名（プロンプトの例と同じ分解）
+DISH_RULES = {
+    "牛丼": ["牛肉", "玉ねぎ", "ご飯"],
+    "から揚げ弁当": ["鶏肉", "ご飯"],
+    "唐揚げ弁当": ["鶏肉", "ご飯"],
+}
+
+
+def build_vocabulary(ingredients: list, recipes: list) -> dict:
+    """
+    入力語（canonical.fold() 済み）→ 正規化後の食材名リスト の辞書を作る。
+    優先順位：正規化ルール ＞ 食材名 ＞ 別名表（canonical.VARIANTS）＞ 料理名（料理名は本物の食材に分解）
+    """
+    names = {item["食材名"] for item in ingredients}
+    vocab = {}
+    for recipe in recipes:
+        vocab[recipe["name"]] = list(recipe["本物の食材"])
+    for dish, parts in DISH_RULES.items():
+        vocab[dish] = list(parts)
+    for name, aliases in canonical.VARIANTS.items():
+        if name in names:
+            vocab.update((alias, [name]) for alias in aliases)
+    for name in names:
+        vocab[name] = [name]
+    for word, name in CANONICAL_RULES.items():
+        if name in names:
+            vocab[word] = [name]
+    # たたむと同じになる単語（ネギ・ねぎ など）は後から入れたほうを残す
+    return {canonical.fold(word): parts for word, parts in vocab.items()}
+
+
+_PARTICLE_WORDS_FOLDED = {canonical.fold(w) for w in PARTICLE_WORDS}
+_PARTICLE_WORD_MAX_LEN = max(len(w) for w in _PARTICLE_WORDS_FOLDED)
+
+
+def _longest_match(folded: str, i: int, words, max_len: int):
+    for length in range(min(max_len, len(folded) - i), 0, -1):
+        if folded[i:i + length] in words:
+            return folded[i:i + length]
+    return None
+
+
+def _trim_particles(word: str, leading: bool, trailing: bool) -> str:
+    """辞書の単語の隣・句読点の前に残った助詞（「卵とはんぺん」「はんぺんと、」の「と」）を落とす。PARTICLE_WORDS は削らない"""
+    folded = canonical.fold(word)
+    while leading and word and word[0] in PARTICLES and not folded.startswith(tuple(_PARTICLE_WORDS_FOLDED)):
+        word, folded = word[1:], folded[1:]
+    while trailing and word and word[-1] in PARTICLES and not folded.endswith(tuple(_PARTICLE_WORDS_FOLDED)):
+        word, folded = word[:-1], folded[:-1]
+    return word
+
+
+def tokenize(text: str, vocab: dict, split_particles: bool = True) -> list:
+    """
+    入力を単語に分ける。戻り値は (単語, 辞書にあるか) のリスト。
+    辞書の単語は最長一致で切り出し、それ以外は助詞か句読点までをひとかたまりにする。
+    split_particles=False なら助詞では区切らず、辞書の単語か句読点までをひとかたまりにする。
+    辞書にある単語は vocab のキー（たたんだ形）、ない単語は入力の表記のまま返す。
+    """
+    text = QUANTITY_PATTERN.sub(" ", canonical.normalize_width(text))
+    max_len = max((len(w) for w in vocab), default=1)
+
+    tokens = []
+    for chunk in PUNCTUATION_PATTERN.split(text):
+        folded = canonical.fold(chunk)   # 文字数は変わらないので、位置は chunk と同じ
+        unknown = ""
+        after_match = False
+
+        def flush(trailing: bool):
+            nonlocal unknown
+            word = unknown if split_particles else _trim_particles(unknown, after_match, trailing)
+            if word:
+                tokens.append((word, False))
+            unknown = ""
+
+        i = 0
+        while i < len(chunk):
+            match = _longest_match(folded, i, vocab, max_len)
+            if match is not None:
+                flush(trailing=True)
+                tokens.append((match, True))
+                i += len(match)
+                after_match = True
+                continue
+            # 辞書にはないが助詞の文字を含む食材名は、割らずに分からない単語へ足す
+            word = _longest_match(folded, i, _PARTICLE_WORDS_FOLDED, _PARTICLE_WORD_MAX_LEN)
+            if word is not None:
+                unknown += chunk[i:i + len(word)]
+                i += len(word)
+                continue
+            if split_particles and chunk[i] in PARTICLES:
+                flush(trailing=False)
+                after_match = False
+                i += 1
+                continue
+            unknown += chunk[i]
+            i += 1
+        flush(trailing=True)
+    return tokens
+
+
+def normalize(text: str, vocab: dict, split_particles: bool = True) -> tuple[list[str], list[str]]:
+    """
+    入力テキストを正規化する。
+    戻り値: (正規化できた食材名リスト, 分からなかった単語リスト)
+    split_particles=False なら分からなかった単語は句読点（と辞書の単語）だけで区切る（tokenize() 参照）
+    """
+    resolved, unresolved = [], []
+    for word, known in tokenize(text, vocab, split_particles):
+        if known:
+            for name in vocab[word]:
+                if name not in resolved:
+                    resolved.append(name)
+        elif word not in NOISE_WORDS:
+            unresolved.append(word)
+    return resolved, unresolved
+
+
+def build_message(ingredients: list) -> str:
+    """Groqを使わなかったときの食材解析セリフ（1つだけのときは「と」で繋がない）"""
+    return f"{'と'.join(ingredients)}があるんだぞい！ちょっと考えてみるぞい…"
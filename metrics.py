@@ -0,0 +1,77 @@
+"""
+metrics.py
+プロセス内の簡易メトリクス（カウンター・ゲージ・分布）。
+Streamlitのスクリプトスレッドやワーカースレッドから同時に呼ばれてもいいようにロックで守る。
+アプリでは secrets.toml に METRICS_TOKEN を設定し、?metrics=<そのトークン> を付けて開くと一覧を見られる。
+"""
+
+import threading
+from collections import deque
+
+OBSERVATION_WINDOW = 1000   # 分布は直近この件数だけ保持する
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_observations = {}
+
+
+def inc(name: str, value: float = 1):
+    """カウンターを増やす"""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def set_gauge(name: str, value: float):
+    """ゲージ（現在値）を設定する"""
+    with _lock:
+        _gauges[name] = value
+
+
+def replace_gauges(prefix: str, values: dict):
+    """
+    prefix で始まるゲージを values（prefix の後ろの名前 → 値）でまるごと置き換える。
+    values に無くなった名前のゲージは消す
+    """
+    with _lock:
+        for name in [n for n in _gauges if n.startswith(prefix)]:
+            del _gauges[name]
+        for key, value in values.items():
+            _gauges[prefix + key] = value
+
+
+def observe(name: str, value: float):
+    """分布（レイテンシなど）に1件追加する"""
+    with _lock:
+        if name not in _observations:
+            _observations[name] = deque(maxlen=OBSERVATION_WINDOW)
+        _observations[name].append(value)
+
+
+def percentile(name: str, q: float, default: float = None) -> float:
+    """直近の分布から q（0〜1）分位点を返す。データがなければ default"""
+    with _lock:
+        values = sorted(_observations.get(name, ()))
+    if not values:
+        return default
+    return values[min(int(len(values) * q), len(values) - 1)]
+
+
+def snapshot() -> dict:
+    """全メトリクスの現在値をdictで返す（分布は件数・p50・p95・最大）"""
+    with _lock:
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+        observations = {k: sorted(v) for k, v in _observations.items()}
+
+    summaries = {}
+    for name, values in observations.items():
+        if not values:
+            continue
+        summaries[name] = {
+            "count": len(values),
+            "p50": values[len(values) // 2],
+            "p95": values[min(int(len(values) * 0.95), len(values) - 1)],
+            "max": values[-1],
+        }
+    return {"counters": counters, "gauges": gauges, "distributions": summaries}
@@ -0,0 +1,155 @@
+"""
+pregen_farewells.py
+お見送りセリフを料理ごとに数パターン事前生成して data/farewell_db.json に保存するスクリプト。
+お見送りセリフは料理DBの項目（料理名・本物の食材・説明文）だけで決まるので、
+アプリでは事前生成分から選ぶだけにして、Groqの呼び出しを1回減らす。
+
+使い方：
+    GROQ_API_KEY=... python pregen_farewells.py              # Groqで生成（足りない料理だけ）
+    GROQ_API_KEY=... python pregen_farewells.py --force      # 全料理を作り直す
+    python pregen_farewells.py --local --output /tmp/farewell_db.json
+                                                             # Groqなしの簡易版（動作確認用）
+--local の出力はアプリでは使わない（data/farewell_db.json には書き込めない。アプリも generator が
+"local" のファイルは読まない）。
+
+料理DBの内容が変わった料理は、ハッシュが合わなくなるので次回の実行で作り直される。
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+
+import llm_models
+import llm_scheduler
+
+RECIPE_JSON = "./data/recipe_db.json"
+FAREWELL_JSON = "./data/farewell_db.json"
+DEFAULT_VARIANTS = 3
+GROQ_REQUESTS_PER_MINUTE = 30
+GROQ_TOKENS_PER_MINUTE = 12000
+# バッチなので順番待ちで捨てない（お見送りの優先度の待ち時間の上限は対話用で短い）
+PREGEN_MAX_WAIT_SEC = math.inf
+
+# --local 用の簡易テンプレート（Groqなしで流れを確認するためのもの）
+LOCAL_TEMPLATES = [
+    "{name}、きっとおいしくできるぞい！{main}の味をしっかり楽しんでほしいぞい。またいつでも来てほしいぞい 🍳",
+    "{name}はきっと得意料理になるぞい！{main}があればまた作れるぞい。またいつでも待ってるぞい 🍳",
+    "{main}を使った{name}、楽しみだぞい！困ったらまたいつでも相談に来てほしいぞい 🍳",
+    "{name}、いい選択だぞい！{main}のおいしさがきっと伝わるぞい。また来てほしいぞい 🍳",
+]
+
+
+def load_existing(path: str, generator: str) -> dict:
+    """既存のパターン（別の作り方で作ったファイルなら使わない）"""
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+    if data.get("generator") != generator:
+        return {}
+    return data.get("recipes", {})
+
+
+def save(path: str, generator: str, recipes: dict):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"generator": generator, "recipes": recipes}, f,
+                  ensure_ascii=False, separators=(",", ":"))
+
+
+def local_variants(recipe: dict, count: int) -> list:
+    rng = random.Random(recipe["name"])
+    main = "・".join(recipe["本物の食材"][:2])
+    templates = rng.sample(LOCAL_TEMPLATES, min(count, len(LOCAL_TEMPLATES)))
+    return [t.format(name=recipe["name"], main=main) for t in templates]
+
+
+def make_groq_generator(model: str):
+    """1パターンずつGroqで生成する関数を返す（レート制限は llm_scheduler に任せる）"""
+    from groq import Groq
+
+    client = Groq(api_key=os.environ["GROQ_API_KEY"])
+    scheduler = llm_scheduler.LLMScheduler(GROQ_REQUESTS_PER_MINUTE, GROQ_TOKENS_PER_MINUTE,
+                                           max_concurrency=2)
+
+    def generate(recipe: dict) -> str:
+        prompt = llm_models.build_farewell_prompt(recipe)
+
+        def call():
+            return client.chat.completions.create(
+                model=model,
+                messages=[{"role": "user", "content": prompt}],
+                max_tokens=200,
+                temperature=0.8,
+            )
+
+        response = scheduler.submit(call, llm_scheduler.PRIORITY_FAREWELL,
+                                    est_tokens=len(prompt) + 200, max_wait=PREGEN_MAX_WAIT_SEC)
+        return response.choices[0].message.content.strip()
+
+    return generate
+
+
+def groq_variants(generate, recipe: dict, count: int, have: list) -> list:
+    variants = list(have)
+    attempts = 0
+    while len(variants) < count and attempts < count * 2:
+        attempts += 1
+        text = generate(recipe)
+        if text and text not in variants:
+            variants.append(text)
+    return variants
+
+
+def main():
+    parser = argparse.ArgumentParser(description="お見送りセリフの事前生成")
+    parser.add_argument("--variants", type=int, default=DEFAULT_VARIANTS, help="料理ごとのパターン数")
+    parser.add_argument("--output", default=FAREWELL_JSON, help="出力ファイル")
+    parser.add_argument("--model", default=llm_models.TASK_MODELS["farewell"], help="Groqのモデル名")
+    parser.add_argument("--local", action="store_true", help="Groqを使わず簡易テンプレートで作る")
+    parser.add_argument("--force", action="store_true", help="既存のパターンを捨てて作り直す")
+    args = parser.parse_args()
+    if args.local and os.path.abspath(args.output) == os.path.abspath(FAREWELL_JSON):
+        parser.error(f"--local の出力で {FAREWELL_JSON} を上書きしないよう、--output で別の場所を指定してください")
+
+    with open(RECIPE_JSON, encoding="utf-8") as f:
+        recipes = json.load(f)
+
+    generator = llm_models.FAREWELL_LOCAL_GENERATOR if args.local else f"groq:{args.model}"
+    existing = {} if args.force else load_existing(args.output, generator)
+    generate = None if args.local else make_groq_generator(args.model)
+
+    result = dict(existing)   # 途中で止まっても、まだ処理していない料理の既存分は残す
+    for i, recipe in enumerate(recipes, 1):
+        source_hash = llm_models.farewell_source_hash(recipe)
+        entry = existing.get(recipe["name"], {})
+        have = entry.get("variants", []) if entry.get("hash") == source_hash else []
+        if len(have) >= args.variants:
+            result[recipe["name"]] = {"hash": source_hash, "variants": have}
+            continue
+
+        if args.local:
+            variants = local_variants(recipe, args.variants)
+        else:
+            try:
+                variants = groq_variants(generate, recipe, args.variants, have)
+            except Exception as e:
+                print(f"  ⚠️ {recipe['name']}：生成に失敗しました（{e}）")
+                variants = have
+        if variants:
+            result[recipe["name"]] = {"hash": source_hash, "variants": variants}
+        print(f"  {i}/{len(recipes)} {recipe['name']}：{len(variants)}パターン")
+
+        # 途中で止まっても続きから再開できるよう、1料理ごとに書き出す
+        save(args.output, generator, result)
+
+    names = {r["name"] for r in recipes}
+    result = {name: entry for name, entry in result.items() if name in names}   # 消えた料理を除く
+    save(args.output, generator, result)
+    print(f"✅ {len(result)}料理ぶんのお見送りセリフを保存しました：{args.output}")
+
+
+if __name__ == "__main__":
+    main()
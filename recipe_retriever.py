@@ -0,0 +1,338 @@
+"""
+recipe_retriever.py
+料理検索の2段構え（語彙の前絞り → 保存済みの埋め込みで並べ替え）。
+
+これまでは「肉系、野菜系を使った料理」のような合成クエリを埋め込んで、コレクション全体をHNSWで
+探していた。カタログが大きくなるとここが一番重いので、
+
+・1段目：料理名・本物の食材・カテゴリ・ジャンル・調理法の語彙で BM25 を計算し、
+  スコアのある料理から上位 PREFILTER_CANDIDATES 件だけを候補にする（numpyの転置インデックス）
+・2段目：候補の埋め込みを ChromaDB から id で取り出し、クエリとのコサイン距離を計算して
+  BM25 と混ぜた距離（fused）で並べる
+とする。2段目の件数は候補数で頭打ちになるので、カタログの件数に引きずられない。
+戻り値は ChromaDB の query() と同じ形なので、search_recipes() の後段はそのまま使える。
+
+さらに、カテゴリの組ごとの料理の並び（ランキング）は CategoryRankings に覚えておく。
+カテゴリの組は順番・重複をそろえたキー（category_key()）にするので、同じ組なら同じクエリ文になる。
+build_category_rankings.py で全部の組のランキングを data/category_rankings.npz に作っておけば、
+アプリは起動時にそれを読み込み、ほとんどの検索で埋め込みを計算しない。
+除外・温度などユーザーごとの条件は、ランキングを引いたあとで ranking_results() が当てる。
+"""
+
+import math
+import os
+import threading
+from collections import OrderedDict, defaultdict
+
+import numpy as np
+
+import canonical
+from recipe_store import build_recipe_metadata, recipe_id, recipe_index
+
+# "two_stage"（語彙の前絞り＋並べ替え）か "vector"（従来どおりコレクション全体をHNSWで検索）
+RECIPE_RETRIEVER = os.environ.get("YURU_RECIPE_RETRIEVER", "two_stage")
+
+PREFILTER_CANDIDATES = 200   # 2段目に回す候補の上限
+LEXICAL_WEIGHT = 0.3         # fused距離での BM25 の重み（残りがベクトルのコサイン距離）
+BM25_K1 = 1.2
+BM25_B = 0.75
+VECTOR_FETCH_MAX = 640       # "vector" のときにコレクション全体から取る件数
+
+# カテゴリの組ごとのランキング
+CATEGORY_RANKINGS_PATH = "./data/category_rankings.npz"
+RANKING_DEPTH = 100          # 1つの組につき覚えておく件数（除外・温度で減っても足りるように）
+RANKING_MEMO_SIZE = 1024     # 事前計算にない組をプロセス内で覚えておく数
+
+
+def _bigrams(key: str) -> list:
+    return [key[i:i + 2] for i in range(len(key) - 1)] or ([key] if key else [])
+
+
+def recipe_terms(recipe: dict) -> list:
+    """料理1件の語彙（カテゴリ・食材・ジャンル・調理法は丸ごと、料理名は2文字ずつ）"""
+    terms = [f"cat:{c}" for c in recipe["使える食材カテゴリ"]]
+    for name in recipe["本物の食材"]:
+        key = canonical.canonical_key(name)
+        terms.append(f"ing:{key}")
+        terms += _bigrams(key)
+    terms += [f"genre:{recipe['ジャンル']}", f"method:{recipe['必要調理法']}"]
+    terms += _bigrams(canonical.canonical_key(recipe["name"]))
+    return terms
+
+
+def query_terms(categories: list, words: list) -> list:
+    """検索条件（カテゴリ・ユーザーの食材名）の語彙"""
+    terms = [f"cat:{c}" for c in categories]
+    for word in words:
+        key = canonical.canonical_key(word)
+        terms.append(f"ing:{key}")
+        terms += _bigrams(key)
+    return terms
+
+
+class RecipePrefilter:
+    """料理の語彙の転置インデックス（語 → 料理IDの配列・出現回数の配列）。読み込み専用"""
+
+    def __init__(self, recipes):
+        postings = defaultdict(lambda: defaultdict(int))
+        lengths, heated = [], []
+        for rid, recipe in enumerate(recipes):
+            terms = recipe_terms(recipe)
+            for term in terms:
+                postings[term][rid] += 1
+            lengths.append(len(terms))
+            heated.append(bool(recipe["加熱"]))
+
+        self.size = len(lengths)
+        self._lengths = np.asarray(lengths, dtype=np.float32)
+        self._avg_length = float(self._lengths.mean()) if self.size else 1.0
+        self._heated = np.asarray(heated, dtype=bool)
+        self._postings = {
+            term: (np.fromiter(docs.keys(), dtype=np.int32, count=len(docs)),
+                   np.fromiter(docs.values(), dtype=np.float32, count=len(docs)))
+            for term, docs in postings.items()
+        }
+
+    def __len__(self):
+        return self.size
+
+    def scores(self, categories: list, words: list) -> np.ndarray:
+        """全料理の BM25 スコア（語彙が1つも重ならない料理は0）"""
+        scores = np.zeros(self.size, dtype=np.float32)
+        counts = defaultdict(int)
+        for term in query_terms(categories, words):
+            counts[term] += 1
+        for term, qtf in counts.items():
+            posting = self._postings.get(term)
+            if posting is None:
+                continue
+            ids, tf = posting
+            idf = math.log(1 + (self.size - len(ids) + 0.5) / (len(ids) + 0.5))
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * self._lengths[ids] / self._avg_length)
+            scores[ids] += qtf * idf * tf * (BM25_K1 + 1) / (tf + norm)
+        return scores
+
+    def candidates(self, categories: list, words: list, limit: int = PREFILTER_CANDIDATES,
+                   exclude_ids=(), heated_only: bool = False) -> tuple[np.ndarray, np.ndarray]:
+        """
+        上位 limit 件の (料理IDの配列, BM25スコアの配列) を返す。
+        search_recipes() はカテゴリ一致数で先に並べるので、候補もカテゴリ一致数 → BM25 の順で選ぶ。
+        除外する料理・加熱しない料理はここで落とす（ChromaDBの where 句の代わり）
+        """
+        scores = self.scores(categories, words)
+        category_matches = np.zeros(self.size, dtype=np.float32)
+        for category in set(categories):
+            posting = self._postings.get(f"cat:{category}")
+            if posting is not None:
+                category_matches[posting[0]] += 1
+        if heated_only:
+            scores[~self._heated] = 0
+        if len(exclude_ids):
+            scores[np.asarray(list(exclude_ids), dtype=np.int64)] = 0
+
+        ids = np.flatnonzero(scores > 0)
+        order_key = category_matches[ids] * (float(scores.max(initial=0)) + 1) + scores[ids]
+        if len(ids) > limit:
+            top = np.argpartition(-order_key, limit - 1)[:limit]
+            ids, order_key = ids[top], order_key[top]
+        ids = ids[np.argsort(-order_key, kind="stable")]
+        return ids, scores[ids]
+
+
+def _empty_results() -> dict:
+    return {"ids": [[]], "distances": [[]], "metadatas": [[]]}
+
+
+def rerank(store, query: str, ids: np.ndarray, lexical_scores: np.ndarray, recipes,
+           lexical_weight: float = LEXICAL_WEIGHT, vectors=None) -> dict:
+    """
+    候補の料理を、保存済みの埋め込みとクエリのコサイン距離で並べ替える。
+    距離は (1 − lexical_weight)×コサイン距離 ＋ lexical_weight×(1 − BM25を最大1に換算した値)。
+    vectors（embedding_store.EmbeddingStore）があれば埋め込みはそこから、なければ ChromaDB から取る。
+    メタデータは料理DB（recipes）から作る
+    """
+    if len(ids) == 0:
+        return _empty_results()
+
+    query_vec = np.asarray(store.embed([query])[0], dtype=np.float32)
+    if vectors is not None:
+        rows = np.asarray(ids, dtype=np.int64)
+        keep = rows < len(vectors)   # ストアを作ったあとに増えた料理は候補にしない
+        if not keep.any():
+            return _empty_results()
+        rows, lexical = rows[keep], lexical_scores[keep] / lexical_scores.max()
+        cosine = vectors.distances(rows, query_vec)
+    else:
+        rid_of = {recipe_id(int(rid)): int(rid) for rid in ids}
+        lexical_of = dict(zip(rid_of, lexical_scores / lexical_scores.max()))
+        got = store.get(ids=list(rid_of), include=["embeddings"])
+        if len(got["ids"]) == 0:
+            return _empty_results()
+        rows = np.asarray([rid_of[doc_id] for doc_id in got["ids"]], dtype=np.int64)
+        lexical = np.asarray([lexical_of[doc_id] for doc_id in got["ids"]], dtype=np.float32)
+        query_vec /= np.linalg.norm(query_vec) or 1.0
+        embeddings = np.asarray(got["embeddings"], dtype=np.float32)
+        norms = np.linalg.norm(embeddings, axis=1)
+        cosine = 1.0 - embeddings @ query_vec / np.where(norms > 0, norms, 1.0)
+    fused = (1 - lexical_weight) * cosine + lexical_weight * (1.0 - lexical)
+
+    order = np.argsort(fused, kind="stable")
+    return {
+        "ids": [[recipe_id(int(rows[i])) for i in order]],
+        "distances": [[float(fused[i]) for i in order]],
+        "metadatas": [[build_recipe_metadata(recipes[int(rows[i])]) for i in order]],
+    }
+
+
+# ────────────────────────────
+# カテゴリの組ごとのランキング
+# ────────────────────────────
+def category_key(categories) -> str:
+    """カテゴリの組を、順番・重複に左右されないキーにする"""
+    return "、".join(sorted(set(categories)))
+
+
+def category_query(categories) -> str:
+    """ベクトル検索に使うクエリ文（同じ組なら必ず同じ文になる）"""
+    return category_key(categories) + "を使った料理"
+
+
+def rankings_config(embed_model: str, retriever: str = RECIPE_RETRIEVER,
+                    vectors: str = "chroma") -> str:
+    """
+    ランキングの作り方を表す文字列（変わったら事前計算のランキングは使わない）。
+    vectors は2段目の埋め込みの取り出し元（"chroma" か embedding_store.store_config()）
+    """
+    if retriever == "two_stage":
+        return (f"{retriever}:{embed_model}:{vectors}:"
+                f"{PREFILTER_CANDIDATES}:{LEXICAL_WEIGHT}:{RANKING_DEPTH}")
+    return f"{retriever}:{embed_model}:{VECTOR_FETCH_MAX}:{RANKING_DEPTH}"
+
+
+def _recipe_where(recipes, exclude_ids=(), heated_only: bool = False) -> dict | None:
+    """除外・温度を ChromaDB の where 句にする（条件がなければ None）"""
+    clauses = []
+    if heated_only:
+        clauses.append({"加熱": 1})
+    if len(exclude_ids):
+        clauses.append({"name": {"$nin": [recipes[int(rid)]["name"] for rid in exclude_ids]}})
+    if len(clauses) > 1:
+        return {"$and": clauses}
+    return clauses[0] if clauses else None
+
+
+def rank_categories(store, prefilter, categories, recipes, retriever: str = RECIPE_RETRIEVER,
+                    depth: int | None = RANKING_DEPTH, vectors=None,
+                    exclude_ids=(), heated_only: bool = False) -> tuple[np.ndarray, np.ndarray]:
+    """
+    カテゴリの組に対する料理のランキング（料理IDの配列, 距離の配列）を作る。
+    並びは search_recipes() と同じくカテゴリ一致数の多い順 → 距離の近い順で、一致なしの料理は含まない。
+    ふだんはユーザーの食材・除外・温度を含めない（どのユーザーでも使い回せるように）。
+    depth=None は覚えている上位が除外・温度で足りなくなったとき用で、exclude_ids・heated_only で
+    先に絞ってから、候補の件数を切らずに全部並べる（この結果は使い回さない）。
+    """
+    query = category_query(categories)
+    if retriever == "two_stage":
+        limit = PREFILTER_CANDIDATES if depth is not None else prefilter.size
+        ids, scores = prefilter.candidates(categories, [], limit=limit,
+                                           exclude_ids=exclude_ids, heated_only=heated_only)
+        results = rerank(store, query, ids, scores, recipes, vectors=vectors)
+    else:
+        fetch = VECTOR_FETCH_MAX if depth is not None else store.count()
+        results = store.query(query_texts=[query], n_results=max(min(fetch, store.count()), 1),
+                              where=_recipe_where(recipes, exclude_ids, heated_only))
+
+    wanted = set(categories)
+    ranked = []
+    for doc_id, distance in zip(results["ids"][0], results["distances"][0]):
+        rid = recipe_index(doc_id)
+        if rid >= len(recipes):
+            continue   # 料理DBにない料理（古いインデックスの残り）
+        match_count = len(wanted & set(recipes[rid]["使える食材カテゴリ"]))
+        if match_count:
+            ranked.append((-match_count, float(distance), rid))
+    ranked.sort()
+    ranked = ranked[:depth]
+    return (np.asarray([rid for _, _, rid in ranked], dtype=np.int32),
+            np.asarray([d for _, d, _ in ranked], dtype=np.float32))
+
+
+def ranking_results(ranking: tuple, recipes, exclude_ids=(), heated_only: bool = False) -> dict:
+    """ランキングにユーザーごとの条件（除外・温度）を当てて、ChromaDB の query() と同じ形にする"""
+    exclude_ids = set(exclude_ids)
+    ids, metadatas, distances = [], [], []
+    for rid, distance in zip(*ranking):
+        rid = int(rid)
+        if rid in exclude_ids or (heated_only and not recipes[rid]["加熱"]):
+            continue
+        ids.append(recipe_id(rid))
+        metadatas.append(build_recipe_metadata(recipes[rid]))
+        distances.append(float(distance))
+    return {"ids": [ids], "distances": [distances], "metadatas": [metadatas]}
+
+
+class CategoryRankings:
+    """
+    カテゴリの組（category_key()）→ ランキング の表。
+    事前計算の表（読み込み専用）と、そこにない組を覚えておくプロセス内のLRUの2段
+    """
+
+    def __init__(self, table: dict | None = None, memo_size: int = RANKING_MEMO_SIZE):
+        self._table = table or {}
+        self._memo = OrderedDict()
+        self._memo_size = memo_size
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._table)
+
+    def get(self, key: str):
+        ranking = self._table.get(key)
+        if ranking is not None:
+            return ranking
+        with self._lock:
+            ranking = self._memo.get(key)
+            if ranking is not None:
+                self._memo.move_to_end(key)
+            return ranking
+
+    def put(self, key: str, ranking: tuple):
+        with self._lock:
+            self._memo[key] = ranking
+            self._memo.move_to_end(key)
+            while len(self._memo) > self._memo_size:
+                self._memo.popitem(last=False)
+
+
+def save_rankings(path: str, rankings: dict, stamp: bytes, config: str):
+    """{キー: (料理IDの配列, 距離の配列)} を1つの npz にまとめて書き出す"""
+    keys = sorted(rankings)
+    sizes = [len(rankings[k][0]) for k in keys]
+    offsets = np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)
+    tmp = path + ".tmp.npz"
+    np.savez(
+        tmp,
+        keys=np.asarray(keys, dtype=str),
+        offsets=offsets,
+        ids=np.concatenate([rankings[k][0] for k in keys]) if keys else np.zeros(0, np.int32),
+        distances=np.concatenate([rankings[k][1] for k in keys]) if keys else np.zeros(0, np.float32),
+        stamp=np.frombuffer(stamp, dtype=np.uint8),
+        config=np.asarray(config),
+    )
+    os.replace(tmp, path)
+
+
+def load_rankings(path: str, stamp: bytes, config: str) -> dict:
+    """事前計算のランキングを読む。ないとき・料理DBや作り方が変わっているときは空の dict"""
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            if data["stamp"].tobytes() != stamp or str(data["config"]) != config:
+                return {}
+            keys, offsets = data["keys"], data["offsets"]
+            ids, distances = data["ids"], data["distances"]
+    except (OSError, KeyError, ValueError):
+        return {}
+    return {
+        str(key): (ids[offsets[i]:offsets[i + 1]], distances[offsets[i]:offsets[i + 1]])
+        for i, key in enumerate(keys)
+    }
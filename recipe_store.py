@@ -0,0 +1,341 @@
+"""
+recipe_store.py
+レシピコレクションをシャード（複数のChromaDBコレクション）に分けて扱うモジュール。
+app.py・setup_chroma.py から共通で使う。
+
+・シャードは料理IDのハッシュで振り分ける（ジャンルだと件数が偏るため）
+・検索は全シャードに並列で投げて、距離の近い順に top-k をマージする
+・登録はチャンク単位（件数と、テキスト・メタデータのバイト数の両方で区切る）で行う
+・シャード数1のときは従来どおり「recipes」コレクション1つだけになる
+"""
+
+import heapq
+import json
+import os
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+# ────────────────────────────
+# 設定
+# ────────────────────────────
+RECIPE_COLLECTION = "recipes"
+RECIPE_SCHEMA_VERSION = 4   # メタデータ・シャード形式（変えたら自動で作り直す）
+
+# シャード数（環境変数で変更できる。カタログが小さいうちは1でよい）
+RECIPE_SHARDS = int(os.environ.get("YURU_RECIPE_SHARDS", "1"))
+
+# HNSWインデックスのパラメータ（bench_hnsw.py の結果を見て決める。初期値はChromaDBの既定値）
+# ・M：ノードごとのリンク数（大きいほど recall が上がり、メモリと登録時間が増える）
+# ・construction_ef：登録時の探索幅（大きいほど良いグラフになり、登録が遅くなる）
+# ・search_ef：検索時の探索幅（大きいほど recall が上がり、検索が遅くなる。作り直さずに変えられる）
+HNSW_M = int(os.environ.get("YURU_HNSW_M", "16"))
+HNSW_CONSTRUCTION_EF = int(os.environ.get("YURU_HNSW_CONSTRUCTION_EF", "100"))
+HNSW_SEARCH_EF = int(os.environ.get("YURU_HNSW_SEARCH_EF", "100"))
+
+# 登録チャンクの上限（件数・テキストとメタデータのバイト数のどちらかに達したら書き込む）
+# 今の料理は1件1KB前後なので件数で区切られる。バイト数は説明文がとても長い料理が続いたとき用
+INGEST_CHUNK_SIZE = 1000
+INGEST_MEMORY_BUDGET_MB = 64
+
+
+# ────────────────────────────
+# ドキュメント・メタデータ生成
+# ────────────────────────────
+def build_recipe_document(recipe: dict) -> str:
+    """料理DBの1件をベクトル検索用のテキストに変換する"""
+    ingredients = "、".join(recipe["本物の食材"])
+    categories = "、".join(recipe["使える食材カテゴリ"])
+    steps = "、".join(recipe.get("加工手順", []))
+    return (
+        f"{recipe['name']}。"
+        f"ジャンル：{recipe['ジャンル']}。"
+        f"食材：{ingredients}。"
+        f"使える食材カテゴリ：{categories}。"
+        f"調理法：{recipe['必要調理法']}。"
+        f"手順：{steps}。"
+        f"{recipe['説明文']}"
+    )
+
+
+def build_recipe_metadata(recipe: dict, derived: dict = None) -> dict:
+    """
+    料理DBの1件をChromaDBのメタデータに変換する。
+    derived は catalog_compiler.index_metadata() で作った派生項目（登録するときに足す）
+    """
+    return {
+        "name": recipe["name"],
+        "ジャンル": recipe["ジャンル"],
+        "加熱": int(recipe["加熱"]),  # ChromaDBはboolを受け付けないので0/1（where句で絞り込める）
+        "必要調理法": recipe["必要調理法"],
+        "本物の食材": json.dumps(recipe["本物の食材"], ensure_ascii=False),
+        "使える食材カテゴリ": json.dumps(recipe["使える食材カテゴリ"], ensure_ascii=False),
+        "加工手順": json.dumps(recipe.get("加工手順", []), ensure_ascii=False),
+        "説明文": recipe["説明文"],
+        **(derived or {}),
+    }
+
+
+def recipe_id(index: int) -> str:
+    """料理DBの並び順から料理IDを作る"""
+    return f"recipe_{index:03d}"
+
+
+def recipe_index(doc_id: str) -> int:
+    """料理IDから料理DBの並び順に戻す（recipe_id() の逆）"""
+    return int(doc_id.rsplit("_", 1)[1])
+
+
+# ────────────────────────────
+# シャード
+# ────────────────────────────
+def shard_collection_name(shard: int, num_shards: int) -> str:
+    """シャード番号からコレクション名を作る（1シャードのときは従来の名前）"""
+    if num_shards == 1:
+        return RECIPE_COLLECTION
+    return f"{RECIPE_COLLECTION}_s{shard:02d}"
+
+
+def shard_of(doc_id: str, num_shards: int) -> int:
+    """料理IDからシャード番号を決める（プロセスをまたいでも変わらないようcrc32を使う）"""
+    return zlib.crc32(doc_id.encode("utf-8")) % num_shards
+
+
+def _merge_query_results(shard_results: list, n_results: int) -> dict:
+    """シャードごとの検索結果を、距離の近い順に n_results 件へマージする"""
+    num_queries = len(shard_results[0]["ids"]) if shard_results else 0
+    keys = [k for k in ("ids", "distances", "metadatas", "documents", "embeddings")
+            if shard_results and shard_results[0].get(k) is not None]
+
+    merged = {k: [] for k in keys}
+    for q in range(num_queries):
+        candidates = []
+        for s, res in enumerate(shard_results):
+            for i, dist in enumerate(res["distances"][q]):
+                candidates.append((dist, s, i))
+        top = heapq.nsmallest(n_results, candidates)
+        for k in keys:
+            merged[k].append([shard_results[s][k][q][i] for _, s, i in top])
+    return merged
+
+
+class ShardedCollection:
+    """
+    複数のシャードを、ChromaDBのコレクションと同じ呼び方（query / get / count / add）で扱う。
+    search_recipes() からは1つのコレクションに見える。
+    """
+
+    def __init__(self, shards: list, embedding_function, max_workers: int = None):
+        self.shards = shards
+        self.num_shards = len(shards)
+        self._embed = embedding_function
+        self._sizes = None   # シャードごとの件数（addするまで使い回す）
+        self._pool = (
+            ThreadPoolExecutor(max_workers=max_workers or self.num_shards,
+                               thread_name_prefix="recipe_shard")
+            if self.num_shards > 1 else None
+        )
+
+    def _shard_sizes(self) -> list:
+        if self._sizes is None:
+            self._sizes = [shard.count() for shard in self.shards]
+        return self._sizes
+
+    def count(self) -> int:
+        return sum(self._shard_sizes())
+
+    def query(self, query_texts: list = None, n_results: int = 10, where: dict = None,
+              query_embeddings: list = None, include: list = None) -> dict:
+        """全シャードに並列で問い合わせて、距離の近い順に n_results 件を返す"""
+        kwargs = {"n_results": n_results}
+        if where:
+            kwargs["where"] = where
+        if include is not None:
+            kwargs["include"] = include
+
+        if self.num_shards == 1:
+            if query_embeddings is None:
+                return self.shards[0].query(query_texts=query_texts, **kwargs)
+            return self.shards[0].query(query_embeddings=query_embeddings, **kwargs)
+
+        # クエリの埋め込みは1回だけ計算して全シャードで使い回す
+        if query_embeddings is None:
+            query_embeddings = [list(map(float, v)) for v in self._embed(query_texts)]
+
+        def _query_shard(shard, size):
+            # シャードの件数より多く要求するとChromaDBが警告を出すので切り詰める
+            if size == 0:
+                return None
+            return shard.query(query_embeddings=query_embeddings,
+                               **{**kwargs, "n_results": min(n_results, size)})
+
+        shard_results = [
+            r for r in self._pool.map(_query_shard, self.shards, self._shard_sizes())
+            if r is not None
+        ]
+        if not shard_results:
+            return {"ids": [[] for _ in query_embeddings],
+                    "distances": [[] for _ in query_embeddings],
+                    "metadatas": [[] for _ in query_embeddings]}
+        return _merge_query_results(shard_results, n_results)
+
+    def embed(self, texts: list) -> list:
+        """クエリを埋め込む（ストアと同じ埋め込み関数）"""
+        return self._embed(texts)
+
+    def get(self, ids: list, include: list = None) -> dict:
+        """料理IDで取り出す（IDからシャードが決まるので、該当するシャードにだけ問い合わせる）"""
+        include = ["metadatas"] if include is None else include
+        buckets = [[] for _ in self.shards]
+        for doc_id in ids:
+            buckets[shard_of(doc_id, self.num_shards)].append(doc_id)
+        merged = {"ids": [], **{k: [] for k in include}}
+        for shard, b_ids in zip(self.shards, buckets):
+            if not b_ids:
+                continue
+            res = shard.get(ids=b_ids, include=include)
+            merged["ids"] += list(res["ids"])
+            for k in include:
+                merged[k] += list(res[k])
+        return merged
+
+    def add(self, ids: list, documents: list, metadatas: list, embeddings: list = None):
+        """料理IDのハッシュでシャードに振り分けて登録する"""
+        buckets = [([], [], [], []) for _ in self.shards]
+        for i, doc_id in enumerate(ids):
+            b = buckets[shard_of(doc_id, self.num_shards)]
+            b[0].append(doc_id)
+            b[1].append(documents[i])
+            b[2].append(metadatas[i])
+            if embeddings is not None:
+                b[3].append(embeddings[i])
+        self._sizes = None
+        for shard, (b_ids, b_docs, b_metas, b_embs) in zip(self.shards, buckets):
+            if not b_ids:
+                continue
+            if embeddings is not None:
+                shard.add(ids=b_ids, documents=b_docs, metadatas=b_metas, embeddings=b_embs)
+            else:
+                shard.add(ids=b_ids, documents=b_docs, metadatas=b_metas)
+
+
+# ────────────────────────────
+# シャードを開く・作る
+# ────────────────────────────
+def hnsw_metadata(m: int = HNSW_M, construction_ef: int = HNSW_CONSTRUCTION_EF,
+                  search_ef: int = HNSW_SEARCH_EF) -> dict:
+    """コレクション作成時のHNSWの設定（料理・食材のコレクション共通）"""
+    return {
+        "hnsw:space": "cosine",
+        "hnsw:M": m,
+        "hnsw:construction_ef": construction_ef,
+        "hnsw:search_ef": search_ef,
+    }
+
+
+def apply_search_ef(collection, search_ef: int = HNSW_SEARCH_EF):
+    """
+    検索時の探索幅を設定に合わせる（search_ef はインデックスを作り直さずに変えられる）。
+    ChromaDB は読み込み済みのインデックスには反映しないので、インデックスを読み込む前（開いた直後）に呼ぶ。
+    """
+    hnsw = (collection.configuration or {}).get("hnsw") or {}
+    if hnsw.get("ef_search") != search_ef:
+        collection.modify(configuration={"hnsw": {"ef_search": search_ef}})
+
+
+def hnsw_matches(collection, m: int = HNSW_M, construction_ef: int = HNSW_CONSTRUCTION_EF) -> bool:
+    """作り直しが必要なパラメータ（M・construction_ef）が設定と同じか"""
+    meta = collection.metadata or {}
+    return (meta.get("hnsw:M", 16) == m
+            and meta.get("hnsw:construction_ef", 100) == construction_ef)
+
+
+def _store_metadata(num_shards: int) -> dict:
+    return {
+        **hnsw_metadata(),
+        "schema_version": RECIPE_SCHEMA_VERSION,
+        "num_shards": num_shards,
+    }
+
+
+def open_recipe_store(client, embedding_function, num_shards: int = RECIPE_SHARDS):
+    """
+    既存のシャードを開く。
+    形式（スキーマ・シャード数・HNSWの M / construction_ef）が違う、または欠けているときは None を返す。
+    search_ef だけが違うときは作り直さずに設定し直す。
+    """
+    existing = {c.name if hasattr(c, "name") else c for c in client.list_collections()}
+    shards = []
+    for s in range(num_shards):
+        name = shard_collection_name(s, num_shards)
+        if name not in existing:
+            return None
+        col = client.get_collection(name=name, embedding_function=embedding_function)
+        meta = col.metadata or {}
+        if (meta.get("schema_version") != RECIPE_SCHEMA_VERSION
+                or meta.get("num_shards", 1) != num_shards
+                or not hnsw_matches(col)):
+            return None
+        apply_search_ef(col)
+        shards.append(col)
+    return ShardedCollection(shards, embedding_function)
+
+
+def create_recipe_store(client, embedding_function, num_shards: int = RECIPE_SHARDS):
+    """既存のレシピコレクション（シャード含む）を全部消して、空のシャードを作る"""
+    for c in client.list_collections():
+        name = c.name if hasattr(c, "name") else c
+        if name == RECIPE_COLLECTION or name.startswith(f"{RECIPE_COLLECTION}_s"):
+            client.delete_collection(name)
+
+    shards = [
+        client.create_collection(
+            name=shard_collection_name(s, num_shards),
+            embedding_function=embedding_function,
+            metadata=_store_metadata(num_shards),
+        )
+        for s in range(num_shards)
+    ]
+    return ShardedCollection(shards, embedding_function)
+
+
+def _record_bytes(doc: str, meta: dict) -> int:
+    """1件のテキストとメタデータのバイト数（キーも含めて数える）"""
+    meta_bytes = sum(len(str(k).encode("utf-8")) + len(str(v).encode("utf-8")) for k, v in meta.items())
+    return len(doc.encode("utf-8")) + meta_bytes
+
+
+def ingest_recipes(store, recipes, chunk_size: int = INGEST_CHUNK_SIZE,
+                   memory_budget_mb: int = INGEST_MEMORY_BUDGET_MB,
+                   start_index: int = 0, on_chunk=None, derived=None) -> int:
+    """
+    料理をチャンク単位で登録する。recipes はイテレータでもよい。
+    件数が chunk_size に達するか、テキストとメタデータの合計が memory_budget_mb を超えたら書き込む。
+    on_chunk(登録済み件数) を書き込みごとに呼ぶ。戻り値は登録件数。
+    derived(料理ID番号) があれば、その戻り値（派生項目のメタデータ）をメタデータに足す。
+    """
+    budget = memory_budget_mb * 1024 * 1024
+    ids, docs, metas = [], [], []
+    used = 0
+    total = 0
+
+    def _flush():
+        nonlocal ids, docs, metas, used, total
+        if ids:
+            store.add(ids=ids, documents=docs, metadatas=metas)
+            total += len(ids)
+            if on_chunk:
+                on_chunk(total)
+        ids, docs, metas = [], [], []
+        used = 0
+
+    for i, recipe in enumerate(recipes, start=start_index):
+        doc = build_recipe_document(recipe)
+        meta = build_recipe_metadata(recipe, derived(i) if derived else None)
+        ids.append(recipe_id(i))
+        docs.append(doc)
+        metas.append(meta)
+        used += _record_bytes(doc, meta)
+        if len(ids) >= chunk_size or used >= budget:
+            _flush()
+    _flush()
+    return total
@@ -0,0 +1,127 @@
+"""
+response_cache.py
+LLMの返答を入力（キー）ごとに数パターンずつ貯めておくキャッシュ。
+
+・キーごとに最大 variants_per_key 個の返答を貯め、揃ったら以降はその中からランダムに返す
+  （同じ料理・同じ食材の組み合わせでも毎回同じセリフにならないように）
+・メモリ上はLRU（max_keys を超えたら一番使われていないキーから捨てる）
+・ディスク（SQLite）にも書いておき、プロセスを再起動しても使い回す
+"""
+
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import canonical
+import metrics
+
+
+def make_key(*parts) -> str:
+    """
+    キーの部品（dict・list・setを含んでよい）から、順番に左右されない文字列キーを作る。
+    文字列は canonical_key() でそろえる（「ネギ」と「ねぎ」は同じキーになる）
+    """
+    def normalize(value):
+        if isinstance(value, dict):
+            return sorted((canonical.canonical_key(str(k)), normalize(v)) for k, v in value.items())
+        if isinstance(value, (set, frozenset)):
+            return sorted(normalize(v) for v in value)
+        if isinstance(value, (list, tuple)):
+            return [normalize(v) for v in value]
+        if isinstance(value, str):
+            return canonical.canonical_key(value)
+        return value
+    return json.dumps([normalize(p) for p in parts], ensure_ascii=False)
+
+
+class VariantCache:
+    """
+    キー → 返答のパターン（最大 variants_per_key 個）を持つ2段キャッシュ（メモリLRU＋SQLite）。
+    get() は揃っていればランダムに1つ返し、まだ揃っていなければ None（＝呼び出し側で生成して add() する）。
+    """
+
+    def __init__(self, name: str, db_path: str = "", max_keys: int = 500,
+                 variants_per_key: int = 3, disk_max_keys: int = 20000):
+        self.name = name
+        self.max_keys = max_keys
+        self.variants_per_key = variants_per_key
+        self.disk_max_keys = disk_max_keys
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if db_path:
+            os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS variants ("
+                " cache TEXT, key TEXT, texts TEXT, last_used REAL,"
+                " PRIMARY KEY (cache, key))"
+            )
+            self._db.commit()
+
+    def _load(self, key: str) -> list:
+        """メモリ → ディスクの順に探す（ディスクにあればメモリに載せる）。ロックを持って呼ぶ"""
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return self._memory[key]
+        texts = []
+        if self._db is not None:
+            row = self._db.execute(
+                "SELECT texts FROM variants WHERE cache = ? AND key = ?", (self.name, key)
+            ).fetchone()
+            if row:
+                texts = json.loads(row[0])
+                self._db.execute(
+                    "UPDATE variants SET last_used = ? WHERE cache = ? AND key = ?",
+                    (time.time(), self.name, key),
+                )
+                self._db.commit()
+                metrics.inc(f"{self.name}.disk_hit")
+        self._memory[key] = texts
+        while len(self._memory) > self.max_keys:
+            self._memory.popitem(last=False)
+            metrics.inc(f"{self.name}.evicted")
+        return texts
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            texts = self._load(key)
+            if len(texts) < self.variants_per_key:
+                metrics.inc(f"{self.name}.miss")
+                return None
+            metrics.inc(f"{self.name}.hit")
+            return random.choice(texts)
+
+    def add(self, key: str, text: str):
+        if not text:
+            return
+        with self._lock:
+            texts = self._load(key)
+            if text in texts or len(texts) >= self.variants_per_key:
+                return
+            texts.append(text)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO variants (cache, key, texts, last_used) VALUES (?, ?, ?, ?)",
+                    (self.name, key, json.dumps(texts, ensure_ascii=False), time.time()),
+                )
+                self._prune_disk()
+                self._db.commit()
+            metrics.set_gauge(f"{self.name}.memory_keys", len(self._memory))
+
+    def _prune_disk(self):
+        """ディスクのキー数が上限を超えたら、古く使われていないものから1割消す"""
+        (count,) = self._db.execute(
+            "SELECT COUNT(*) FROM variants WHERE cache = ?", (self.name,)
+        ).fetchone()
+        if count <= self.disk_max_keys:
+            return
+        self._db.execute(
+            "DELETE FROM variants WHERE cache = ? AND key IN ("
+            " SELECT key FROM variants WHERE cache = ? ORDER BY last_used LIMIT ?)",
+            (self.name, self.name, count - self.disk_max_keys + self.disk_max_keys // 10),
+        )
@@ -2,46 +2,45 @@
 setup_chroma.py
 料理DB・食材DBをChromaDBに登録するスクリプト。
 初回セットアップ時に一度だけ実行する。
+
+埋め込みはバッチごとにワーカーのプロセスで計算する（index_build.py）。
+途中で止まったときは --resume で登録済みの分を飛ばして続きから登録できる。
+料理DB・食材DBはファイルから1件ずつ読みながら登録するので、件数が増えても読み込みのメモリは一定
+（YURU_RECIPE_JSON / YURU_INGREDIENT_JSON に .jsonl を指定すれば JSON Lines で読む）。
+
+使い方：
+    python setup_chroma.py
+    python setup_chroma.py --workers 8 --batch-size 512
+    python setup_chroma.py --resume
+    YURU_RECIPE_JSON=./data/recipe_db.jsonl python setup_chroma.py
 """
 
+import argparse
 import json
 import os
 import chromadb
-from chromadb.utils import embedding_functions
+
+import numpy as np
+
+import catalog_compiler
+import catalog_stream
+import data_pack
+import embedding_store
+import index_build
+from embedding import EMBED_MODEL, get_embedding_function
+from recipe_store import (
+    HNSW_CONSTRUCTION_EF, HNSW_M, RECIPE_SCHEMA_VERSION, RECIPE_SHARDS, build_recipe_document,
+    build_recipe_metadata, create_recipe_store, hnsw_matches, hnsw_metadata, open_recipe_store,
+    recipe_id, recipe_index,
+)
 
 # ────────────────────────────
 # 設定
 # ────────────────────────────
 CHROMA_DIR = "./chroma_db"          # ChromaDBの保存先
-RECIPE_JSON = "./data/recipe_db.json"
-INGREDIENT_JSON = "./data/ingredient_db.json"
 
-RECIPE_COLLECTION = "recipes"
 INGREDIENT_COLLECTION = "ingredients"
-
-# 埋め込みモデル（sentence-transformers の日本語対応モデル）
-EMBED_MODEL = "paraphrase-multilingual-mpnet-base-v2"
-
-
-def load_json(path: str) -> list:
-    with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)
-
-
-def build_recipe_document(recipe: dict) -> str:
-    """料理DBの1件をベクトル検索用のテキストに変換する"""
-    ingredients = "、".join(recipe["本物の食材"])
-    categories = "、".join(recipe["使える食材カテゴリ"])
-    steps = "、".join(recipe.get("加工手順", []))
-    return (
-        f"{recipe['name']}。"
-        f"ジャンル：{recipe['ジャンル']}。"
-        f"食材：{ingredients}。"
-        f"使える食材カテゴリ：{categories}。"
-        f"調理法：{recipe['必要調理法']}。"
-        f"手順：{steps}。"
-        f"{recipe['説明文']}"
-    )
+EMBED_STORE_FETCH_CHUNK = 5000      # 埋め込みストアを作るときに1回でChromaDBから取り出す件数
 
 
 def build_ingredient_document(ingredient: dict) -> str:
@@ -63,105 +62,196 @@ def build_ingredient_document(ingredient: dict) -> str:
     )
 
 
-def register_recipes(collection, recipes: list):
-    """料理DBをChromaDBに登録する"""
-    documents = []
-    metadatas = []
-    ids = []
-
-    for i, recipe in enumerate(recipes):
-        doc = build_recipe_document(recipe)
-        meta = {
-            "name": recipe["name"],
-            "ジャンル": recipe["ジャンル"],
-            "加熱": str(recipe["加熱"]),  # ChromaDBはboolを受け付けないのでstr変換
-            "必要調理法": recipe["必要調理法"],
-            "本物の食材": json.dumps(recipe["本物の食材"], ensure_ascii=False),
-            "使える食材カテゴリ": json.dumps(recipe["使える食材カテゴリ"], ensure_ascii=False),
-            "加工手順": json.dumps(recipe.get("加工手順", []), ensure_ascii=False),
-            "説明文": recipe["説明文"],
-        }
-        documents.append(doc)
-        metadatas.append(meta)
-        ids.append(f"recipe_{i:03d}")
-
-    collection.add(documents=documents, metadatas=metadatas, ids=ids)
-    print(f"  料理DB：{len(recipes)}件を登録しました")
-
-
-def register_ingredients(collection, ingredients: list):
+def build_ingredient_metadata(ingredient: dict) -> dict:
+    """食材DBの1件をChromaDBのメタデータに変換する"""
+    return {
+        "食材名": ingredient["食材名"],
+        "カテゴリ": json.dumps(ingredient["カテゴリ"], ensure_ascii=False),
+        "生食可": str(ingredient["生食可"]),  # ChromaDBはboolを受け付けないのでstr変換
+        "説明": ingredient["説明"],
+    }
+
+
+def _print_progress(done: int, elapsed: float, docs_per_sec: float):
+    print(f"    {done}件（{elapsed:.1f}秒・{docs_per_sec:.0f} docs/sec）")
+
+
+def register_recipes(store, path: str, embed_fn, args, validator) -> int:
+    """
+    料理DBをChromaDBに登録する（ファイルから1件ずつ読み、バッチごとに並列で埋め込み・シャードに振り分け）。
+    1件ずつ validator（食材DBを確認済みの CatalogValidator）で確かめ、派生項目をメタデータに入れる。
+    戻り値は料理DBの件数（登録済みで飛ばした分を含む）
+    """
+    records = (
+        (recipe_id(i), build_recipe_document(recipe),
+         build_recipe_metadata(recipe, catalog_compiler.index_metadata(validator.check_recipe(i, recipe))))
+        for i, recipe in enumerate(catalog_stream.iter_recipes(path))
+    )
+    result = index_build.build_index(
+        store, records, embed_fn, batch_size=args.batch_size, workers=args.workers,
+        resume=args.resume, on_progress=_print_progress,
+    )
+    print(f"  料理DB：{result['added']}件を登録しました（シャード数：{store.num_shards}・"
+          f"登録済みで飛ばした分：{result['skipped']}件・"
+          f"{result['added'] / max(result['seconds'], 1e-9):.0f} docs/sec）")
+    return result["added"] + result["skipped"]
+
+
+def register_ingredients(collection, path: str, embed_fn, args) -> int:
     """食材DBをChromaDBに登録する"""
-    documents = []
-    metadatas = []
-    ids = []
-
-    for i, ingredient in enumerate(ingredients):
-        doc = build_ingredient_document(ingredient)
-        meta = {
-            "食材名": ingredient["食材名"],
-            "カテゴリ": json.dumps(ingredient["カテゴリ"], ensure_ascii=False),
-            "生食可": str(ingredient["生食可"]),  # ChromaDBはboolを受け付けないのでstr変換
-            "説明": ingredient["説明"],
-        }
-        documents.append(doc)
-        metadatas.append(meta)
-        ids.append(f"ingredient_{i:03d}")
-
-    collection.add(documents=documents, metadatas=metadatas, ids=ids)
-    print(f"  食材DB：{len(ingredients)}件を登録しました")
+    records = (
+        (f"ingredient_{i:03d}", build_ingredient_document(ingredient), build_ingredient_metadata(ingredient))
+        for i, ingredient in enumerate(catalog_stream.iter_ingredients(path))
+    )
+    result = index_build.build_index(
+        collection, records, embed_fn, batch_size=args.batch_size, workers=args.workers,
+        resume=args.resume, on_progress=_print_progress,
+    )
+    print(f"  食材DB：{result['added']}件を登録しました（登録済みで飛ばした分：{result['skipped']}件）")
+    return result["added"] + result["skipped"]
+
+
+def build_state() -> dict:
+    """登録の中身を決めるもの（変わっていたら --resume でも最初から作り直す）"""
+    return {
+        "stamp": data_pack.source_stamp([data_pack.RECIPE_JSON, data_pack.INGREDIENT_JSON]).hex(),
+        "embed_model": EMBED_MODEL,
+        "schema_version": RECIPE_SCHEMA_VERSION,
+        "num_shards": RECIPE_SHARDS,
+        "hnsw": [HNSW_M, HNSW_CONSTRUCTION_EF],
+    }
+
+
+def build_embedding_store(store, count: int):
+    """
+    登録した料理の埋め込みをChromaDBからチャンクごとに取り出し、小さくして data/recipe_embeddings.npz に保存する
+    （全件の float32 は持たない。メモリは小さくしたあとのストアの大きさだけ）
+    """
+    def _fetch(start: int, end: int):
+        got = store.get(ids=[recipe_id(i) for i in range(start, end)], include=["embeddings"])
+        return [recipe_index(doc_id) for doc_id in got["ids"]], np.asarray(got["embeddings"], dtype=np.float32)
+
+    def _chunks():
+        for start in range(0, count, EMBED_STORE_FETCH_CHUNK):
+            yield _fetch(start, min(start + EMBED_STORE_FETCH_CHUNK, count))
+
+    if count == 0:
+        return
+    _, first = _fetch(0, 1)
+    dim = first.shape[1]
+    components = None
+    pca_dim = embedding_store.EMBED_STORE_PCA_DIM
+    if pca_dim and pca_dim < dim:
+        # 主成分は先頭から PCA_FIT_SAMPLE 件で求める
+        sample_end = min(count, embedding_store.PCA_FIT_SAMPLE)
+        sample = np.concatenate([
+            vectors for _, vectors in (
+                _fetch(start, min(start + EMBED_STORE_FETCH_CHUNK, sample_end))
+                for start in range(0, sample_end, EMBED_STORE_FETCH_CHUNK)
+            )
+        ])
+        components = embedding_store.fit_pca(sample, pca_dim)
+        del sample
+
+    vectors_store = embedding_store.EmbeddingStore.build_chunks(_chunks(), count, dim, components=components)
+    vectors_store.save(
+        embedding_store.EMBED_STORE_PATH,
+        data_pack.source_stamp([data_pack.RECIPE_JSON]),
+        embedding_store.store_config(EMBED_MODEL),
+    )
+    print(f"  埋め込みストア：{vectors_store.dtype}・{vectors_store.dim}次元・"
+          f"{vectors_store.nbytes / 1024:.1f}KB（float32のままなら{count * dim * 4 / 1024:.1f}KB）")
 
 
 def main():
+    parser = argparse.ArgumentParser(description="料理DB・食材DBをChromaDBに登録する")
+    parser.add_argument("--resume", action="store_true",
+                        help="前回の登録が途中で止まったとき、登録済みの分を飛ばして続きから登録する")
+    parser.add_argument("--workers", type=int, default=index_build.BUILD_WORKERS,
+                        help="埋め込みを計算するワーカーのプロセス数（0ならCPUのコア数から決める）")
+    parser.add_argument("--batch-size", type=int, default=index_build.BUILD_BATCH_SIZE,
+                        help="1回の埋め込み・書き込みの件数")
+    args = parser.parse_args()
+
     print("=" * 40)
     print("ゆるゆるコックさん ChromaDB セットアップ")
     print("=" * 40)
 
-    # JSONを読み込む
-    print("\n[1] JSONファイルを読み込み中...")
-    recipes = load_json(RECIPE_JSON)
-    ingredients = load_json(INGREDIENT_JSON)
-    print(f"  料理DB：{len(recipes)}件")
-    print(f"  食材DB：{len(ingredients)}件")
+    # 料理DB・食材DBは全体を読み込まず、登録しながら1件ずつ読む
+    # 形式は拡張子で決める（.jsonl / .ndjson は JSON Lines。アプリの data_pack.load_catalog() と同じ）
+    print("\n[1] 料理DB・食材DBを確認中...")
+    for label, path in (("料理DB", data_pack.RECIPE_JSON), ("食材DB", data_pack.INGREDIENT_JSON)):
+        fmt = catalog_stream.detect_format(path)
+        print(f"  {label}：{path}（{'JSON Lines' if fmt == 'jsonl' else 'JSON'}・"
+              f"{os.path.getsize(path) / 2 ** 20:.1f}MB）")
+
+    # 料理の確認（本物の食材が食材DBにあるか）と派生項目の計算に使うので、食材DBは先に確かめておく
+    validator = catalog_compiler.CatalogValidator()
+    for i, item in enumerate(catalog_stream.iter_ingredients(data_pack.INGREDIENT_JSON)):
+        validator.check_ingredient(i, item)
 
     # ChromaDBクライアントを作成
     print("\n[2] ChromaDBを初期化中...")
     client = chromadb.PersistentClient(path=CHROMA_DIR)
 
-    # 埋め込み関数を設定
-    embed_fn = embedding_functions.SentenceTransformerEmbeddingFunction(
-        model_name=EMBED_MODEL
-    )
-
-    # 既存のコレクションを削除（再実行時にクリーンにする）
-    for col_name in [RECIPE_COLLECTION, INGREDIENT_COLLECTION]:
+    # 埋め込み関数を設定（YURU_EMBED_SERVER があれば埋め込みサーバーを使う）
+    embed_fn = get_embedding_function()
+
+    # --resume でも、前回とデータ・設定が違えば最初から作り直す
+    state = build_state()
+    recipe_col = ingredient_col = None
+    if args.resume:
+        if index_build.load_build_state(CHROMA_DIR) == state:
+            recipe_col = open_recipe_store(client, embed_fn)
+            try:
+                ingredient_col = client.get_collection(name=INGREDIENT_COLLECTION, embedding_function=embed_fn)
+            except Exception:
+                ingredient_col = None
+            if ingredient_col is not None and not hnsw_matches(ingredient_col):
+                ingredient_col = None
+        if recipe_col is None or ingredient_col is None:
+            print("  前回の登録とデータ・設定が違うので、最初から登録し直します")
+            args.resume = False
+            recipe_col = ingredient_col = None
+        else:
+            print("  前回の登録の続きから登録します")
+
+    if recipe_col is None:
+        # 既存のコレクションを削除（再実行時にクリーンにする）
         try:
-            client.delete_collection(col_name)
-            print(f"  既存の「{col_name}」コレクションを削除しました")
+            client.delete_collection(INGREDIENT_COLLECTION)
+            print(f"  既存の「{INGREDIENT_COLLECTION}」コレクションを削除しました")
         except Exception:
             pass  # 初回は存在しないので無視
 
-    # コレクションを作成
-    recipe_col = client.create_collection(
-        name=RECIPE_COLLECTION,
-        embedding_function=embed_fn,
-        metadata={"hnsw:space": "cosine"},
-    )
-    ingredient_col = client.create_collection(
-        name=INGREDIENT_COLLECTION,
-        embedding_function=embed_fn,
-        metadata={"hnsw:space": "cosine"},
-    )
+        # コレクションを作成（レシピは既存シャードを消してから作り直す）
+        recipe_col = create_recipe_store(client, embed_fn, RECIPE_SHARDS)
+        ingredient_col = client.create_collection(
+            name=INGREDIENT_COLLECTION,
+            embedding_function=embed_fn,
+            metadata=hnsw_metadata(),
+        )
+        index_build.save_build_state(CHROMA_DIR, state)
 
     # データを登録
     print("\n[3] データを登録中...")
     print("  ※初回は埋め込みモデルのダウンロードがあるので少し時間がかかります")
-    register_recipes(recipe_col, recipes)
-    register_ingredients(ingredient_col, ingredients)
+    print(f"  ワーカー：{args.workers or index_build.default_workers()}・バッチ：{args.batch_size}件")
+    recipe_count = register_recipes(recipe_col, data_pack.RECIPE_JSON, embed_fn, args, validator)
+    register_ingredients(ingredient_col, data_pack.INGREDIENT_JSON, embed_fn, args)
 
     # 登録件数を確認
     print("\n[4] 登録件数を確認中...")
-    print(f"  recipes コレクション：{recipe_col.count()}件")
+    print(f"  recipes コレクション：{recipe_col.count()}件（シャード数：{recipe_col.num_shards}）")
     print(f"  ingredients コレクション：{ingredient_col.count()}件")
+    for line in validator.report():
+        print(f"  {line}")
+    if validator.errors:
+        print("  ※データの問題は登録を止めません。直したら python catalog_compiler.py で確認できます")
+
+    # 2段目の並べ替え用に、料理の埋め込みを小さくして保存する
+    print("\n[5] 埋め込みストアを作成中...")
+    build_embedding_store(recipe_col, recipe_count)
 
     print("\n✅ セットアップ完了だぞい！")
     print(f"   ChromaDBの保存先：{os.path.abspath(CHROMA_DIR)}")
@@ -8,25 +8,23 @@ ChromaDBのベクトル検索動作確認スクリプト。
 import json
 import re
 import chromadb
-from chromadb.utils import embedding_functions
+
+from embedding import get_embedding_function
+from recipe_store import open_recipe_store
 
 # ────────────────────────────
 # 設定
 # ────────────────────────────
 CHROMA_DIR = "./chroma_db"
-RECIPE_COLLECTION = "recipes"
 INGREDIENT_COLLECTION = "ingredients"
-EMBED_MODEL = "paraphrase-multilingual-mpnet-base-v2"
 
 
 def get_collections():
     client = chromadb.PersistentClient(path=CHROMA_DIR)
-    embed_fn = embedding_functions.SentenceTransformerEmbeddingFunction(
-        model_name=EMBED_MODEL
-    )
-    recipe_col = client.get_collection(
-        name=RECIPE_COLLECTION, embedding_function=embed_fn
-    )
+    embed_fn = get_embedding_function()
+    recipe_col = open_recipe_store(client, embed_fn)
+    if recipe_col is None:
+        raise RuntimeError("レシピDBの形式が古いぞい。setup_chroma.py を実行してほしいぞい")
     ingredient_col = client.get_collection(
         name=INGREDIENT_COLLECTION, embedding_function=embed_fn
     )
@@ -77,7 +75,7 @@ def search_recipes_by_categories(recipe_col, categories: list, n=5) -> list:
             "name": meta["name"],
             "ジャンル": meta["ジャンル"],
             "必要調理法": meta["必要調理法"],
-            "加熱": meta["加熱"] == "True",
+            "加熱": bool(meta["加熱"]),
             "本物の食材": json.loads(meta["本物の食材"]),
             "使える食材カテゴリ": recipe_categories,
             "加工手順": json.loads(meta["加工手順"]),
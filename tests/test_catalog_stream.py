@@ -0,0 +1,105 @@
+"""
+catalog_stream.py のテスト。
+バッファの境目で要素・数値・文字列が切れても正しく読めることと、壊れた配列を ValueError にすることを確かめる。
+"""
+
+import json
+import os
+import tempfile
+import unittest
+
+import catalog_stream
+from catalog_stream import iter_json_array, iter_jsonl, iter_records
+
+
+class _TempFiles(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._dir.cleanup)
+
+    def write(self, text: str, name: str = "data.json") -> str:
+        path = os.path.join(self._dir.name, name)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+        return path
+
+
+class JsonArrayChunkTest(_TempFiles):
+
+    ITEMS = [
+        {"name": "卵かけご飯", "加熱": False, "本物の食材": ["卵", "ご飯"]},
+        7.5e3,
+        -12,
+        "文字列、カンマ,と]括弧",
+        [1, [2, {"a": None}]],
+        True,
+        {"説明文": "ながい" * 20},
+    ]
+
+    def test_every_chunk_size(self):
+        # どの位置でバッファが切れても同じ結果になる
+        path = self.write("﻿ \n" + json.dumps(self.ITEMS, ensure_ascii=False, indent=1) + "\n")
+        for chunk in range(1, 64):
+            with self.subTest(chunk=chunk):
+                self.assertEqual(list(iter_json_array(path, chunk_chars=chunk)), self.ITEMS)
+
+    def test_number_split_at_chunk_end(self):
+        path = self.write("[7.5e3,12345]")
+        for chunk in range(1, 14):
+            with self.subTest(chunk=chunk):
+                self.assertEqual(list(iter_json_array(path, chunk_chars=chunk)), [7500.0, 12345])
+
+    def test_empty_array(self):
+        for text in ("[]", " [ \n ] "):
+            self.assertEqual(list(iter_json_array(self.write(text), chunk_chars=2)), [])
+
+
+class JsonArrayMalformedTest(_TempFiles):
+
+    def assertRejected(self, text: str, message: str):
+        path = self.write(text)
+        for chunk in (1, 3, catalog_stream.READ_CHUNK_CHARS):
+            with self.subTest(text=text, chunk=chunk):
+                with self.assertRaisesRegex(ValueError, message):
+                    list(iter_json_array(path, chunk_chars=chunk))
+
+    def test_missing_comma(self):
+        self.assertRejected("[1 2]", "1件目のあとにカンマがありません")
+        self.assertRejected('[{"a": 1} {"a": 2}]', "1件目のあとにカンマがありません")
+
+    def test_leading_comma(self):
+        self.assertRejected("[,1,2]", "1件目の前に余分なカンマ")
+
+    def test_doubled_comma(self):
+        self.assertRejected("[1,,2]", "2件目の前に余分なカンマ")
+
+    def test_trailing_comma(self):
+        self.assertRejected("[1,2,]", "最後に余分なカンマ")
+
+    def test_unclosed(self):
+        self.assertRejected("[1,2", "配列が閉じていません")
+        self.assertRejected("[1,", "配列が閉じていません")
+
+    def test_broken_item(self):
+        self.assertRejected('[1, {"a": ]', "2件目を読めません")
+
+    def test_not_array(self):
+        self.assertRejected('{"a": 1}', "トップレベルが配列ではありません")
+        self.assertRejected("", "トップレベルが配列ではありません")
+
+
+class JsonLinesTest(_TempFiles):
+
+    def test_lines_and_detection(self):
+        path = self.write('{"a": 1}\n\n{"a": 2}\n', name="data.jsonl")
+        self.assertEqual(list(iter_records(path)), [{"a": 1}, {"a": 2}])
+
+    def test_broken_line(self):
+        path = self.write('{"a": 1}\n{"a": \n', name="data.jsonl")
+        with self.assertRaisesRegex(ValueError, "2行目を読めません"):
+            list(iter_jsonl(path))
+
+
+if __name__ == "__main__":
+    unittest.main()
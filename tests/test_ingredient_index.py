@@ -0,0 +1,64 @@
+"""
+ingredient_index.IngredientIndex のテスト（完全一致・表記ゆれ・部分一致の採否）。
+部分一致のしきい値 TRIGRAM_MIN_SCORE で、どこまで拾ってどこから捨てるかを確かめる。
+"""
+
+import unittest
+
+from ingredient_index import TRIGRAM_MIN_SCORE, IngredientIndex, _trigram_score
+
+INGREDIENTS = [
+    {"食材名": name, "カテゴリ": categories, "生食可": False, "説明": ""}
+    for name, categories in (
+        ("鶏むね肉", ["肉系"]), ("豚バラ肉", ["肉系"]), ("じゃがいも", ["芋系"]),
+        ("そうめん", ["主食系"]), ("イカ", ["魚系"]), ("ねぎ", ["野菜系"]),
+        ("玉ねぎ", ["野菜系"]), ("ツナ缶", ["魚系"]),
+    )
+]
+
+
+class IngredientIndexTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.index = IngredientIndex(INGREDIENTS)
+
+    def name_of(self, word: str):
+        hit = self.index.lookup(word)
+        return hit and hit["食材名"]
+
+    def test_exact(self):
+        hit = self.index.lookup("鶏むね肉")
+        self.assertEqual((hit["食材名"], hit["距離"], hit["カテゴリ"]), ("鶏むね肉", 0.0, ["肉系"]))
+
+    def test_variants(self):
+        for word, name in (("ネギ", "ねぎ"), ("ﾈｷﾞ", "ねぎ"), ("たまねぎ", "玉ねぎ"),
+                           ("シーチキン", "ツナ缶"), ("いか", "イカ")):
+            with self.subTest(word=word):
+                hit = self.index.lookup(word)
+                self.assertEqual((hit["食材名"], hit["距離"]), (name, 0.0))
+
+    def test_fuzzy_accept(self):
+        for word, name in (("鶏むね", "鶏むね肉"), ("じゃがいもスライス", "じゃがいも"),
+                           ("ツナ缶詰", "ツナ缶")):
+            with self.subTest(word=word):
+                hit = self.index.lookup(word)
+                self.assertEqual(hit["食材名"], name)
+                self.assertGreater(hit["距離"], 0.0)
+                self.assertLessEqual(hit["距離"], 1 - TRIGRAM_MIN_SCORE)
+
+    def test_fuzzy_reject_below_threshold(self):
+        # 豚バラ肉との重なりは0.29しかない
+        self.assertLess(_trigram_score("豚ばらすらいす", "豚ばら肉"), TRIGRAM_MIN_SCORE)
+        for word in ("豚バラスライス", "冷蔵庫", "しめじ", "肉"):
+            with self.subTest(word=word):
+                self.assertIsNone(self.index.lookup(word))
+
+    def test_fuzzy_reject_compound(self):
+        # いか＋そうめん は重なりでは0.67あるが、そうめんにはしない
+        self.assertGreaterEqual(_trigram_score("いかそうめん", "そうめん"), TRIGRAM_MIN_SCORE)
+        self.assertIsNone(self.index.lookup("いかそうめん"))
+
+
+if __name__ == "__main__":
+    unittest.main()
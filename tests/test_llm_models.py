@@ -0,0 +1,70 @@
+"""
+llm_models.normalize_tiered のテスト（モデルの呼び出しは返答テキストを返す関数で差し替える）。
+"""
+
+import json
+import unittest
+
+import llm_models
+from llm_models import MODEL_LARGE, MODEL_SMALL, NormalizeParseError, normalize_tiered
+
+
+def _reply(ingredients: list) -> str:
+    return json.dumps({"ingredients": ingredients, "message": "あるんだぞい！"}, ensure_ascii=False)
+
+
+class _Models:
+    """モデル名 → 返答（例外なら投げる）。呼ばれたモデルを記録する"""
+
+    def __init__(self, **replies):
+        self.replies = {MODEL_SMALL: replies.get("small"), MODEL_LARGE: replies.get("large")}
+        self.calls = []
+
+    def __call__(self, model, prompt):
+        self.calls.append(model)
+        reply = self.replies[model]
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+
+class NormalizeTieredTest(unittest.TestCase):
+
+    def test_unknown_ingredient_is_not_escalated(self):
+        # 食材DBに無い食材（＝Groqに回ってくる入力）でも形がまともなら聞き直さない
+        models = _Models(small=_reply(["しめじ", "ベーコン"]))
+        result = normalize_tiered(models, "しめじとベーコン")
+        self.assertEqual(models.calls, [MODEL_SMALL])
+        self.assertEqual(result["ingredients"], ["しめじ", "ベーコン"])
+        self.assertFalse(result["escalated"])
+
+    def test_bad_shape_is_escalated(self):
+        models = _Models(small=_reply(["冷蔵庫にしめじがあります。"]), large=_reply(["しめじ"]))
+        result = normalize_tiered(models, "冷蔵庫にしめじ")
+        self.assertEqual(result["ingredients"], ["しめじ"])
+        self.assertEqual((result["model"], result["reason"]), (MODEL_LARGE, "low_confidence"))
+
+    def test_double_parse_failure_raises(self):
+        models = _Models(small="すみません", large="わかりません")
+        with self.assertRaises(NormalizeParseError):
+            normalize_tiered(models, "しめじ")
+
+    def test_escalation_error_falls_back_to_small_result(self):
+        models = _Models(small=_reply([]), large=RuntimeError("timeout"))
+        result = normalize_tiered(models, "しめじ")
+        self.assertEqual((result["ingredients"], result["model"]), ([], MODEL_SMALL))
+
+    def test_escalation_error_without_small_result_raises(self):
+        models = _Models(small="{", large=RuntimeError("timeout"))
+        with self.assertRaises(RuntimeError):
+            normalize_tiered(models, "しめじ")
+
+    def test_looks_valid(self):
+        self.assertTrue(llm_models.normalize_looks_valid(["鶏むね肉", "ツナ缶"]))
+        self.assertFalse(llm_models.normalize_looks_valid([]))
+        self.assertFalse(llm_models.normalize_looks_valid(["", "卵"]))
+        self.assertFalse(llm_models.normalize_looks_valid(["卵、牛乳"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+"""
+llm_scheduler.py のテスト。
+取り消しと「待ちすぎで捨てる」処理が入れ違っても、取り出しのスレッドが止まらないことを確かめる。
+"""
+
+import threading
+import time
+import unittest
+from concurrent.futures import Future
+from unittest import mock
+
+import llm_scheduler
+from llm_scheduler import PRIORITY_FAREWELL, PRIORITY_NORMALIZE, LLMScheduler, LLMShedError, _Job
+
+RESULT_TIMEOUT_SEC = 10
+
+
+class _CancelledWhileChecking(Future):
+    """cancelled() を見た直後に取り消しが割り込んだ状態を再現する Future"""
+
+    def cancelled(self):
+        answer = super().cancelled()
+        self.cancel()
+        return answer
+
+
+def _scheduler(**kwargs) -> LLMScheduler:
+    return LLMScheduler(requests_per_minute=6000, tokens_per_minute=10 ** 7, **kwargs)
+
+
+class CancelRaceTest(unittest.TestCase):
+
+    def test_cancel_between_check_and_shed(self):
+        scheduler = _scheduler()
+        job = _Job(lambda: "x", PRIORITY_FAREWELL, "s", 0, 0)
+        job.future = _CancelledWhileChecking()
+        with scheduler._cond:
+            scheduler._enqueue(job)
+            scheduler._remove(job, scheduler._queues[PRIORITY_FAREWELL]["s"])   # 例外にならない
+        self.assertTrue(job.future.cancelled())
+        self.assertEqual(scheduler.queue_depth(), 0)
+
+    def test_cancel_racing_max_wait_shed(self):
+        scheduler = _scheduler(max_concurrency=1, max_queue=1000)
+        gate = threading.Event()
+        blocker = scheduler.submit_async(gate.wait, PRIORITY_NORMALIZE)
+        with mock.patch.dict(llm_scheduler.MAX_WAIT_SEC, {PRIORITY_FAREWELL: 0.0}):
+            futures = [scheduler.submit_async(lambda: "x", PRIORITY_FAREWELL, f"s{i % 7}")
+                       for i in range(300)]
+            cancellers = [threading.Thread(target=lambda fs=futures[i::4]: [scheduler.cancel(f) for f in fs])
+                          for i in range(4)]
+            for t in cancellers:
+                t.start()
+            gate.set()   # 空いた枠で取り出しが始まり、待ちすぎのジョブを捨てていく
+            for t in cancellers:
+                t.join()
+            for f in futures:
+                if not f.cancelled():
+                    with self.assertRaises(LLMShedError):
+                        f.result(timeout=RESULT_TIMEOUT_SEC)
+        self.assertTrue(blocker.result(timeout=RESULT_TIMEOUT_SEC))
+        # 取り出しのスレッドが生きていれば次のジョブも通る
+        self.assertEqual(scheduler.submit_async(lambda: "ok", PRIORITY_NORMALIZE).result(timeout=RESULT_TIMEOUT_SEC), "ok")
+
+    def test_dispatch_loop_survives_error(self):
+        scheduler = _scheduler(max_concurrency=1)
+        original = scheduler._next_job
+        calls = []
+
+        def flaky():
+            if not calls:
+                calls.append(1)
+                raise RuntimeError("boom")
+            return original()
+
+        with mock.patch.object(scheduler, "_next_job", flaky):
+            first = scheduler.submit_async(lambda: "a", PRIORITY_NORMALIZE)
+            time.sleep(0.1)
+            second = scheduler.submit_async(lambda: "b", PRIORITY_NORMALIZE)
+            self.assertEqual(first.result(timeout=RESULT_TIMEOUT_SEC), "a")
+            self.assertEqual(second.result(timeout=RESULT_TIMEOUT_SEC), "b")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,39 @@
+"""
+local_normalizer.py のテスト（助詞の文字を含む単語が割れないこと）。
+"""
+
+import unittest
+
+import local_normalizer
+
+INGREDIENTS = [
+    {"食材名": name, "カテゴリ": [], "生食可": False, "説明": ""}
+    for name in ("卵", "にんじん", "もやし", "ベーコン")
+]
+
+
+class NormalizeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.vocab = local_normalizer.build_vocabulary(INGREDIENTS, [])
+
+    def normalize(self, text: str, **kwargs):
+        return local_normalizer.normalize(text, self.vocab, **kwargs)
+
+    def test_vocabulary_words_with_particles(self):
+        self.assertEqual(self.normalize("にんじんともやし"), (["にんじん", "もやし"], []))
+
+    def test_particle_words_outside_vocabulary(self):
+        self.assertEqual(self.normalize("卵とはんぺん"), (["卵"], ["はんぺん"]))
+        self.assertEqual(self.normalize("ハンペンとのり"), ([], ["ハンペン", "のり"]))
+
+    def test_fallback_splits_on_punctuation_only(self):
+        self.assertEqual(self.normalize("しめじとエリンギ、卵", split_particles=False),
+                         (["卵"], ["しめじとエリンギ"]))
+        # 辞書の単語の隣・句読点の前の助詞は落とす
+        self.assertEqual(self.normalize("ベーコンとはんぺんと、卵", split_particles=False),
+                         (["ベーコン", "卵"], ["はんぺん"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
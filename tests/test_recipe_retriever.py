@@ -0,0 +1,89 @@
+"""
+recipe_retriever.rank_categories のテスト。
+除外・温度で覚えている上位（RANKING_DEPTH 件）が全部落ちても、並べ直せば n 件そろうことを確かめる。
+"""
+
+import unittest
+import zlib
+
+import chromadb
+import numpy as np
+from chromadb.api.types import EmbeddingFunction
+
+import recipe_retriever
+from recipe_retriever import RANKING_DEPTH, rank_categories, ranking_results
+from recipe_store import create_recipe_store, ingest_recipes
+
+NUM_RECIPES = 400
+WANTED = 5
+CATEGORIES = ["肉系", "野菜系"]
+
+
+class HashEmbedding(EmbeddingFunction):
+    """文字列のハッシュから決まる小さいベクトル（モデルを読み込まずに済ませる）"""
+
+    def __init__(self):
+        pass
+
+    def __call__(self, input):
+        return [np.random.default_rng(zlib.crc32(text.encode("utf-8"))).random(8).astype(np.float32)
+                for text in input]
+
+    @staticmethod
+    def name() -> str:
+        return "test_hash"
+
+    def get_config(self) -> dict:
+        return {}
+
+    @staticmethod
+    def build_from_config(config):
+        return HashEmbedding()
+
+
+def _recipes() -> list:
+    return [
+        {
+            "name": f"料理{i}", "ジャンル": "和食", "加熱": i % 2 == 0,
+            "本物の食材": ["豚肉", "キャベツ"], "使える食材カテゴリ": CATEGORIES[:1 + i % 2],
+            "必要調理法": "焼く", "説明文": f"説明{i}", "加工手順": [],
+        }
+        for i in range(NUM_RECIPES)
+    ]
+
+
+class DeepRankingTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.recipes = _recipes()
+        client = chromadb.EphemeralClient()
+        cls.store = create_recipe_store(client, HashEmbedding(), num_shards=1)
+        ingest_recipes(cls.store, cls.recipes)
+        cls.prefilter = recipe_retriever.RecipePrefilter(cls.recipes)
+
+    def check(self, retriever: str):
+        shallow = rank_categories(self.store, self.prefilter, CATEGORIES, self.recipes, retriever=retriever)
+        self.assertEqual(len(shallow[0]), RANKING_DEPTH)
+        # 覚えている上位を全部除外し、さらに温度でも絞る
+        exclude_ids = [int(rid) for rid in shallow[0]]
+        short = ranking_results(shallow, self.recipes, exclude_ids, heated_only=True)
+        self.assertLess(len(short["ids"][0]), WANTED)
+
+        deep = rank_categories(self.store, self.prefilter, CATEGORIES, self.recipes, retriever=retriever,
+                               depth=None, exclude_ids=exclude_ids, heated_only=True)
+        results = ranking_results(deep, self.recipes, exclude_ids, heated_only=True)
+        self.assertGreaterEqual(len(results["ids"][0]), WANTED)
+        self.assertEqual(len(deep[0]), NUM_RECIPES // 2 - len([r for r in exclude_ids if r % 2 == 0]))
+        self.assertFalse(set(int(r) for r in deep[0]) & set(exclude_ids))
+        self.assertTrue(all(self.recipes[int(r)]["加熱"] for r in deep[0]))
+
+    def test_two_stage(self):
+        self.check("two_stage")
+
+    def test_vector(self):
+        self.check("vector")
+
+
+if __name__ == "__main__":
+    unittest.main()